@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio engine of VideoThumbGenerator (ENGINE='asyncio')
+
+ffmpeg children are awaited from a single process with a semaphore limiting
+the number of them in flight, only the matplotlib compositing goes to a small
+process pool, admitted under the memory budget (see VideoThumbMemory). Every
+disk has its own files and ffmpeg limit (DATA['device_limits']), so NWORKERS
+is only the CPU limit of compositing. Kept in its own module so that asyncio is only imported when this engine is used.
+
+The event loop runs in a background thread and results are handed to the
+caller through a bounded queue, so a slow consumer stops new files from being
+started.
+"""
+
+import os
+import os.path
+import time
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from VideoThumbGenerator import duration_command,frame_command,frames_command,candidate_files,parse_metadata,make_thumbnail_from_files,thumbnail_row,new_result,finish_result,check_thumbnail
+from VideoThumbMemory import MemoryBudget,estimate_job_memory,measured_call
+from VideoThumbProfile import profiled_call
+
+async def run_ffmpeg_async(cmd):
+    process = await asyncio.create_subprocess_exec(*cmd,stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout,stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    return str(stderr)
+
+async def process_file_async(k,DATA,semaphore,executor,budget,condition,device):
+    """Same as thumbnail_job, returns a result dict. ffmpeg runs hold semaphore and the device semaphore."""
+
+    start_time = time.time()
+
+    #---------------------------
+    output = DATA['alloutfiles'][k]
+    INPUT_FILE = DATA['allfiles'][k]
+    THUMBFOLDER = DATA['THUMBFOLDER']
+    TIMEPOINTS = DATA['TIMEPOINTS']
+    FFMPEG_PATH = DATA['FFMPEG_PATH']
+    SIZE = DATA['SIZE']
+    ENCODER = DATA['ENCODER']
+    CANDIDATES = DATA['CANDIDATES']
+    STEP = DATA['CANDIDATE_STEP']
+    #---------------------------
+
+    outfile = THUMBFOLDER + os.sep + output
+    result = new_result(k,INPUT_FILE,outfile)
+
+    async with device, semaphore:
+        probe = await run_ffmpeg_async(duration_command(INPUT_FILE,FFMPEG_PATH))
+    metadata = parse_metadata(probe)
+    duration,width,height = metadata['duration'],metadata['width'],metadata['height']
+    result['duration'] = duration
+
+    if duration<5:
+        result['error'] = 'zero duration' if duration==0 else 'too short'
+        return finish_result(result,start_time)
+
+    if os.path.isfile(outfile) and check_thumbnail(outfile) is None:
+        result['row'] = thumbnail_row(THUMBFOLDER,output,INPUT_FILE,metadata)
+        result['status'] = 'old'
+        return finish_result(result,start_time)
+
+    points = [round(duration*x) for x in TIMEPOINTS]
+    outputs = [candidate_files('%s.%i.jpg' % (outfile,i),CANDIDATES) for i in range(len(points))]
+    frame_files = [x[1] for x in outputs]
+
+    try:
+        # one ffmpeg run for all frames, the ones it could not write are tried one at a time
+        async with device, semaphore:
+            await run_ffmpeg_async(frames_command(points,INPUT_FILE,[x[0] for x in outputs],FFMPEG_PATH,CANDIDATES,STEP))
+            for point,files in zip(points,frame_files):
+                if not any(os.path.isfile(file) for file in files):
+                    await run_ffmpeg_async(frame_command(point,INPUT_FILE,files[0],FFMPEG_PATH))
+
+        base = estimate_job_memory(width,height,len(points),SIZE,CANDIDATES=CANDIDATES)
+        async with condition:
+            estimate = budget.estimate(base)
+            await condition.wait_for(lambda: budget.fits(estimate))
+            budget.acquire(estimate)
+        loop = asyncio.get_running_loop()
+        try:
+            args = (make_thumbnail_from_files,frame_files,points,INPUT_FILE,outfile,SIZE,ENCODER,STEP)
+            if 'PROFILE_DIR' in DATA:
+                args = (profiled_call,DATA['PROFILE_DIR']) + args
+            hashes,peak = await loop.run_in_executor(executor,measured_call,*args)
+        finally:
+            async with condition:
+                budget.release(estimate)
+                condition.notify_all()
+    except asyncio.CancelledError:
+        # frames are normally removed by make_thumbnail_from_files
+        for files in frame_files:
+            for file in files:
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+        raise
+
+    if hashes is None:
+        result['error'] = 'snapshot failed'
+        return finish_result(result,start_time)
+
+    result['row'] = thumbnail_row(THUMBFOLDER,output,INPUT_FILE,metadata,hashes)
+    result['status'] = 'done'
+    result['memory'] = peak
+    budget.observe(base,peak)
+
+    return finish_result(result,start_time)
+
+async def process_files_async(DATA,FFMPEG_JOBS,NWORKERS,BUDGET,results):
+    """Puts results into the asyncio queue results, None when all are done"""
+
+    semaphore = asyncio.Semaphore(FFMPEG_JOBS)
+    budget = MemoryBudget(BUDGET)
+    condition = asyncio.Condition()
+    devices = DATA.get('devices') or [None]*len(DATA['allfiles'])
+    limits = DATA.get('device_limits') or {}
+    files = {} # device -> iterator of its files, largest first
+    for k in DATA.get('order',range(len(DATA['allfiles']))):
+        files.setdefault(devices[k],[]).append(k)
+    files = {device:iter(x) for device,x in files.items()}
+    semaphores = {device:asyncio.Semaphore(limits.get(device,FFMPEG_JOBS)) for device in files}
+
+    async def worker(executor,device):
+        # up to FFMPEG_JOBS files of each device in flight, a full results queue holds the workers
+        for k in files[device]:
+            try:
+                result = await process_file_async(k,DATA,semaphore,executor,budget,condition,semaphores[device])
+            except Exception as inst:
+                result = new_result(k,DATA['allfiles'][k],DATA['THUMBFOLDER'] + os.sep + DATA['alloutfiles'][k])
+                result['error'] = str(inst)
+            await results.put(result)
+
+    with ProcessPoolExecutor(max_workers=max(1,NWORKERS)) as executor:
+        await asyncio.gather(*[worker(executor,device) for device in files
+                               for _ in range(max(1,min(FFMPEG_JOBS,limits.get(device,FFMPEG_JOBS))))])
+    print(budget.summary())
+    await results.put(None)
+
+def iter_async(DATA,FFMPEG_JOBS,NWORKERS,BUDGET=None):
+    """Yields result dicts as they finish, closing the iterator cancels the rest"""
+
+    loop = asyncio.new_event_loop()
+    results = asyncio.Queue(maxsize=max(1,FFMPEG_JOBS))
+    task = loop.create_task(process_files_async(DATA,FFMPEG_JOBS,NWORKERS,BUDGET,results))
+
+    async def cancel():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=loop.run_forever,daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = asyncio.run_coroutine_threadsafe(results.get(),loop).result()
+            if result is None:
+                break
+            yield result
+    finally:
+        asyncio.run_coroutine_threadsafe(cancel(),loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
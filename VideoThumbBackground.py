@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Background generation
+
+Long runs started from the viewer or cron should not make the workstation
+unusable, so a run can
+    - lower the CPU and I/O priority of its process, the workers and ffmpeg
+      children started after it inherit it (nice and the idle I/O class of
+      ionice on Linux, nice on other POSIX systems, idle priority class on
+      Windows)
+    - cap its throughput (videos per minute) and CPU use (share of all cores,
+      estimated from the wall time of the jobs). Finished results are held
+      back, which keeps new jobs from starting.
+    - pause while OUTPATH/MyVideoThumbs.paused exists. The catalogs are written
+      when a pause starts, so a paused run that is killed is resumed from the
+      finished thumbnails by the next run.
+"""
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import subprocess
+
+PAUSE_NAME = 'MyVideoThumbs.paused'
+NICE = 15
+POLL = 1.0 # seconds between checks of the pause file while paused
+
+def lower_priority():
+    """Lowers CPU and I/O priority of this process and its future children, returns what was done"""
+
+    done = []
+    if os.name=='nt':
+        import ctypes
+        IDLE_PRIORITY_CLASS = 0x40
+        kernel32 = ctypes.windll.kernel32
+        if kernel32.SetPriorityClass(kernel32.GetCurrentProcess(),IDLE_PRIORITY_CLASS):
+            done.append('idle priority class')
+        return done
+
+    try:
+        if os.getpriority(os.PRIO_PROCESS,0)<NICE:
+            os.setpriority(os.PRIO_PROCESS,0,NICE)
+        done.append('nice %i' % os.getpriority(os.PRIO_PROCESS,0))
+    except OSError:
+        pass
+    ionice = shutil.which('ionice')
+    if sys.platform.startswith('linux') and ionice is not None:
+        if subprocess.call([ionice,'-c','3','-p',str(os.getpid())],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)==0:
+            done.append('idle I/O class')
+    return done
+
+def pause_file(OUTPATH):
+    return OUTPATH + os.sep + PAUSE_NAME
+
+def pause(OUTPATH):
+    """Pauses runs into OUTPATH (also ones started later) until resume()"""
+    with open(pause_file(OUTPATH),'w') as f:
+        f.write('%i\n' % os.getpid())
+
+def resume(OUTPATH):
+    try:
+        os.remove(pause_file(OUTPATH))
+    except FileNotFoundError:
+        pass
+
+class Governor(object):
+    """
+    Paces a run: wait(result) is called with every result and returns when the
+    next job may start
+    """
+
+    def __init__(self,OUTPATH,MAX_RATE=None,CPU_LIMIT=None,NCPU=None):
+
+        self.pause_file = pause_file(OUTPATH)
+        self.MAX_RATE = MAX_RATE # videos per minute, None for no cap
+        self.CPU_LIMIT = CPU_LIMIT # share of all cores (0-1), None for no cap
+        self.NCPU = NCPU or os.cpu_count() or 1
+        self.start = time.time()
+        self.count = 0
+        self.busy = 0.0 # seconds of job time
+
+    def delay(self):
+        """Seconds to hold before the caps allow the next job"""
+        elapsed = time.time()-self.start
+        delay = 0.0
+        if self.MAX_RATE:
+            delay = max(delay,self.count*60.0/self.MAX_RATE - elapsed)
+        if self.CPU_LIMIT:
+            delay = max(delay,self.busy/(self.CPU_LIMIT*self.NCPU) - elapsed)
+        return delay
+
+    def paused(self):
+        return os.path.exists(self.pause_file)
+
+    def wait(self,result,checkpoint=None):
+        """checkpoint() is called when a pause starts"""
+
+        if result['status'] != 'reused':
+            self.count += 1
+            self.busy += result['elapsed']
+
+        while True:
+            if self.paused():
+                print('... paused, remove %s to resume' % self.pause_file)
+                if checkpoint is not None:
+                    checkpoint()
+                start_time = time.time()
+                while self.paused():
+                    time.sleep(POLL)
+                # no burst of held back jobs after the pause
+                self.start += time.time()-start_time
+                print('... resumed')
+            delay = self.delay()
+            if delay<=0:
+                return
+            time.sleep(min(delay,POLL))
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for VideoThumbGenerator
+
+USAGE:
+    python VideoThumbBenchmark.py engines INFOLDER [FFMPEG_PATH]
+    python VideoThumbBenchmark.py importtime
+    python VideoThumbBenchmark.py encoders
+    python VideoThumbBenchmark.py decode
+    python VideoThumbBenchmark.py schedule
+
+Every benchmark writes into a fresh temporary OUTPATH so that no old
+thumbnails are reused. The importtime benchmark exits with status 1 if a
+startup budget is exceeded or a module does not import.
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+
+MB = 1 << 20
+
+def timed_run(INFOLDER,**kwargs):
+    """Run the generator into an empty OUTPATH, returns elapsed seconds"""
+    from VideoThumbGenerator import VideoThumbGenerator
+
+    OUTPATH = tempfile.mkdtemp(prefix='videothumb_bench_')
+    try:
+        obj = VideoThumbGenerator(OUTPATH=OUTPATH,INFOLDER=INFOLDER,**kwargs)
+        start_time = time.time()
+        obj.run()
+        return time.time()-start_time
+    finally:
+        shutil.rmtree(OUTPATH,ignore_errors=True)
+
+def bench_engines(INFOLDER,FFMPEG_PATH='',levels=(2,4,8,16,32)):
+    """multiprocessing.Pool engine against the asyncio engine at several concurrency levels"""
+
+    results = []
+    for level in levels:
+        elapsed = timed_run(INFOLDER,FFMPEG_PATH=FFMPEG_PATH,ENGINE='pool',NWORKERS=level)
+        results.append(('pool',level,elapsed))
+        elapsed = timed_run(INFOLDER,FFMPEG_PATH=FFMPEG_PATH,ENGINE='asyncio',FFMPEG_JOBS=level,NWORKERS=max(1,os.cpu_count()//2))
+        results.append(('asyncio',level,elapsed))
+
+    print('\nengine    concurrency  seconds')
+    for engine,level,elapsed in results:
+        print('%-9s %11i  %7.2f' % (engine,level,elapsed))
+
+    return results
+
+def jpg(QUALITY,SUBSAMPLING='4:2:0',PROGRESSIVE=False,OPTIMIZE=True):
+    return {'FORMAT':'jpg','QUALITY':QUALITY,'PROGRESSIVE':PROGRESSIVE,'OPTIMIZE':OPTIMIZE,'SUBSAMPLING':SUBSAMPLING}
+
+ENCODER_SETTINGS = (
+    ('matplotlib default',None),
+    ('jpg q90 4:4:4',jpg(90,'4:4:4')),
+    ('jpg q80 4:2:0',jpg(80)),
+    ('jpg q80 4:2:0 not optimized',jpg(80,OPTIMIZE=False)),
+    ('jpg q80 4:2:0 progressive',jpg(80,PROGRESSIVE=True)),
+    ('jpg q65 4:2:0',jpg(65)),
+    ('webp q80',{'FORMAT':'webp','QUALITY':80,'PROGRESSIVE':False,'OPTIMIZE':False,'SUBSAMPLING':'4:2:0'}),
+    )
+
+def synthetic_frames(N_FRAMES=3,seed=0):
+    """Smooth random 640x360 frames with some noise, compress roughly like video content"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(N_FRAMES):
+        coarse = rng.random((18,32,3))
+        img = np.kron(coarse,np.ones((20,20,1)))
+        img = np.clip(img + rng.normal(0,0.03,img.shape),0,1)
+        frames.append(img.astype(np.float32))
+    return frames
+
+def decode_time(file,repeats):
+    """Seconds per full decode, with wx (as the viewer does) when available, otherwise with PIL"""
+    try:
+        import wx
+        app = wx.App(False)
+        load = lambda: wx.Image(file)
+    except ImportError:
+        from PIL import Image
+        load = lambda: Image.open(file).load()
+    start_time = time.time()
+    for _ in range(repeats):
+        load()
+    return (time.time()-start_time)/repeats
+
+def bench_encoders(settings=ENCODER_SETTINGS,N=10,SIZE=17):
+    """Bytes per thumbnail, compositing+encode time and decode time of each encoder setting"""
+    from VideoThumbGenerator import make_thumbnail
+
+    OUTPATH = tempfile.mkdtemp(prefix='videothumb_bench_')
+    results = []
+    try:
+        for name,ENCODER in settings:
+            ext = '.jpg' if ENCODER is None else '.' + ENCODER['FORMAT']
+            sizes = []
+            elapsed = 0.0
+            for k in range(N):
+                frames = synthetic_frames(seed=k)
+                outfile = OUTPATH + os.sep + 'thumb_%i%s' % (k,ext)
+                start_time = time.time()
+                make_thumbnail(frames,[10,20,30],'benchmark video %i' % k,outfile,SIZE,ENCODER)
+                elapsed += time.time()-start_time
+                sizes.append(os.path.getsize(outfile))
+            results.append((name,sum(sizes)/N,1000*elapsed/N,1000*decode_time(outfile,N)))
+    finally:
+        shutil.rmtree(OUTPATH,ignore_errors=True)
+
+    print('\n%-28s %10s %14s %10s' % ('encoder','bytes','compose+enc ms','decode ms'))
+    for name,size,encode,decode in results:
+        print('%-28s %10i %14.1f %10.1f' % (name,size,encode,decode))
+
+    return results
+
+def cell_width(SCREEN_WIDTH):
+    """Thumbnail width the viewer paints on a screen SCREEN_WIDTH pixels wide"""
+    WIDTH = round(SCREEN_WIDTH*0.80)
+    return (WIDTH-70-65)-10-2
+
+def paint_functions():
+    """(full decode, reduced decode) functions of path, width, height like the viewer paints them"""
+    try:
+        import wx
+        from VideoThumbViewer import load_bitmap,scale_bitmap
+        app = wx.App(False)
+        return (lambda path,w,h: scale_bitmap(wx.Bitmap(path),w,h)),load_bitmap
+    except ImportError:
+        # no wx, the same steps with PIL (LANCZOS in place of wx.IMAGE_QUALITY_HIGH)
+        from PIL import Image
+        def full(path,w,h):
+            return Image.open(path).convert('RGB').resize((w,h),Image.LANCZOS)
+        def reduced(path,w,h):
+            image = Image.open(path)
+            image.draft('RGB',(w,h))
+            return image.convert('RGB').resize((w,h),Image.BILINEAR)
+        return full,reduced
+
+def bench_decode(screens=(1024,1280,1920,2560,3840),SIZES=(17,34),N=20):
+    """Paint time of one thumbnail cell with full and DCT-reduced JPEG decoding"""
+    from VideoThumbGenerator import make_thumbnail
+    from get_image_size import get_image_size
+    from PIL import Image
+
+    full,reduced = paint_functions()
+    OUTPATH = tempfile.mkdtemp(prefix='videothumb_bench_')
+    results = []
+    try:
+        for SIZE in SIZES:
+            outfile = OUTPATH + os.sep + 'thumb_%i.jpg' % SIZE
+            make_thumbnail(synthetic_frames(),[10,20,30],'benchmark video',outfile,SIZE,jpg(80))
+            W,H = get_image_size(outfile)
+            for screen in screens:
+                w = cell_width(screen)
+                h = max(1,round(w*H/W))
+                image = Image.open(outfile)
+                image.draft('RGB',(w,h))
+                times = []
+                for paint in (full,reduced):
+                    start_time = time.time()
+                    for _ in range(N):
+                        paint(outfile,w,h)
+                    times.append(1000*(time.time()-start_time)/N)
+                results.append(('%ix%i' % (W,H),screen,'%ix%i' % (w,h),'1/%i' % round(W/image.size[0]),times[0],times[1]))
+    finally:
+        shutil.rmtree(OUTPATH,ignore_errors=True)
+
+    print('\n%-10s %7s %10s %6s %9s %9s %8s' % ('thumbnail','screen','cell','scale','full ms','DCT ms','speedup'))
+    for thumb,screen,cell,scale,t_full,t_reduced in results:
+        print('%-10s %7i %10s %6s %9.1f %9.1f %7.1fx' % (thumb,screen,cell,scale,t_full,t_reduced,t_full/max(t_reduced,1e-6)))
+
+    return results
+
+def synthetic_corpus(N=400,seed=0):
+    """
+    (file size, job seconds) of a mixed library in walk order: mostly short
+    clips, some episodes and a few long high resolution films. Job time follows
+    size only roughly, as bitrates differ.
+    """
+    import random
+
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(N):
+        kind = rng.random()
+        if kind<0.80:
+            size,seconds = rng.uniform(5,80)*MB,rng.uniform(0.5,2.0)
+        elif kind<0.97:
+            size,seconds = rng.uniform(200,900)*MB,rng.uniform(3.0,8.0)
+        else:
+            size,seconds = rng.uniform(4000,20000)*MB,rng.uniform(20.0,60.0)
+        corpus.append((size,seconds*rng.uniform(0.7,1.3)))
+    return corpus
+
+def makespan(seconds,order,NWORKERS):
+    """Finish time of the last job when jobs start in order on the first free worker"""
+    import heapq
+
+    workers = [0.0]*NWORKERS
+    for k in order:
+        heapq.heapreplace(workers,workers[0] + seconds[k])
+    return max(workers)
+
+def bench_schedule(levels=(2,4,8,16),seeds=range(5)):
+    """Simulated makespan of walk order against largest file first on synthetic corpora"""
+
+    results = []
+    for NWORKERS in levels:
+        walk,lpt,bound = 0.0,0.0,0.0
+        for seed in seeds:
+            corpus = synthetic_corpus(seed=seed)
+            sizes = [x[0] for x in corpus]
+            seconds = [x[1] for x in corpus]
+            walk += makespan(seconds,range(len(corpus)),NWORKERS)
+            lpt += makespan(seconds,sorted(range(len(corpus)),key=lambda k: -sizes[k]),NWORKERS)
+            bound += max(sum(seconds)/NWORKERS,max(seconds))
+        results.append((NWORKERS,walk/len(seeds),lpt/len(seeds),bound/len(seeds)))
+
+    print('\n%8s %10s %10s %10s %8s' % ('workers','walk s','largest s','bound s','gain'))
+    for NWORKERS,walk,lpt,bound in results:
+        print('%8i %10.1f %10.1f %10.1f %7.0f%%' % (NWORKERS,walk,lpt,bound,100*(walk-lpt)/walk))
+
+    return results
+
+# cold import budgets in milliseconds, and modules that must not be imported
+IMPORT_BUDGETS = {
+    'VideoThumbCatalog': 50,
+    'VideoThumbGenerator': 150,
+    'VideoThumbViewer': 1000,
+    }
+IMPORT_FORBIDDEN = ('matplotlib','asyncio')
+
+def import_report(module):
+    """
+    Import module in a fresh interpreter with -X importtime.
+    Returns (cumulative ms of module, [(ms, name) of its direct imports], names of all imported modules)
+    """
+
+    cmd = [sys.executable,'-X','importtime','-c','import %s' % module]
+    process = subprocess.run(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE,cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode(errors='replace'))
+
+    # lines are 'import time: self [us] | cumulative | name', nesting is two spaces per level
+    entries = []
+    for line in process.stderr.decode(errors='replace').split('\n'):
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        level = (len(name)-len(name.lstrip()))//2
+        entries.append((level,int(parts[1])/1000.0,name.strip()))
+
+    # children are listed before their parent
+    total = 0.0
+    children = []
+    names = set()
+    for i,(level,ms,name) in enumerate(entries):
+        if level==0 and name==module:
+            total = ms
+            for j in range(i-1,-1,-1):
+                if entries[j][0]==0:
+                    break
+                names.add(entries[j][2])
+                if entries[j][0]==1:
+                    children.append((entries[j][1],entries[j][2]))
+            break
+
+    children.sort(reverse=True)
+    return total,children,names
+
+def bench_import_time(budgets=IMPORT_BUDGETS,forbidden=IMPORT_FORBIDDEN):
+    """Import time summary of the main modules, returns False if a budget is exceeded or a module could not be measured"""
+
+    ok = True
+    for module,budget in budgets.items():
+        try:
+            total,entries,names = import_report(module)
+        except RuntimeError as inst:
+            # a module that does not import (e.g. no wx here) is not within its budget either
+            print('\n%s: import failed, NOT MEASURED\n  %s' % (module,str(inst).strip().split('\n')[-1]))
+            ok = False
+            continue
+        bad = set(name.split('.')[0] for name in names if name.split('.')[0] in forbidden)
+        status = 'OK'
+        if total>budget or len(bad)>0:
+            status = 'OVER BUDGET'
+            ok = False
+        print('\n%s: %.1f ms (budget %i ms) %s' % (module,total,budget,status))
+        for ms,name in entries[:8]:
+            print('  %8.1f ms  %s' % (ms,name))
+        if len(bad)>0:
+            print('  forbidden imports: %s' % ', '.join(sorted(bad)))
+
+    return ok
+
+if __name__ == '__main__':
+    __spec__ = "ModuleSpec(name='builtins', loader=<class '_frozen_importlib.BuiltinImporter'>)"
+    if len(sys.argv)>1 and sys.argv[1] == 'encoders':
+        bench_encoders()
+        sys.exit(0)
+    if len(sys.argv)>1 and sys.argv[1] == 'decode':
+        bench_decode()
+        sys.exit(0)
+    if len(sys.argv)>1 and sys.argv[1] == 'schedule':
+        bench_schedule()
+        sys.exit(0)
+    if len(sys.argv)>1 and sys.argv[1] == 'importtime':
+        sys.exit(0 if bench_import_time() else 1)
+    if len(sys.argv)<3 or sys.argv[1] != 'engines':
+        print(__doc__)
+        sys.exit(2)
+    bench_engines(sys.argv[2],FFMPEG_PATH=sys.argv[3] if len(sys.argv)>3 else '')
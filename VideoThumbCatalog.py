@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of MyVideoThumbs.dat catalogs
+
+Thumbnails are stored in a single folder (OUTPATH/thumbnails) that does not
+depend on the duration buckets. Buckets are only computed when catalogs are
+written, so changing OUTTIMES is a rewrite of a few text files instead of
+re-extracting every thumbnail that moves to another bucket.
+
+Catalog files are '|' separated text, one video per row. Newer files start
+with a '#' header row naming the fields, older ones have the 4 legacy fields.
+
+Incremental updates (watch mode) also append to a change journal next to the
+master catalog, '+' rows are added or replaced videos and '-' rows are removed
+video paths. An open viewer follows the journal instead of reloading.
+"""
+
+import os
+import os.path
+from bisect import bisect_right
+
+CATALOG_NAME = 'MyVideoThumbs.dat'
+JOURNAL_NAME = 'MyVideoThumbs.changes'
+THUMB_FOLDER = 'thumbnails'
+LEGACY_FIELDS = ('folder','name','video','duration')
+# width and height are the thumbnail size, video_width and video_height the frame size of the video
+CATALOG_FIELDS = LEGACY_FIELDS + ('phash','size','mtime','width','height','copies','codec','fps','bitrate','video_width','video_height')
+
+def get_folder_index(duration,OUTTIMES):
+    """Bucket index of a duration (seconds), OUTTIMES are sorted boundaries in seconds"""
+    return bisect_right(OUTTIMES,duration)
+
+def get_outfolders(OUTPATH,OUTTIMES):
+    """Bucket folder names for sorted OUTTIMES (in minutes)"""
+    if len(OUTTIMES)==0:
+        return [OUTPATH]
+    OUTFOLDER = ['' for _ in range(len(OUTTIMES)+1)]
+    OUTFOLDER[0] = OUTPATH + os.sep + 'less_than_%imin' % OUTTIMES[0]
+    for i in range(1,len(OUTTIMES)):
+        OUTFOLDER[i] = OUTPATH + os.sep + 'between_%imin_and_%imin' % (OUTTIMES[i-1],OUTTIMES[i])
+    OUTFOLDER[len(OUTTIMES)] = OUTPATH + os.sep + 'over_%imin' % OUTTIMES[-1]
+    return OUTFOLDER
+
+def is_bucket_folder(name):
+    return name.startswith('less_than_') or name.startswith('between_') or name.startswith('over_')
+
+def read_catalog(filename):
+    """Returns catalog rows as a list of dicts (field name -> string)"""
+
+    rows = []
+    fields = LEGACY_FIELDS
+
+    with open(filename,'r',encoding='utf8') as file:
+        data = file.read()
+
+    for d in data.split('\n'):
+        if len(d)==0:
+            continue
+        if d[0]=='#':
+            fields = tuple(d[1:].split('|'))
+            continue
+        dd = d.split('|')
+        if len(dd)==len(fields):
+            rows.append(dict(zip(fields,dd)))
+        else:
+            print('Incorrect row format %s\n' % d)
+
+    return rows
+
+def write_catalog(filename,rows):
+
+    lines = ['#' + '|'.join(CATALOG_FIELDS)]
+    for row in rows:
+        lines.append(row_to_line(row))
+
+    # write to a temporary file first, a crash must not leave a truncated catalog
+    with open(filename + '.tmp','w',encoding='utf8') as file:
+        file.write('\n'.join(lines))
+    os.replace(filename + '.tmp',filename)
+
+def write_catalogs(OUTPATH,rows,OUTTIMES):
+    """
+    Write the master catalog into OUTPATH and one catalog per duration bucket.
+    OUTTIMES are bucket separations in minutes. Catalogs of buckets that are no
+    longer in use are removed.
+    """
+
+    OUTTIMES = sorted(set(round(x) for x in OUTTIMES))
+    OUTFOLDER = get_outfolders(OUTPATH,OUTTIMES)
+    OUTSECONDS = [x*60 for x in OUTTIMES]
+
+    rows_sorted = [[] for _ in range(len(OUTFOLDER))]
+    for row in rows:
+        rows_sorted[get_folder_index(float(row['duration']),OUTSECONDS)].append(row)
+
+    if OUTFOLDER != [OUTPATH]:
+        write_catalog(OUTPATH + os.sep + CATALOG_NAME,rows)
+        print('... textfile written: %s' % (OUTPATH + os.sep + CATALOG_NAME))
+
+    for i,folder_rows in enumerate(rows_sorted):
+        if not os.path.isdir(OUTFOLDER[i]):
+            os.makedirs(OUTFOLDER[i])
+        filename = OUTFOLDER[i] + os.sep + CATALOG_NAME
+        write_catalog(filename,folder_rows)
+        print('... textfile written: %s' % filename)
+
+    # stale buckets from earlier OUTTIMES
+    for name in os.listdir(OUTPATH):
+        folder = OUTPATH + os.sep + name
+        if is_bucket_folder(name) and folder not in OUTFOLDER and os.path.isdir(folder):
+            if os.path.isfile(folder + os.sep + CATALOG_NAME):
+                os.remove(folder + os.sep + CATALOG_NAME)
+            if len(os.listdir(folder))==0:
+                os.rmdir(folder)
+
+def read_known_rows(OUTPATH):
+    """
+    Rows of earlier runs, keyed by video path. Falls back to per-bucket catalogs
+    of the old layout where thumbnails were stored inside the bucket folders.
+    """
+
+    known = {}
+    filenames = []
+    if os.path.isfile(OUTPATH + os.sep + CATALOG_NAME):
+        filenames.append(OUTPATH + os.sep + CATALOG_NAME)
+    elif os.path.isdir(OUTPATH):
+        for name in os.listdir(OUTPATH):
+            if is_bucket_folder(name) and os.path.isfile(OUTPATH + os.sep + name + os.sep + CATALOG_NAME):
+                filenames.append(OUTPATH + os.sep + name + os.sep + CATALOG_NAME)
+
+    for filename in filenames:
+        try:
+            for row in read_catalog(filename):
+                known[row['video']] = row
+        except Exception as inst:
+            print('Warning: Failed to read %s (%s)' % (filename,inst))
+
+    return known
+
+def rebucket(OUTPATH,OUTTIMES):
+    """
+    Recompute duration buckets of an existing catalog without regenerating
+    thumbnails. An OUTPATH of the old layout (bucket catalogs only) is migrated,
+    its thumbnails are moved into OUTPATH/thumbnails.
+    """
+
+    THUMBFOLDER = OUTPATH + os.sep + THUMB_FOLDER
+    if not os.path.isdir(THUMBFOLDER):
+        os.makedirs(THUMBFOLDER)
+
+    rows = list(read_known_rows(OUTPATH).values())
+    for row in rows:
+        oldfile = row['folder'] + os.sep + row['name']
+        if os.path.abspath(row['folder']) == os.path.abspath(THUMBFOLDER) or not os.path.isfile(oldfile):
+            continue
+        name,ext = os.path.splitext(row['name'])
+        k = 0
+        while os.path.exists(THUMBFOLDER + os.sep + row['name']):
+            # same name in two bucket folders
+            k += 1
+            row['name'] = '%s_%i%s' % (name,k,ext)
+        os.replace(oldfile,THUMBFOLDER + os.sep + row['name'])
+        row['folder'] = THUMBFOLDER
+
+    write_catalogs(OUTPATH,rows,OUTTIMES)
+    return len(rows)
+
+def row_to_line(row):
+    return '|'.join(str(row.get(field,'')) for field in CATALOG_FIELDS)
+
+def append_changes(OUTPATH,added,removed):
+
+    if len(added)==0 and len(removed)==0:
+        return
+    lines = ['-' + video for video in removed] + ['+' + row_to_line(row) for row in added]
+    with open(OUTPATH + os.sep + JOURNAL_NAME,'a',encoding='utf8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def clear_changes(OUTPATH):
+    """A full run rewrites the catalogs, earlier changes are included there"""
+    if os.path.isfile(OUTPATH + os.sep + JOURNAL_NAME):
+        os.remove(OUTPATH + os.sep + JOURNAL_NAME)
+
+def read_changes(filename,offset=0):
+    """
+    Changes after byte offset. Returns (added rows, removed video paths, new offset),
+    an incomplete last line is left for the next call.
+    """
+
+    added = []
+    removed = []
+    if not os.path.isfile(filename):
+        return added,removed,0
+    if os.path.getsize(filename)<offset:
+        offset = 0 # journal was cleared and started again
+
+    with open(filename,'rb') as file:
+        file.seek(offset)
+        data = file.read()
+    end = data.rfind(b'\n')+1
+    for d in data[:end].decode('utf8').split('\n'):
+        if d[:1]=='-':
+            removed.append(d[1:])
+        elif d[:1]=='+':
+            dd = d[1:].split('|')
+            # rows of an older version lack the last fields
+            if len(LEGACY_FIELDS)<=len(dd)<=len(CATALOG_FIELDS):
+                added.append(dict(zip(CATALOG_FIELDS,dd)))
+
+    return added,removed,offset+end
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived generation service
+
+Every run of VideoThumbGenerator pays for starting the interpreter, importing
+matplotlib and spawning the worker pool. The daemon keeps one pool of warm
+workers (matplotlib already imported) and takes jobs over a local socket, so
+the viewer and cron jobs only send a request.
+
+USAGE:
+    python VideoThumbDaemon.py serve [--workers N] [--background]
+    python VideoThumbDaemon.py submit INFOLDER OUTPATH [VIDEO ...]
+    python VideoThumbDaemon.py status [JOB]
+    python VideoThumbDaemon.py cancel JOB
+    python VideoThumbDaemon.py shutdown
+
+Requests and replies are single JSON lines. A folder job is a full run of
+INFOLDER into OUTPATH, a job with videos is an update of only those files.
+Jobs run one at a time. A submit that is already covered by a queued or
+running job of the same OUTPATH returns that job instead of a new one, and
+video lists submitted for the same OUTPATH are merged while queued.
+
+With --background the daemon and its workers run at the lowest CPU and I/O
+priority (see VideoThumbBackground).
+
+A Unix socket in the home folder is used, or a localhost TCP port where Unix
+sockets are not available (Windows).
+"""
+
+import os
+import os.path
+import sys
+import json
+import socket
+import socketserver
+import threading
+from collections import deque
+
+SOCKET_PATH = os.path.expanduser('~' + os.sep + '.videothumb.sock')
+TCP_ADDRESS = ('127.0.0.1',47631)
+UNIX = hasattr(socket,'AF_UNIX') and hasattr(socketserver,'ThreadingUnixStreamServer')
+
+def warm_worker():
+    """Pool initializer, imports what every job needs once per worker"""
+    from VideoThumbMemory import worker_group
+    worker_group()
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import VideoThumbHash
+
+def is_inside(path,folder):
+    return path==folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+class JobQueue(object):
+
+    def __init__(self,NWORKERS,FFMPEG_PATH=''):
+        from multiprocessing import Pool
+
+        self.NWORKERS = NWORKERS
+        self.FFMPEG_PATH = FFMPEG_PATH
+        self.pool = Pool(processes=NWORKERS,initializer=warm_worker)
+        self.jobs = {}
+        self.queue = deque()
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.worker,daemon=True)
+        self.thread.start()
+
+    def covering_job(self,INFOLDER,OUTPATH,files):
+        """Active job of OUTPATH that already does this request, None if there is none"""
+        for job in self.jobs.values():
+            if job['state'] not in ('queued','running') or job['OUTPATH'] != OUTPATH:
+                continue
+            if job['files'] is None:
+                # a full run covers everything, files only if it has not scanned yet
+                if files is None and job['INFOLDER']==INFOLDER:
+                    return job
+                if files is not None and job['state']=='queued' and all(is_inside(x,job['INFOLDER']) for x in files):
+                    return job
+            elif files is not None:
+                if set(files) <= set(job['files']):
+                    return job
+                if job['state']=='queued':
+                    job['files'] += [x for x in files if x not in job['files']]
+                    return job
+        return None
+
+    def submit(self,INFOLDER,OUTPATH,files=None):
+        INFOLDER = os.path.abspath(INFOLDER)
+        OUTPATH = os.path.abspath(OUTPATH)
+        if files is not None:
+            files = [os.path.abspath(x) for x in files]
+        with self.condition:
+            job = self.covering_job(INFOLDER,OUTPATH,files)
+            if job is not None:
+                job['clients'] += 1
+                return self.info(job)
+            self.counter += 1
+            job = {'job':self.counter,'INFOLDER':INFOLDER,'OUTPATH':OUTPATH,'files':files,'state':'queued',
+                   'done':0,'failed':0,'total':0 if files is None else len(files),'error':None,'clients':1,'cancel':False}
+            self.jobs[job['job']] = job
+            self.queue.append(job)
+            self.condition.notify_all()
+            return self.info(job)
+
+    def info(self,job):
+        return {key:value for key,value in job.items() if key != 'cancel'}
+
+    def status(self,job=None):
+        with self.condition:
+            if job is None:
+                return {'jobs':[self.info(x) for x in self.jobs.values()]}
+            if job not in self.jobs:
+                return {'error':'unknown job %s' % job}
+            return self.info(self.jobs[job])
+
+    def cancel(self,job):
+        with self.condition:
+            if job not in self.jobs:
+                return {'error':'unknown job %s' % job}
+            job = self.jobs[job]
+            job['cancel'] = True
+            if job['state']=='queued':
+                self.queue.remove(job)
+                job['state'] = 'cancelled'
+            return self.info(job)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            for job in self.jobs.values():
+                job['cancel'] = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.pool.terminate()
+
+    def progress(self,job,result):
+        with self.condition:
+            job['total'] = self.generator.total
+            if result['status'] != 'failed':
+                job['done'] += 1
+            else:
+                job['failed'] += 1
+            return not job['cancel']
+
+    def worker(self):
+        from VideoThumbGenerator import VideoThumbGenerator
+
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.queue)==0:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                job = self.queue.popleft()
+                job['state'] = 'running'
+
+            self.generator = VideoThumbGenerator(INFOLDER=job['INFOLDER'],OUTPATH=job['OUTPATH'],FFMPEG_PATH=self.FFMPEG_PATH,
+                                                 NWORKERS=self.NWORKERS,POOL=self.pool)
+            try:
+                if job['files'] is None:
+                    self.generator.run(progress=lambda result: self.progress(job,result))
+                else:
+                    rows,removed = self.generator.update(created=job['files'])
+                    with self.condition:
+                        job['done'] = len(rows)
+                        job['failed'] = len(job['files'])-len(rows)
+                state = 'cancelled' if job['cancel'] else 'done'
+            except Exception as inst:
+                job['error'] = str(inst)
+                state = 'failed'
+            with self.condition:
+                job['state'] = state
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode('utf8'))
+            reply = self.server.dispatch(request)
+        except Exception as inst:
+            reply = {'error':str(inst)}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf8'))
+
+def make_server(queue,ADDRESS=None):
+
+    if UNIX:
+        ADDRESS = ADDRESS or SOCKET_PATH
+        if os.path.exists(ADDRESS):
+            try:
+                request({'command':'status'},ADDRESS)
+                raise OSError('a daemon is already running at %s' % ADDRESS)
+            except (ConnectionError,FileNotFoundError):
+                os.remove(ADDRESS) # left over from a crash
+        server = socketserver.ThreadingUnixStreamServer(ADDRESS,RequestHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(ADDRESS or TCP_ADDRESS,RequestHandler)
+    server.daemon_threads = True
+
+    def dispatch(request):
+        command = request.get('command')
+        if command=='submit':
+            return queue.submit(request['INFOLDER'],request['OUTPATH'],request.get('files'))
+        if command=='status':
+            return queue.status(request.get('job'))
+        if command=='cancel':
+            return queue.cancel(request['job'])
+        if command=='shutdown':
+            threading.Thread(target=server.shutdown).start()
+            return {'state':'shutting down'}
+        return {'error':'unknown command %s' % command}
+
+    server.dispatch = dispatch
+    return server
+
+def serve(NWORKERS=3,FFMPEG_PATH='',ADDRESS=None,BACKGROUND=False):
+    if BACKGROUND:
+        # before the pool, workers inherit the priority
+        from VideoThumbBackground import lower_priority
+        print('... background mode: %s' % (', '.join(lower_priority()) or 'priority unchanged'))
+    queue = JobQueue(NWORKERS,FFMPEG_PATH)
+    server = make_server(queue,ADDRESS)
+    print('... generation daemon listening at %s with %i workers' % (server.server_address,NWORKERS))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        queue.stop()
+        if UNIX and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+
+def request(message,ADDRESS=None,timeout=10.0):
+    """Sends a request dict to the daemon, returns the reply. Raises OSError if no daemon runs."""
+
+    if UNIX:
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        ADDRESS = ADDRESS or SOCKET_PATH
+    else:
+        sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        ADDRESS = ADDRESS or TCP_ADDRESS
+    sock.settimeout(timeout)
+    with sock:
+        sock.connect(ADDRESS)
+        sock.sendall((json.dumps(message) + '\n').encode('utf8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(1 << 16)
+            if len(chunk)==0:
+                break
+            data += chunk
+    return json.loads(data.decode('utf8'))
+
+def submit(INFOLDER,OUTPATH,files=None,ADDRESS=None):
+    """Job info dict, None if no daemon is running"""
+    try:
+        return request({'command':'submit','INFOLDER':INFOLDER,'OUTPATH':OUTPATH,'files':files},ADDRESS)
+    except OSError:
+        return None
+
+def main(argv=None):
+    import optparse
+
+    prs = optparse.OptionParser(usage=__doc__.split('USAGE:')[1].split('\n\n')[0])
+    prs.add_option('--workers',dest='nworkers',type='int',default=3)
+    prs.add_option('--ffmpeg',dest='ffmpeg_path',default='',help='folder of the ffmpeg executable')
+    prs.add_option('--background',dest='background',action='store_true',default=False,help='lowest CPU and I/O priority')
+    argv = list(argv) if argv is not None else sys.argv[1:]
+    (opts, args) = prs.parse_args(args=argv)
+    if len(args)==0:
+        prs.error("You must give a command")
+
+    command = args[0]
+    if command=='serve':
+        serve(opts.nworkers,opts.ffmpeg_path,BACKGROUND=opts.background)
+        return 0
+    if command=='submit' and len(args)>=3:
+        reply = request({'command':'submit','INFOLDER':args[1],'OUTPATH':args[2],'files':args[3:] or None})
+    elif command=='status':
+        reply = request({'command':'status','job':int(args[1]) if len(args)>1 else None})
+    elif command=='cancel' and len(args)==2:
+        reply = request({'command':'cancel','job':int(args[1])})
+    elif command=='shutdown':
+        reply = request({'command':'shutdown'})
+    else:
+        prs.error("Unknown command or arguments")
+    print(json.dumps(reply,indent=1))
+    return 1 if 'error' in reply else 0
+
+if __name__ == '__main__':
+    __spec__ = "ModuleSpec(name='builtins', loader=<class '_frozen_importlib.BuiltinImporter'>)"
+    sys.exit(main(argv=sys.argv[1:]))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Decoding of a video in one session with PyAV (optional, pip install av)
+
+With the ffmpeg executable a video takes two runs, one to probe its duration
+and stream metadata and one that extracts the frames of all timepoints
+(frames_command), which opens the video as a separate input per timepoint.
+With PyAV the frames of all timepoints are decoded by seeking in one session,
+and a job without probed metadata reads it from the same container. The pool
+engine probes videos ahead of their jobs (for memory admission), so there a
+video is opened twice, for the probe and for the frames.
+"""
+
+class VideoReader(object):
+    """Open video, metadata() as parse_metadata of VideoThumbGenerator and frames(points) as RGB arrays"""
+
+    def __init__(self,INFILE):
+        import av
+        import av.logging
+
+        # errors come with the exception, the log would only repeat them on stderr
+        av.logging.set_level(av.logging.PANIC)
+        self.container = av.open(INFILE)
+        if len(self.container.streams.video)==0:
+            self.container.close()
+            raise ValueError('no video stream')
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+
+    def metadata(self):
+        import av
+
+        container,stream = self.container,self.stream
+        if container.duration is not None:
+            duration = container.duration/av.time_base
+        elif stream.duration is not None:
+            duration = float(stream.duration*stream.time_base)
+        else:
+            duration = 0
+        rate = stream.average_rate or stream.guessed_rate
+        return {'duration':duration,'width':stream.codec_context.width,'height':stream.codec_context.height,
+                'codec':stream.codec_context.name,'fps':float(rate) if rate else 0.0,
+                'bitrate':(container.bit_rate or 0)//1000}
+
+    def candidates(self,point,CANDIDATES=1,STEP=1.0):
+        """
+        Frames at or after point, point+STEP, ... (seconds from the start) as
+        RGB arrays, decoded in one pass after one seek. Fewer if the video ends
+        before, the last frame if it ends before point.
+        """
+
+        stream = self.stream
+        start = stream.start_time or 0
+        targets = [start + int((point + j*STEP)/stream.time_base) for j in range(CANDIDATES)]
+        # seeks to the keyframe before the point and decodes up to it, like ffmpeg -ss
+        self.container.seek(targets[0],stream=stream)
+        frames = []
+        frame = None
+        for frame in self.container.decode(stream):
+            if frame.pts is None or frame.pts>=targets[len(frames)]:
+                frames.append(frame.to_ndarray(format='rgb24'))
+                if len(frames)==len(targets):
+                    break
+        if len(frames)==0 and frame is not None:
+            frames.append(frame.to_ndarray(format='rgb24'))
+        return frames
+
+    def frames(self,points,CANDIDATES=1,STEP=1.0):
+        """Best candidate frames of points and their times (see choose_frame), None for frames if one failed"""
+        from VideoThumbGenerator import choose_frame
+
+        img = []
+        times = []
+        for point in points:
+            frame,chosen = choose_frame(self.candidates(point,CANDIDATES,STEP),point,STEP)
+            if frame is None or frame.shape[0]<=10 or frame.shape[1]<=10:
+                return None,times
+            img.append(frame)
+            times.append(chosen)
+        return img,times
+
+    def close(self):
+        self.container.close()
@@ -7,47 +7,107 @@ Created on Wed Nov 22 12:26:27 2017
 
 import os
 import os.path
+import sys
+import re
 import subprocess
-import matplotlib.pyplot as plt
-import matplotlib.image as Image
-from functools import partial
-from multiprocessing import Pool
-import matplotlib.patheffects as PathEffects
+import hashlib
 import time
+from get_image_size import get_image_size,UnknownImageFormat
+from VideoThumbCatalog import THUMB_FOLDER,get_outfolders,read_known_rows,write_catalogs,rebucket,append_changes,clear_changes
 
-def get_video_frames(points,INFILE,TEMP_FILE,FFMPEG_PATH):
+def ffmpeg_command(FFMPEG_PATH):
+    return [FFMPEG_PATH + ('ffmpeg.exe' if os.name=='nt' else 'ffmpeg')]
 
-    img = []
+def frame_command(point,INFILE,TEMP_FILE,FFMPEG_PATH):
+    return ffmpeg_command(FFMPEG_PATH) + ['-y','-ss','%i' % point,'-i',INFILE,'-vframes','1',TEMP_FILE]
 
+def frames_command(points,INFILE,OUTPUTS,FFMPEG_PATH,CANDIDATES=1,STEP=1.0):
+    """
+    One ffmpeg run for all points, the video is an input per point and each
+    writes one frame, or CANDIDATES frames STEP seconds apart into the numbered
+    OUTPUTS of candidate_files
+    """
+    cmd = ffmpeg_command(FFMPEG_PATH) + ['-y']
     for point in points:
+        cmd += ['-ss','%i' % point,'-i',INFILE]
+    for i,OUTPUT in enumerate(OUTPUTS):
+        cmd += ['-map','%i:V:0' % i]
+        if CANDIDATES>1:
+            cmd += ['-vf','fps=%g' % (1.0/STEP)]
+        cmd += ['-frames:v','%i' % CANDIDATES,OUTPUT]
+    return cmd
 
-        cmd = '%sffmpeg.exe -y -ss %i -i "%s" -vframes 1 "%s"' % (FFMPEG_PATH,point,INFILE,TEMP_FILE)
-        subprocess.run(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        #process.wait()
+def candidate_files(TEMP_FILE,CANDIDATES=1):
+    """frames_command output for one point and the files it writes"""
+    if CANDIDATES<=1:
+        return TEMP_FILE,[TEMP_FILE]
+    name,ext = os.path.splitext(TEMP_FILE)
+    # a numbered pattern for ffmpeg, a % of the name is written as %%
+    return name.replace('%','%%') + '.%d' + ext,['%s.%i%s' % (name,j+1,ext) for j in range(CANDIDATES)]
 
-        try:
-            img.append(Image.imread(TEMP_FILE))
-            if os.path.isfile(TEMP_FILE):
-                os.remove(TEMP_FILE)
-            assert(img[-1].shape[0]>10 and img[-1].shape[1]>10)
-        except:
-            if os.path.isfile(TEMP_FILE):
-                os.remove(TEMP_FILE)
-            return None
+def choose_frame(frames,point,STEP=1.0):
+    """Best of the candidate frames of point (see VideoThumbQuality) and its time, None if all failed"""
+    if len(frames)==1:
+        return frames[0],point
+    from VideoThumbQuality import best_frame
+    j = best_frame(frames)
+    if j is None:
+        return None,point
+    return frames[j],point + j*STEP
+
+def duration_command(INFILE,FFMPEG_PATH):
+    return ffmpeg_command(FFMPEG_PATH) + ['-i',INFILE,'-f','null']
+
+def run_ffmpeg(cmd):
+    """stderr of an ffmpeg run as text"""
+    profile = sys.modules.get('VideoThumbProfile')
+    if profile is not None and profile.JOB is not None:
+        # profiled job, bytes read by ffmpeg are counted
+        return profile.run_counted(cmd)
+    process = subprocess.run(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    return str(process.stderr)
+
+def read_frame(TEMP_FILE):
+    import matplotlib.image as Image
+
+    try:
+        img = Image.imread(TEMP_FILE)
+        assert(img.shape[0]>10 and img.shape[1]>10)
+    except:
+        img = None
+    if os.path.isfile(TEMP_FILE):
+        os.remove(TEMP_FILE)
 
     return img
 
-def get_sec(time_str):
-    h, m, s = time_str.split(':')
-    return int(h)*3600 + int(m)*60 + int(float(s))
+def get_video_frames(points,INFILE,TEMP_FILE,FFMPEG_PATH,CANDIDATES=1,STEP=1.0):
+    """Frames of points and their times (a later candidate may be chosen), None for frames if one failed"""
 
-def get_video_duration(INFILE,FFMPEG_PATH):
+    outputs = [candidate_files('%s.%i.jpg' % (TEMP_FILE,i),CANDIDATES) for i in range(len(points))]
+    run_ffmpeg(frames_command(points,INFILE,[x[0] for x in outputs],FFMPEG_PATH,CANDIDATES,STEP))
 
-    cmd = '%sffmpeg.exe -i "%s" -f null' % (FFMPEG_PATH,INFILE)
-    process = subprocess.run(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    #process.wait()
+    img = []
+    times = []
+
+    for point,(_,files) in zip(points,outputs):
+
+        frame,chosen = choose_frame([read_frame(file) for file in files],point,STEP)
+        if frame is None:
+            # frames the fused run could not write are tried one at a time
+            run_ffmpeg(frame_command(point,INFILE,TEMP_FILE,FFMPEG_PATH))
+            frame,chosen = read_frame(TEMP_FILE),point
+        img.append(frame)
+        times.append(chosen)
+
+    if any(i is None for i in img):
+        return None,times
+    return img,times
+
+def get_sec(time_str):
+    h, m, s = time_str.split(':')
+    return int(h)*3600 + int(m)*60 + float(s)
 
-    b = str(process.stderr)#.readlines())
+def parse_duration(b):
 
     ind = b.find('Duration: ')
 
@@ -60,62 +120,78 @@ def get_video_duration(INFILE,FFMPEG_PATH):
 
     return duration
 
-def get_folder_index(duration,OUTFOLDERS,OUTTIMES):
+def video_stream(b):
+    """Line of the first video stream that is not cover art, '' if not found"""
 
-    folder_index = None
-    if duration<OUTTIMES[0]:
-        folder_index=0
-    elif duration>=OUTTIMES[-1]:
-        folder_index = len(OUTFOLDERS)-1
-    else:
-        for i in range(len(OUTTIMES)-1):
-            if duration>=OUTTIMES[i] & duration<OUTTIMES[i+1]:
-                folder_index=i+1                
-                
-    return folder_index
+    # b is the text of the stderr bytes, its line breaks are \n escapes
+    for match in re.finditer(r'Video: (.*?)(?:\\n|\n|$)',b):
+        if 'attached pic' not in match.group(1):
+            return match.group(1)
+    return ''
 
+def parse_resolution(b):
+    """Frame size of the first video stream, (0,0) if not found"""
 
-def process_file(k,DATA):
-    
-    #---------------------------    
-    output = DATA['alloutfiles'][k]
-    INPUT_FILE = DATA['allfiles'][k]
-    OUTFOLDER = DATA['OUTFOLDER']
-    OUTTIMES = DATA['OUTTIMES']
-    TIMEPOINTS = DATA['TIMEPOINTS']
-    FFMPEG_PATH = DATA['FFMPEG_PATH']
-    SIZE = DATA['SIZE']    
-    #---------------------------        
-    
-    textfiles = []
-        
-    duration = get_video_duration(INPUT_FILE,FFMPEG_PATH)
-
-    if duration<5:
-        #failed_files[k] = 1
-        if duration==0:
-            print('... FAILED (zero duration) %s' % INPUT_FILE)
-        else:
-            print('... FAILED (too short) %s' % INPUT_FILE)
-        return textfiles
+    match = re.search(r'\b(\d{2,5})x(\d{2,5})\b',video_stream(b))
+    if match is None:
+        return 0,0
+    return int(match.group(1)),int(match.group(2))
 
-    folder_index = get_folder_index(duration, OUTFOLDER, OUTTIMES)
+def parse_metadata(b):
+    """
+    Duration (seconds), width, height, codec, fps and bitrate (kb/s, of the
+    file) of the first video stream, zeros and '' for what was not found
+    """
 
-    outfile = OUTFOLDER[folder_index] + os.sep + output
-    
-    if os.path.isfile(outfile):
-        textfiles = (folder_index, (OUTFOLDER[folder_index] + ';' + output + ';' + INPUT_FILE))
-        print('... DONE (old found) %s' % INPUT_FILE)
-        return textfiles
+    metadata = {'duration':parse_duration(b),'codec':'','fps':0.0,'bitrate':0}
+    metadata['width'],metadata['height'] = parse_resolution(b)
+    stream = video_stream(b)
+    match = re.match(r'\w+',stream)
+    if match is not None:
+        metadata['codec'] = match.group(0)
+    match = re.search(r', ([\d.]+) fps',stream)
+    if match is not None:
+        metadata['fps'] = float(match.group(1))
+    match = re.search(r'bitrate: (\d+) kb/s',b)
+    if match is not None:
+        metadata['bitrate'] = int(match.group(1))
+    return metadata
 
-    points = [round(duration*x) for x in TIMEPOINTS]
+def get_video_duration(INFILE,FFMPEG_PATH):
 
-    img = get_video_frames(points,INPUT_FILE,outfile,FFMPEG_PATH)
+    return parse_duration(run_ffmpeg(duration_command(INFILE,FFMPEG_PATH)))
 
-    if img is None:
-        #failed_files[k] = 1
-        print('... FAILED (snapshot failed) %s' % INPUT_FILE)
-        return textfiles
+def probe_metadata(INFILE,FFMPEG_PATH,DECODER='ffmpeg'):
+    """Metadata of a video (see parse_metadata)"""
+
+    if DECODER=='pyav':
+        from VideoThumbDecode import VideoReader
+        video = VideoReader(INFILE)
+        try:
+            return video.metadata()
+        finally:
+            video.close()
+    return parse_metadata(run_ffmpeg(duration_command(INFILE,FFMPEG_PATH)))
+
+def encoder_options(ENCODER):
+    """savefig arguments of the thumbnail encoder settings (see VideoThumbGenerator)"""
+
+    if ENCODER is None:
+        return {}
+    if ENCODER['FORMAT'] == 'webp':
+        return {'format':'webp','pil_kwargs':{'quality':ENCODER['QUALITY'],'method':4}}
+    return {'format':'jpeg','pil_kwargs':{'quality':ENCODER['QUALITY'],
+                                          'progressive':ENCODER['PROGRESSIVE'],
+                                          'optimize':ENCODER['OPTIMIZE'],
+                                          'subsampling':ENCODER['SUBSAMPLING']}}
+
+def make_thumbnail(img,points,INPUT_FILE,outfile,SIZE,ENCODER=None):
+    # matplotlib is imported here and not at module level, the viewer and
+    # workers that only probe or reuse old thumbnails never need it
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.patheffects as PathEffects
 
     aspect = img[0].shape[0] / img[0].shape[1]
 
@@ -134,14 +210,275 @@ def process_file(k,DATA):
         if i==middle:
             ax.set_title(INPUT_FILE,fontsize=10)
 
-    fig1.savefig(outfile)
+    fig1.savefig(outfile,**encoder_options(ENCODER))
     plt.close(fig1)
 
-    textfiles = (folder_index,(OUTFOLDER[folder_index] + '|' + output + '|' + INPUT_FILE + '|' + str(duration)))
+def frame_hashes(img):
+    """Perceptual hashes of the frames as a catalog string"""
+    from VideoThumbHash import phash,hash_to_str
+    return hash_to_str(phash(i) for i in img)
 
-    print('... DONE %s' % INPUT_FILE)
+def make_thumbnail_from_files(frame_files,points,INPUT_FILE,outfile,SIZE,ENCODER=None,STEP=1.0):
+    """
+    Compositing step of the asyncio engine, runs in an executor process.
+    frame_files are the candidate files of each point. Returns frame hashes or None.
+    """
+
+    candidates = [[read_frame(file) for file in files] for files in frame_files]
+    chosen = [choose_frame(frames,point,STEP) for frames,point in zip(candidates,points)]
+    img = [x[0] for x in chosen]
+    if any(i is None for i in img):
+        return None
+
+    make_thumbnail(img,[x[1] for x in chosen],INPUT_FILE,outfile,SIZE,ENCODER)
+    return frame_hashes(img)
+
+def thumbnail_row(THUMBFOLDER,output,INPUT_FILE,metadata,phash=''):
+    """Catalog row of a video, with its metadata, the source size/mtime and thumbnail dimensions"""
+
+    row = {'folder':THUMBFOLDER,'name':output,'video':INPUT_FILE,'duration':str(round(metadata['duration'],2)),'phash':phash,
+           'codec':metadata.get('codec','')}
+    # metadata that was not found is left empty, it sorts last in the viewer
+    for field,key in (('fps','fps'),('bitrate','bitrate'),('video_width','width'),('video_height','height')):
+        value = metadata.get(key,0)
+        row[field] = '%g' % round(value,3) if value else ''
+    try:
+        stat = os.stat(INPUT_FILE)
+        row['size'] = str(stat.st_size)
+        row['mtime'] = '%.0f' % stat.st_mtime
+        row['width'],row['height'] = get_image_size(THUMBFOLDER + os.sep + output)
+    except (OSError,UnknownImageFormat):
+        pass
 
-    return textfiles
+    return row
+
+def sample_hash(file,size,BLOCK=1 << 16):
+    """Hash of the first, middle and last BLOCK bytes, cheap even for huge videos"""
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file,'rb') as f:
+        for offset in sorted(set([0,max(0,size//2-BLOCK//2),max(0,size-BLOCK)])):
+            f.seek(offset)
+            digest.update(f.read(BLOCK))
+    return digest.digest()
+
+def group_duplicate_files(files,preferred=()):
+    """
+    Groups copies of the same video: hardlinks (same st_dev, st_ino) and files
+    of equal size with equal sampled content. Returns representative -> other
+    files of its group, representatives are taken from preferred when possible.
+    """
+
+    inodes = {}
+    for file in files:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        # st_ino is 0 on file systems that have no inode numbers
+        key = (stat.st_dev,stat.st_ino) if stat.st_ino else file
+        inodes.setdefault(key,(stat.st_size,[]))[1].append(file)
+
+    sizes = {}
+    for size,group in inodes.values():
+        sizes.setdefault(size,[]).append(group)
+
+    groups = []
+    for size,candidates in sizes.items():
+        if len(candidates)==1:
+            groups += candidates
+            continue
+        contents = {}
+        for group in candidates:
+            try:
+                key = sample_hash(group[0],size)
+            except OSError:
+                key = group[0]
+            contents.setdefault(key,[]).extend(group)
+        groups += list(contents.values())
+
+    preferred = set(preferred)
+    copies = {}
+    for group in groups:
+        if len(group)>1:
+            group.sort(key=lambda file: (file not in preferred,file))
+            copies[group[0]] = group[1:]
+
+    return copies
+
+def attach_copies(rows,copies):
+    for row in rows:
+        row['copies'] = '\t'.join(copies.get(row['video'],[]))
+    return rows
+
+def probed_cost(duration,width,height):
+    """Relative cost of a probed video, frame decoding grows with resolution and seeking with duration"""
+    if not (width>0 and height>0):
+        width,height = 1920,1080
+    return width*height*(1.0 + duration/3600.0)
+
+def lpt_order(files):
+    """
+    Indices of files, largest first. Starting the longest jobs first (LPT) keeps
+    a few huge videos from running alone at the end while other workers idle.
+    """
+    sizes = []
+    for file in files:
+        try:
+            sizes.append(os.path.getsize(file))
+        except OSError:
+            sizes.append(0)
+    return sorted(range(len(files)),key=lambda k: -sizes[k])
+
+def mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent==path:
+            break
+        path = parent
+    return path
+
+def file_devices(files):
+    """Mount point of each file, files of one disk get the same string"""
+    folders = {}
+    devices = []
+    for file in files:
+        folder = os.path.dirname(file)
+        if folder not in folders:
+            folders[folder] = mount_point(folder)
+        devices.append(folders[folder])
+    return devices
+
+def parse_device_jobs(text):
+    """'2' or 'MOUNT=N,...,N' of the command line into DEVICE_JOBS"""
+    limits = {}
+    for item in text.split(','):
+        if '=' in item:
+            mount,limit = item.rsplit('=',1)
+            limits[os.path.realpath(mount)] = int(limit)
+        elif len(item.strip())>0:
+            limits[None] = int(item)
+    return limits
+
+def device_limits(devices,DEVICE_JOBS):
+    """
+    Jobs allowed in parallel on each device. DEVICE_JOBS is None (no limits),
+    one number for all devices or a dict of mount point -> number where the
+    key None is used for the other devices. Devices without a limit are left out.
+    """
+    if DEVICE_JOBS is None:
+        return {}
+    if not isinstance(DEVICE_JOBS,dict):
+        DEVICE_JOBS = {None:DEVICE_JOBS}
+    limits = {}
+    for device in set(devices):
+        limit = DEVICE_JOBS.get(device,DEVICE_JOBS.get(None))
+        if limit is not None:
+            limits[device] = max(1,int(limit))
+    return limits
+
+def thumbnail_job(k,DATA,metadata=None):
+    """
+    Makes the thumbnail of DATA['allfiles'][k]. Returns a result dict with the
+    video, thumbnail, catalog row ([] if failed), status ('done', 'old' if the
+    thumbnail file was found or 'failed'), error, duration, width, height (of
+    the thumbnail) and elapsed seconds. metadata of an earlier probe (see
+    parse_metadata) saves probing again. With DATA['DECODER']=='pyav' the frames
+    are decoded in one session (see VideoThumbDecode). Each
+    timepoint gets the best of DATA['CANDIDATES'] frames (see VideoThumbQuality).
+    """
+
+    start_time = time.time()
+
+    #---------------------------
+    output = DATA['alloutfiles'][k]
+    INPUT_FILE = DATA['allfiles'][k]
+    THUMBFOLDER = DATA['THUMBFOLDER']
+    TIMEPOINTS = DATA['TIMEPOINTS']
+    FFMPEG_PATH = DATA['FFMPEG_PATH']
+    SIZE = DATA['SIZE']
+    ENCODER = DATA['ENCODER']
+    CANDIDATES = DATA['CANDIDATES']
+    STEP = DATA['CANDIDATE_STEP']
+    #---------------------------
+
+    outfile = THUMBFOLDER + os.sep + output
+    result = new_result(k,INPUT_FILE,outfile)
+    video = None
+
+    try:
+        if DATA.get('DECODER')=='pyav':
+            from VideoThumbDecode import VideoReader
+            video = VideoReader(INPUT_FILE)
+        if metadata is None:
+            metadata = parse_metadata(run_ffmpeg(duration_command(INPUT_FILE,FFMPEG_PATH))) if video is None else video.metadata()
+        duration = metadata['duration']
+        result['duration'] = duration
+
+        if duration<5:
+            result['error'] = 'zero duration' if duration==0 else 'too short'
+        elif os.path.isfile(outfile) and check_thumbnail(outfile) is None:
+            result['row'] = thumbnail_row(THUMBFOLDER,output,INPUT_FILE,metadata)
+            result['status'] = 'old'
+        else:
+            points = [round(duration*x) for x in TIMEPOINTS]
+            if video is None:
+                img,points = get_video_frames(points,INPUT_FILE,outfile + '.frame.jpg',FFMPEG_PATH,CANDIDATES,STEP)
+            else:
+                img,points = video.frames(points,CANDIDATES,STEP)
+            if img is None:
+                result['error'] = 'snapshot failed'
+            else:
+                make_thumbnail(img,points,INPUT_FILE,outfile,SIZE,ENCODER)
+                result['row'] = thumbnail_row(THUMBFOLDER,output,INPUT_FILE,metadata,frame_hashes(img))
+                result['status'] = 'done'
+    except Exception as inst:
+        result['error'] = str(inst)
+    finally:
+        if video is not None:
+            video.close()
+
+    return finish_result(result,start_time)
+
+def job_function(DATA):
+    """thumbnail_job, or its profiled version when DATA has a PROFILE_DIR"""
+    if 'PROFILE_DIR' in DATA:
+        from VideoThumbProfile import profiled_job
+        return profiled_job
+    return thumbnail_job
+
+def check_thumbnail(outfile):
+    # truncated thumbnails of a crashed run are made again
+    from VideoThumbVerify import check_thumbnail
+    return check_thumbnail(outfile)
+
+def new_result(k,INPUT_FILE,outfile):
+    return {'index':k,'video':INPUT_FILE,'thumbnail':outfile,'row':[],'status':'failed','error':None,
+            'duration':0,'width':0,'height':0,'elapsed':0.0}
+
+def finish_result(result,start_time):
+    row = result['row']
+    if len(row)>0:
+        result['width'] = int(row.get('width',0) or 0)
+        result['height'] = int(row.get('height',0) or 0)
+    result['elapsed'] = time.time()-start_time
+    return result
+
+def print_result(result):
+    if result['status']=='failed':
+        print('... FAILED (%s) %s' % (result['error'],result['video']))
+    elif result['status']=='old':
+        print('... DONE (old found) %s' % result['video'])
+    else:
+        print('... DONE %s' % result['video'])
+
+def process_file(k,DATA,metadata=None):
+    """Catalog row of DATA['allfiles'][k], [] if failed"""
+
+    result = thumbnail_job(k,DATA,metadata)
+    print_result(result)
+    return result['row']
 
 class VideoThumbGenerator(object):
 
@@ -150,8 +487,26 @@ class VideoThumbGenerator(object):
                  OUTPATH = r'D:\Downloads\thumbnail_testing',
                  INFOLDER = r'D:\Downloads',
                  SIZE = 17, # figure width in inches
+                 FORMAT = 'jpg', # thumbnail format, 'jpg' or 'webp'
+                 QUALITY = 80, # JPEG/WebP quality, 1-100
+                 PROGRESSIVE = False, # progressive JPEG
+                 OPTIMIZE = True, # optimized Huffman tables of JPEG, a few % smaller for a little more encoding time
+                 SUBSAMPLING = '4:2:0', # JPEG chroma subsampling, '4:4:4', '4:2:2' or '4:2:0'
+                 CANDIDATES = 3, # frames tried from each timepoint on, black or blank ones are skipped, 1 for the timepoint only
+                 CANDIDATE_STEP = 1.0, # seconds between candidate frames
                  OUTTIMES = (2,15), # separations, in minutes
-                 NWORKERS = 3,
+                 NWORKERS = 3, # 0 to tune the number of parallel jobs during the run
+                 AUTOTUNE = False, # tune the parallel jobs up to NWORKERS
+                 ENGINE = 'pool', # 'pool' or 'asyncio'
+                 DECODER = 'ffmpeg', # 'ffmpeg' (executable) or 'pyav' (one session for the frames of a video, pip install av)
+                 FFMPEG_JOBS = 16, # ffmpeg processes in flight with the asyncio engine
+                 MEMORY_BUDGET = None, # MB for the frames and figures of parallel jobs, None for half of the RAM
+                 DEVICE_JOBS = None, # jobs reading one disk at a time, a number or {mount point: number}, None for no limit
+                 BACKGROUND = False, # lowest CPU and I/O priority for the run, workers and ffmpeg
+                 MAX_RATE = None, # videos per minute, None for no cap
+                 CPU_LIMIT = None, # share of all cores (0-1) used by jobs, None for no cap
+                 PROFILE = None, # pstats file of the merged worker profiles, None for no profiling
+                 POOL = None, # running multiprocessing.Pool of NWORKERS to use (generation daemon), None for a new one per run
                  FFMPEG_PATH = r'C:\Users\JanneK\PycharmProjects\VideoThumbViewer' + os.sep,
                  EXTENSIONS = ('.mp4','.avi','.mov','.mpg','.wmv','.mkv','.m4v','.flv')):
 
@@ -159,8 +514,23 @@ class VideoThumbGenerator(object):
         self.OUTPATH = OUTPATH
         self.INFOLDER = INFOLDER
         self.SIZE = SIZE
+        self.ENCODER = {'FORMAT':FORMAT,'QUALITY':QUALITY,'PROGRESSIVE':PROGRESSIVE,'OPTIMIZE':OPTIMIZE,'SUBSAMPLING':SUBSAMPLING}
+        self.CANDIDATES = CANDIDATES
+        self.CANDIDATE_STEP = CANDIDATE_STEP
         self.OUTTIMES = OUTTIMES
         self.NWORKERS = NWORKERS
+        self.AUTOTUNE = AUTOTUNE
+        self.ENGINE = ENGINE
+        self.DECODER = DECODER
+        self.FFMPEG_JOBS = FFMPEG_JOBS
+        self.MEMORY_BUDGET = MEMORY_BUDGET
+        self.DEVICE_JOBS = DEVICE_JOBS
+        self.BACKGROUND = BACKGROUND
+        self.MAX_RATE = MAX_RATE
+        self.CPU_LIMIT = CPU_LIMIT
+        self.PROFILE = PROFILE
+        self.POOL = POOL
+        self.total = 0 # results of the current iter_results
         self.FFMPEG_PATH = FFMPEG_PATH
         self.EXTENSIONS = EXTENSIONS
 
@@ -188,8 +558,8 @@ class VideoThumbGenerator(object):
             extension = ''
         return [drive + path, filename, extension]
 
-    def run(self):
-    #if __name__ == '__main__':
+    def setup(self):
+        """Checks parameters and creates output folders, returns sorted OUTTIMES (minutes) and the thumbnail folder"""
 
         assert(os.path.isdir(self.INFOLDER))
 
@@ -197,114 +567,469 @@ class VideoThumbGenerator(object):
         OUTTIMES = list(set(OUTTIMES))
         OUTTIMES.sort()
 
-        assert(all([a>0 & a<1000 for a in OUTTIMES]));
+        assert(all([0<a<1000 for a in OUTTIMES]));
         assert(0<len(OUTTIMES)<100)
+        assert(self.ENCODER['FORMAT'] in ('jpg','webp'))
 
-        print('\nphase 1: setting parameters')
+        OUTFOLDER = get_outfolders(self.OUTPATH,OUTTIMES)
+        THUMBFOLDER = self.OUTPATH + os.sep + THUMB_FOLDER
 
-        if len(OUTTIMES)==0:
-            OUTFOLDER = [self.OUTPATH]
-        else:
-            OUTFOLDER = ['' for _ in range(len(OUTTIMES)+1)]
-            OUTFOLDER[0] = self.OUTPATH+os.sep+'less_than_%imin' % OUTTIMES[0]
-            for i in range(1,len(OUTTIMES)):
-                OUTFOLDER[i] = self.OUTPATH + os.sep + 'between_%imin_and_%imin' % (OUTTIMES[i-1],OUTTIMES[i])
-            OUTFOLDER[len(OUTTIMES)] = self.OUTPATH + os.sep + 'over_%imin' % OUTTIMES[-1]
-            assert(len(OUTTIMES) == len(OUTFOLDER)-1);
-
-        for i in OUTFOLDER:
+        for i in OUTFOLDER + [THUMBFOLDER]:
             if not os.path.isdir(i):
                 os.makedirs(i)
                 assert(os.path.isdir(i))
 
-        allfiles = self.filesearch(self.INFOLDER, [])
+        return OUTTIMES,THUMBFOLDER
+
+    def plan(self,allfiles,known,THUMBFOLDER):
+        """
+        Splits allfiles into videos with an old thumbnail (their catalog rows)
+        and new ones that need processing (with their thumbnail names). Copies
+        of the same video are processed once, returns representative -> copies.
+        """
 
+        # known videos of the same size may be copies too (watch mode updates)
+        sizes = set()
+        for file in allfiles:
+            try:
+                sizes.add(str(os.path.getsize(file)))
+            except OSError:
+                pass
+        inputs = set(allfiles)
+        extra = [video for video,row in known.items() if video not in inputs and row.get('size') in sizes]
+        copies = group_duplicate_files(list(allfiles) + extra,preferred=known)
+        duplicates = set(file for group in copies.values() for file in group)
+        allfiles = [file for file in allfiles if file not in duplicates]
+        if len(duplicates)>0:
+            print('... %i copies of other videos skipped' % len(duplicates))
+
+        # thumbnails of earlier runs are reused as they are, no need to probe
+        usednames = set(row['name'] for row in known.values())
+
+        oldrows = []
+        newfiles = []
         alloutfiles=[]
         for i in range(len(allfiles)):
+            row = known.get(allfiles[i])
+            if row is not None:
+                outfile = THUMBFOLDER + os.sep + row['name']
+                oldfile = row['folder'] + os.sep + row['name']
+                if not os.path.isfile(outfile) and os.path.isfile(oldfile):
+                    # stored in a bucket folder by an older version
+                    os.replace(oldfile,outfile)
+                if os.path.isfile(outfile):
+                    row['folder'] = THUMBFOLDER
+                    oldrows.append(row)
+                    continue
+                newfiles.append(allfiles[i])
+                alloutfiles.append(row['name'])
+                continue
             [a,b,c] = self.fileparts(allfiles[i])
             k=0
-            newname = b + '.jpg'
+            ext = '.' + self.ENCODER['FORMAT']
+            newname = b + ext
             while 1:
-                if newname in alloutfiles:
+                if newname in usednames:
                     k+=1
-                    newname = b + '_' + str(k) + '.jpg'
+                    newname = b + '_' + str(k) + ext
                 else:
                     break
                 if k>100:
                     raise('Too many files with same name! Check your files')
+            usednames.add(newname)
+            newfiles.append(allfiles[i])
             alloutfiles.append(newname)
 
-        assert(len(alloutfiles)==len(allfiles))
-        print('Total %i files found' % len(allfiles))
+        assert(len(alloutfiles)==len(newfiles))
 
-        N = len(allfiles)
-        assert(N<10000)  # lets not go grazy
+        return oldrows,newfiles,alloutfiles,copies
 
-        plt.close('all')
-    
-        # into seconds
-        OUTTIMES = [x*60 for x in OUTTIMES]
-    
-        DATA = {}    
+    def job_data(self,newfiles,alloutfiles,THUMBFOLDER):
+        """Settings passed to process_file"""
+
+        DATA = {}
         DATA['alloutfiles']=alloutfiles
-        DATA['allfiles'] = allfiles
-        DATA['OUTFOLDER'] = OUTFOLDER
-        DATA['OUTTIMES']= OUTTIMES
+        DATA['allfiles'] = newfiles
+        DATA['THUMBFOLDER'] = THUMBFOLDER
         DATA['TIMEPOINTS'] = self.TIMEPOINTS
         DATA['FFMPEG_PATH'] = self.FFMPEG_PATH
         DATA['SIZE'] = self.SIZE
+        DATA['ENCODER'] = self.ENCODER
+        DATA['DECODER'] = self.decoder()
+        DATA['CANDIDATES'] = max(1,self.CANDIDATES)
+        DATA['CANDIDATE_STEP'] = self.CANDIDATE_STEP
+        return DATA
+
+    def decoder(self):
+        """DECODER of the jobs, the asyncio engine always awaits the ffmpeg executable"""
+        if self.ENGINE=='asyncio':
+            return 'ffmpeg'
+        return self.DECODER
+
+    def iter_jobs(self,newfiles,alloutfiles,THUMBFOLDER):
+        """
+        Makes thumbnails of newfiles, yields thumbnail_job results as they finish.
+        At most NWORKERS jobs (FFMPEG_JOBS with the asyncio engine) are in flight
+        and no new ones are started while the consumer holds a result. Closing
+        the iterator cancels the remaining jobs. With DEVICE_JOBS the videos of
+        each disk are also limited separately, so several disks are read in
+        parallel without seek thrashing on any one of them. With NWORKERS=0 or
+        AUTOTUNE the pool engine adapts the jobs in flight (see VideoThumbTuner).
+        With PROFILE the jobs are profiled (see VideoThumbProfile).
+        """
+
+        N = len(newfiles)
+        if N>=10000:
+            print('... %i new videos, this will take a while' % N)
+        if N==0:
+            return
 
-        #res = process_file(9,DATA)
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+        DATA = self.job_data(newfiles,alloutfiles,THUMBFOLDER)
+        DATA['order'] = lpt_order(newfiles)
+        DATA['devices'] = file_devices(newfiles)
+        DATA['device_limits'] = device_limits(DATA['devices'],self.DEVICE_JOBS)
+
+        if self.PROFILE is None:
+            yield from self.iter_engine(DATA)
+            return
+
+        from VideoThumbProfile import JobProfile
+        profile = JobProfile(self.PROFILE)
+        DATA['PROFILE_DIR'] = profile.folder
+        try:
+            for result in self.iter_engine(DATA):
+                profile.add(result)
+                yield result
+        finally:
+            profile.close()
+
+    def iter_engine(self,DATA):
+        """Results of the jobs of DATA from the engine of the settings"""
+
+        N = len(DATA['allfiles'])
+        NWORKERS = self.workers()
+        if self.ENGINE == 'asyncio':
+
+            from VideoThumbAsync import iter_async
+            yield from iter_async(DATA,self.FFMPEG_JOBS,NWORKERS,self.memory_budget())
+
+        elif self.POOL is not None or (NWORKERS>1 and N>1):
+
+            from VideoThumbMemory import iter_pool
+            tuner = None
+            if self.AUTOTUNE or self.NWORKERS<=0:
+                from VideoThumbTuner import ConcurrencyTuner
+                tuner = ConcurrencyTuner(NWORKERS)
+            yield from iter_pool(DATA,NWORKERS,self.memory_budget(),self.POOL,tuner)
+            if tuner is not None:
+                print(tuner.summary())
+
+        else:
+            job = job_function(DATA)
+            for k in range(N):
+                yield job(k,DATA)
+
+    def iter_results(self):
+        """
+        Thumbnails of all videos in INFOLDER, yields one result dict per video
+        (see thumbnail_job) as soon as it is ready. Videos with a catalog row of
+        an earlier run come first with status 'reused'. Rows include the copies
+        of the video. Nothing is written into the catalogs, see run().
+        """
+
+        OUTTIMES,THUMBFOLDER = self.setup()
+
+        allfiles = self.filesearch(self.INFOLDER, [])
+
+        oldrows,newfiles,alloutfiles,copies = self.plan(allfiles,read_known_rows(self.OUTPATH),THUMBFOLDER)
+
+        print('Total %i files found (%i with old thumbnails)' % (len(allfiles),len(oldrows)))
+        self.total = len(oldrows) + len(newfiles)
+
+        for row in attach_copies(oldrows,copies):
+            result = new_result(None,row['video'],row['folder'] + os.sep + row['name'])
+            result['row'] = row
+            result['status'] = 'reused'
+            result['duration'] = float(row['duration'])
+            yield finish_result(result,time.time())
+
+        print('\nphase 2: generating thumbnails')
+
+        for result in self.iter_jobs(newfiles,alloutfiles,THUMBFOLDER):
+            if len(result['row'])>0:
+                attach_copies([result['row']],copies)
+            yield result
+
+    def generate(self,newfiles,alloutfiles,THUMBFOLDER):
+        """Creates thumbnails of newfiles, returns catalog rows of the successful ones"""
 
         print('\nphase 2: generating thumbnails')
-        
+
         start_time = time.time()
+        results = []
+        for result in self.iter_jobs(newfiles,alloutfiles,THUMBFOLDER):
+            print_result(result)
+            results.append(result)
 
-        if self.NWORKERS>1:
-
-            pool = Pool(processes=self.NWORKERS)        
-            pool_result = pool.map(partial(process_file,DATA=DATA),list(range(len(allfiles))))
-            pool.close()
-            pool.join()
-            
-            textfiles = [[]]*len(allfiles)        
-            
-            for i,result in enumerate(pool_result):
-                textfiles[i] = result
-#
-        else:
-            textfiles = ['']*len(allfiles)
-            for k in range(len(allfiles)):
-                textfiles[k] = process_file(DATA=DATA,k=k)
-#            
-#        for k in range(len(allfiles)):
-        N1= len(textfiles)
-        elapsed =  time.time()-start_time
-        print('..summary: %i files processed in %is (%f videos/sec)' % (N1,round(elapsed),N1/elapsed))
+        return self.summary(results,start_time)
 
-        print('\nphase 3: writing textfiles')
-        
-        textfiles = [i for i in textfiles if len(i)>0]
+    def summary(self,results,start_time):
+        """Prints the summary of job results, returns their catalog rows in job order"""
+
+        N1 = len(results)
+        elapsed = time.time()-start_time
+        print('..summary: %i files processed in %is (%f videos/sec)' % (N1,round(elapsed),N1/max(elapsed,1e-6)))
+
+        textfiles = [result['row'] for result in sorted(results,key=lambda result: result['index']) if len(result['row'])>0]
         N2 = len(textfiles)
-        
+
         print('..summary: %i/%i files failed' % (N1-N2,N1))
 
-        textfiles_sorted = [[] for _ in range(len(OUTFOLDER))]
-        for i in textfiles:
-            ind = i[0]
-            data = i[1]
-            textfiles_sorted[ind].append(data)
+        return textfiles
+
+    def workers(self):
+        """NWORKERS, or the most parallel jobs the tuner may try if it is 0"""
+        if self.NWORKERS<=0:
+            from VideoThumbTuner import default_ceiling
+            return default_ceiling()
+        return self.NWORKERS
 
-        for i,texts in enumerate(textfiles_sorted):
-            filename = OUTFOLDER[i] + os.sep + 'MyVideoThumbs.dat'
-            with open(filename,'w',encoding='utf8') as file:
-                file.write('\n'.join(texts))
-            print('... textfile written: %s' % filename )
+    def memory_budget(self):
+        """MEMORY_BUDGET in bytes"""
+        if self.MEMORY_BUDGET is None:
+            from VideoThumbMemory import default_budget
+            return default_budget()
+        return int(self.MEMORY_BUDGET*(1 << 20))
+
+    def run(self,progress=None):
+        """
+        Thumbnails of INFOLDER into OUTPATH. progress(result) is called for every
+        result of iter_results, returning False from it stops the run early (the
+        catalogs then have the videos finished so far). The run is paced by
+        BACKGROUND, MAX_RATE and CPU_LIMIT and pauses while the pause file of
+        OUTPATH exists (see VideoThumbBackground).
+        """
+    #if __name__ == '__main__':
+        from VideoThumbBackground import Governor,lower_priority
+
+        print('\nphase 1: setting parameters')
+
+        if self.BACKGROUND:
+            print('... background mode: %s' % (', '.join(lower_priority()) or 'priority unchanged'))
+        governor = Governor(self.OUTPATH,self.MAX_RATE,self.CPU_LIMIT)
+
+        oldrows = []
+        results = []
+
+        def checkpoint():
+            OUTTIMES,THUMBFOLDER = self.setup()
+            rows = [result['row'] for result in sorted(results,key=lambda result: result['index']) if len(result['row'])>0]
+            write_catalogs(self.OUTPATH,oldrows + rows,OUTTIMES)
+
+        start_time = time.time()
+        iterator = self.iter_results()
+        for result in iterator:
+            if result['status']=='reused':
+                oldrows.append(result['row'])
+            else:
+                print_result(result)
+                results.append(result)
+            if progress is not None and progress(result)==False:
+                iterator.close()
+                break
+            # holding the result keeps new jobs from starting
+            governor.wait(result,checkpoint)
+
+        textfiles = self.summary(results,start_time)
+
+        print('\nphase 3: writing textfiles')
+
+        OUTTIMES,THUMBFOLDER = self.setup()
+        write_catalogs(self.OUTPATH,oldrows + textfiles,OUTTIMES)
+        clear_changes(self.OUTPATH)
 
         print('\n--- ALL DONE! ---\n')
+
+    def update(self,created=(),deleted=(),moved=()):
+        """
+        Incremental update of an existing OUTPATH: thumbnails are made only for
+        created (or modified) videos and rows of deleted videos are dropped.
+        moved (old path, new path) pairs of renamed videos keep their thumbnail,
+        only the paths in the rows change. Changes are also appended to the
+        change journal read by open viewers.
+        """
+
+        OUTTIMES,THUMBFOLDER = self.setup()
+
+        known = read_known_rows(self.OUTPATH)
+        removed = []
+        promoted = []
+
+        paths = dict(moved)
+        created = list(created)
+        renamed = [row for row in known.values() if row['video'] in paths or any(x in paths for x in row.get('copies','').split('\t'))]
+        for row in renamed:
+            if row['video'] in paths:
+                removed.append(row['video'])
+                del known[row['video']]
+        for row in renamed:
+            row['video'] = paths.get(row['video'],row['video'])
+            row['copies'] = '\t'.join(paths.get(x,x) for x in row.get('copies','').split('\t') if len(x)>0)
+            known[row['video']] = row
+            promoted.append(row)
+        # renamed files that have no row yet are new
+        copies = set(x for row in promoted for x in row['copies'].split('\t'))
+        created += [new for old,new in moved if new not in known and new not in copies]
+
+        gone = set(deleted) | set(created)
+        for file in gone:
+            row = known.pop(file,None)
+            if row is None:
+                continue
+            removed.append(file)
+            others = [x for x in row.get('copies','').split('\t') if len(x)>0 and x not in gone]
+            if file not in created and len(others)>0:
+                # a copy of the deleted video takes over its thumbnail
+                row['video'] = others[0]
+                row['copies'] = '\t'.join(others[1:])
+                known[others[0]] = row
+                promoted.append(row)
+            elif os.path.isfile(THUMBFOLDER + os.sep + row['name']):
+                os.remove(THUMBFOLDER + os.sep + row['name'])
+        for row in known.values():
+            if len(row.get('copies',''))>0:
+                row['copies'] = '\t'.join(file for file in row['copies'].split('\t') if file not in gone)
+
+        created = [file for file in created if os.path.isfile(file)]
+        oldrows,newfiles,alloutfiles,copies = self.plan(created,known,THUMBFOLDER)
+        textfiles = attach_copies(self.generate(newfiles,alloutfiles,THUMBFOLDER),copies)
+
+        # new copies of videos that already have a thumbnail
+        for video,files in copies.items():
+            if video in known:
+                row = known[video]
+                old = [x for x in row.get('copies','').split('\t') if len(x)>0]
+                row['copies'] = '\t'.join(old + [x for x in files if x not in old])
+                if row not in promoted:
+                    promoted.append(row)
+
+        write_catalogs(self.OUTPATH,list(known.values()) + textfiles,OUTTIMES)
+        append_changes(self.OUTPATH,promoted + textfiles,removed)
+
+        return textfiles,removed
+
+    def known_videos(self):
+        """Catalogued video paths, including copies"""
+        videos = []
+        for video,row in read_known_rows(self.OUTPATH).items():
+            videos.append(video)
+            videos += [x for x in row.get('copies','').split('\t') if len(x)>0]
+        return videos
+
+    def verify(self,REPAIR=False,NTHREADS=16):
+        """
+        Checks every catalog row (see VideoThumbVerify), returns the problems as
+        (row, kind, text). With REPAIR broken thumbnails and changed videos are
+        made again and rows of deleted videos are dropped.
+        """
+        from VideoThumbVerify import verify_rows,missing_copies,MISSING
+
+        start_time = time.time()
+        rows = list(read_known_rows(self.OUTPATH).values())
+        problems = verify_rows(rows,NTHREADS)
+        gone = missing_copies(rows)
+
+        for row,kind,problem in problems:
+            print('... %s (%s) %s' % (kind.upper(),problem,row['video']))
+        print('..verify: %i rows checked in %.1fs, %i problems, %i missing copies' % (len(rows),time.time()-start_time,len(problems),len(gone)))
+
+        if REPAIR and (len(problems)>0 or len(gone)>0):
+            deleted = [row['video'] for row,kind,problem in problems if kind==MISSING] + gone
+            created = [row['video'] for row,kind,problem in problems if kind!=MISSING]
+            self.update(created=created,deleted=deleted)
+
+        return problems
+
+    def watch(self,DEBOUNCE=5.0,POLL=2.0):
+        """Keeps running, new, changed and deleted videos in INFOLDER are updated as they arrive"""
+        from VideoThumbWatch import watch
+        watch(self,DEBOUNCE=DEBOUNCE,POLL=POLL)
+
+    def rebucket(self,OUTTIMES):
+        """Change duration buckets of an existing OUTPATH, thumbnails are not made again"""
+        self.OUTTIMES = OUTTIMES
+        N = rebucket(self.OUTPATH,OUTTIMES)
+        print('... %i videos rebucketed' % N)
     
 
+def main(argv=None):
+    """
+    Command line interface, e.g.
+        python VideoThumbGenerator.py E:\\folder E:\\folder\\video_preview_images --watch
+    """
+    import optparse
+
+    prs = optparse.OptionParser(
+        usage="%prog [options] <INFOLDER> <OUTPATH>",
+        description="Create video thumbnails of INFOLDER into OUTPATH.")
+    prs.add_option('--ffmpeg',dest='ffmpeg_path',default='',help='folder of the ffmpeg executable')
+    prs.add_option('--workers',dest='nworkers',type='int',default=0,help='parallel jobs, 0 (default) to tune them during the run')
+    prs.add_option('--autotune',dest='autotune',action='store_true',default=False,help='tune the parallel jobs up to --workers')
+    prs.add_option('--engine',dest='engine',default='pool',choices=['pool','asyncio'])
+    prs.add_option('--decoder',dest='decoder',default='ffmpeg',choices=['ffmpeg','pyav'],help='pyav decodes all frames of a video in one session (pip install av)')
+    prs.add_option('--candidates',dest='candidates',type='int',default=3,help='frames tried per timepoint, the best is kept (1 to take the timepoint only)')
+    prs.add_option('--format',dest='format',default='jpg',choices=['jpg','webp'],help='thumbnail format')
+    prs.add_option('--quality',dest='quality',type='int',default=80,help='JPEG/WebP quality')
+    prs.add_option('--progressive',dest='progressive',action='store_true',default=False,help='progressive JPEG')
+    prs.add_option('--no-optimize',dest='optimize',action='store_false',default=True,help='standard JPEG Huffman tables, faster but larger')
+    prs.add_option('--memory',dest='memory',type='float',default=None,help='memory budget (MB) of parallel jobs, default half of the RAM')
+    prs.add_option('--device-jobs',dest='device_jobs',default=None,help='parallel jobs per disk, N or MOUNT=N,...,N for the rest')
+    prs.add_option('--background',dest='background',action='store_true',default=False,help='lowest CPU and I/O priority')
+    prs.add_option('--max-rate',dest='max_rate',type='float',default=None,help='at most this many videos per minute')
+    prs.add_option('--cpu-limit',dest='cpu_limit',type='float',default=None,help='at most this percentage of all cores')
+    prs.add_option('--pause',dest='pause',action='store_true',default=False,help='pause runs into OUTPATH')
+    prs.add_option('--resume',dest='resume',action='store_true',default=False,help='resume paused runs into OUTPATH')
+    prs.add_option('--profile',dest='profile',default=None,help='profile the jobs into this pstats file (and FILE.jobs)')
+    prs.add_option('--verify',dest='verify',action='store_true',default=False,help='check thumbnails and videos of the OUTPATH catalog')
+    prs.add_option('--repair',dest='repair',action='store_true',default=False,help='check the catalog and make broken thumbnails again')
+    prs.add_option('--submit',dest='submit',action='store_true',default=False,help='send the job to a running generation daemon (VideoThumbDaemon), run here if none')
+    prs.add_option('--watch',dest='watch',action='store_true',help='keep running and update new videos as they arrive')
+    prs.add_option('--debounce',dest='debounce',type='float',default=5.0,help='seconds a file must stay unchanged in watch mode')
+
+    argv = list(argv) if argv is not None else sys.argv[1:]
+    (opts, args) = prs.parse_args(args=argv)
+    if len(args) != 2:
+        prs.error("You must specify INFOLDER and OUTPATH")
+
+    obj = VideoThumbGenerator(INFOLDER=args[0],OUTPATH=args[1],FFMPEG_PATH=opts.ffmpeg_path,NWORKERS=opts.nworkers,AUTOTUNE=opts.autotune,ENGINE=opts.engine,DECODER=opts.decoder,
+                              FORMAT=opts.format,QUALITY=opts.quality,PROGRESSIVE=opts.progressive,OPTIMIZE=opts.optimize,CANDIDATES=opts.candidates,
+                              MEMORY_BUDGET=opts.memory,DEVICE_JOBS=None if opts.device_jobs is None else parse_device_jobs(opts.device_jobs),
+                              BACKGROUND=opts.background,MAX_RATE=opts.max_rate,
+                              CPU_LIMIT=None if opts.cpu_limit is None else opts.cpu_limit/100.0,PROFILE=opts.profile)
+    if opts.pause or opts.resume:
+        from VideoThumbBackground import pause,resume
+        if opts.pause:
+            pause(args[1])
+        else:
+            resume(args[1])
+        return 0
+    if opts.verify or opts.repair:
+        problems = obj.verify(REPAIR=opts.repair)
+        return 1 if len(problems)>0 and not opts.repair else 0
+    if opts.submit and not opts.watch:
+        from VideoThumbDaemon import submit
+        job = submit(INFOLDER=args[0],OUTPATH=args[1])
+        if job is not None:
+            print('... submitted as job %i of the generation daemon' % job['job'])
+            return 0
+    obj.run()
+    if opts.watch:
+        obj.watch(DEBOUNCE=opts.debounce)
+    return 0
+
 if __name__ == '__main__':
     __spec__ = "ModuleSpec(name='builtins', loader=<class '_frozen_importlib.BuiltinImporter'>)"
-    obj = VideoThumbGenerator(OUTPATH=r'E:\folder\video_preview_images',INFOLDER=r'E:\folder',FFMPEG_PATH='',NWORKERS=1)
-    obj.run()
+    sys.exit(main(argv=sys.argv[1:]))
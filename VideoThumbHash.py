@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Perceptual hashes of video frames and near-duplicate search
+
+Every timepoint of a video gets a 64 bit pHash (or dHash) computed with NumPy
+from the frames that are already extracted for the thumbnail. The hashes of a
+video are concatenated, so re-encodes and resized copies of the same video end
+up within a small Hamming distance of each other.
+
+Near-duplicates are found with multi-index hashing: hashes are split into
+radius+1 chunks, and by the pigeonhole principle two hashes within the radius
+share at least one identical chunk. Only videos sharing a chunk are compared,
+which avoids comparing every pair. A video is not compared again with videos
+already in its group, and large buckets keep one video per group.
+"""
+
+import numpy as np
+
+HASH_BITS = 64
+DEFAULT_RADIUS = 11 # bits, for the full (all timepoints) video hash
+BUCKET_LIMIT = 32 # chunk bucket size above which grouped members are compacted
+
+def luma(img):
+    """Gray levels in 0..255 of a HxW, HxWx3 or HxWx4 frame (uint8 or float 0..1)"""
+    img = np.asarray(img)
+    if img.dtype.kind == 'f':
+        img = img*255.0
+    img = img.astype(np.float32)
+    if img.ndim == 3:
+        img = img[:,:,0]*0.299 + img[:,:,1]*0.587 + img[:,:,2]*0.114
+    return img
+
+def resize_mean(gray,height,width):
+    """Area average down to height x width, nearest sampling for tiny frames"""
+    H,W = gray.shape
+    rows = (np.arange(height)*H)//height
+    cols = (np.arange(width)*W)//width
+    if H<height or W<width:
+        return gray[rows][:,cols]
+    out = np.add.reduceat(np.add.reduceat(gray,rows,axis=0),cols,axis=1)
+    counts = np.outer(np.diff(np.append(rows,H)),np.diff(np.append(cols,W)))
+    return out/counts
+
+def bits_to_int(bits):
+    return int.from_bytes(np.packbits(np.asarray(bits,dtype=bool).ravel()).tobytes(),'big')
+
+def dhash(img):
+    """Difference hash, sign of horizontal gradients of a 8x9 image"""
+    small = resize_mean(luma(img),8,9)
+    return bits_to_int(small[:,1:]>small[:,:-1])
+
+_DCT = {}
+
+def dct_matrix(n):
+    if n not in _DCT:
+        k = np.arange(n)
+        m = np.cos(np.pi*(2*k[None,:]+1)*k[:,None]/(2*n))*np.sqrt(2.0/n)
+        m[0,:] = np.sqrt(1.0/n)
+        _DCT[n] = m
+    return _DCT[n]
+
+def phash(img):
+    """DCT hash, low 8x8 frequencies of a 32x32 image compared against their median"""
+    small = resize_mean(luma(img),32,32)
+    D = dct_matrix(32)
+    low = (D @ small @ D.T)[:8,:8].ravel()
+    return bits_to_int(low>np.median(low[1:]))
+
+def hash_to_str(hashes):
+    return ','.join('%016x' % h for h in hashes)
+
+def str_to_hash(text):
+    """Catalog string of timepoint hashes into (number of bits, one integer)"""
+    parts = [x for x in text.split(',') if len(x)>0]
+    value = 0
+    for x in parts:
+        value = (value << HASH_BITS) | int(x,16)
+    return len(parts)*HASH_BITS,value
+
+def hamming(a,b):
+    return bin(a ^ b).count('1')
+
+class MultiIndexHash(object):
+    """Hamming distance index over equal length integer hashes"""
+
+    def __init__(self,nbits,radius=DEFAULT_RADIUS):
+        self.nbits = nbits
+        self.radius = radius
+        nchunks = min(radius+1,nbits)
+        edges = [round(i*nbits/nchunks) for i in range(nchunks+1)]
+        self.chunks = [(edges[i],((1 << (edges[i+1]-edges[i]))-1)) for i in range(nchunks)]
+        self.tables = [{} for _ in self.chunks]
+        self.hashes = []
+
+    def keys(self,h):
+        return [(h >> shift) & mask for shift,mask in self.chunks]
+
+    def add(self,h):
+        """Adds a hash, returns its index"""
+        ind = len(self.hashes)
+        self.hashes.append(h)
+        for table,key in zip(self.tables,self.keys(h)):
+            table.setdefault(key,[]).append(ind)
+        return ind
+
+    def query(self,h):
+        """Indices of hashes within radius of h"""
+        candidates = set()
+        for table,key in zip(self.tables,self.keys(h)):
+            candidates.update(table.get(key,()))
+        return [i for i in candidates if hamming(h,self.hashes[i])<=self.radius]
+
+def find_duplicates(hashes,radius=DEFAULT_RADIUS):
+    """
+    Groups of near-duplicates. hashes is a list of catalog hash strings (empty
+    if unknown), returns lists of indices into it, largest groups first.
+    """
+
+    parent = list(range(len(hashes)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    indexes = {}
+    first = {}
+    compacted = {} # (nbits, table, key) -> (bucket without grouped members, bucket entries seen)
+    for i,text in enumerate(hashes):
+        if len(text)==0:
+            continue
+        nbits,h = str_to_hash(text)
+        if (nbits,h) in first:
+            # exact copy, it joins the group of the first one and is not indexed
+            parent[i] = root(first[nbits,h])
+            continue
+        first[nbits,h] = i
+        if nbits not in indexes:
+            indexes[nbits] = (MultiIndexHash(nbits,radius),[])
+        index,members = indexes[nbits]
+        for t,(table,key) in enumerate(zip(index.tables,index.keys(h))):
+            bucket = table.get(key)
+            if bucket is None:
+                continue
+            if len(bucket)>BUCKET_LIMIT:
+                # clustered hashes, members already grouped are represented by one of them (the index is left as is)
+                view,seen = compacted.get((nbits,t,key),((),0))
+                kept = {}
+                for j in list(view) + bucket[seen:]:
+                    kept.setdefault(root(members[j]),j)
+                bucket = list(kept.values())
+                compacted[nbits,t,key] = (bucket,len(table[key]))
+            for j in bucket:
+                b = root(members[j])
+                if b != i and hamming(h,index.hashes[j])<=radius:
+                    parent[b] = i
+        index.add(h)
+        members.append(i)
+
+    groups = {}
+    for i,text in enumerate(hashes):
+        if len(text)>0:
+            groups.setdefault(root(i),[]).append(i)
+
+    groups = [g for g in groups.values() if len(g)>1]
+    groups.sort(key=len,reverse=True)
+    return groups
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Generation job of the viewer in a separate process
+
+The generator runs in its own process (spawned, wx is not forked), which is
+the leader of a new process group. Cancelling sends it SIGTERM, which ends
+the run like an exception: the pool engine kills the ffmpeg children of its
+workers (they have process groups of their own, see VideoThumbMemory) and
+terminates the pool. After CANCEL_WAIT seconds whatever is left in the group
+of the job is killed (taskkill /T on Windows). Progress comes back over
+a queue and a reader thread hands it to the callbacks at most once per
+INTERVAL seconds. Callbacks are called from that thread, the viewer passes
+them on with wx.CallAfter.
+
+A cancelled run writes no catalogs, the thumbnails finished so far are reused
+by the next run.
+"""
+
+import os
+import time
+import queue
+import signal
+import subprocess
+import threading
+import multiprocessing
+
+INTERVAL = 0.25 # seconds between progress callbacks
+CANCEL_WAIT = 5.0 # seconds a cancelled job has to stop its workers before it is killed
+
+def stop_generation(signum,frame):
+    """SIGTERM handler of the job process, unwinds the run so that its pool is shut down"""
+    signal.signal(signal.SIGTERM,signal.SIG_IGN)
+    raise SystemExit(1)
+
+def generation_main(settings,messages):
+    """Runs in the job process, settings are VideoThumbGenerator arguments"""
+    if hasattr(os,'setsid'):
+        os.setsid()
+        signal.signal(signal.SIGTERM,stop_generation)
+    from VideoThumbGenerator import VideoThumbGenerator
+
+    obj = VideoThumbGenerator(**settings)
+    counts = {'done':0,'failed':0}
+
+    def progress(result):
+        counts['failed' if result['status']=='failed' else 'done'] += 1
+        messages.put(('progress',counts['done'],counts['failed'],obj.total))
+
+    try:
+        obj.run(progress=progress)
+        messages.put(('finished','done',None))
+    except Exception as inst:
+        messages.put(('finished','failed',str(inst)))
+
+class GenerationJob(object):
+    """
+    on_progress(done,failed,total) and on_finished(state,error) with state
+    'done', 'failed' or 'cancelled' are called from a background thread
+    """
+
+    def __init__(self,settings,on_progress=None,on_finished=None,INTERVAL=INTERVAL):
+
+        self.settings = settings
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.INTERVAL = INTERVAL
+        self.cancelled = False
+        self.context = multiprocessing.get_context('spawn')
+        self.messages = self.context.Queue()
+        self.process = None
+        self.thread = None
+
+    def start(self):
+        self.process = self.context.Process(target=generation_main,args=(self.settings,self.messages),daemon=False)
+        self.process.start()
+        self.thread = threading.Thread(target=self.read,daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.process is not None and self.process.is_alive()
+
+    def cancel(self):
+        """Stops the job process, its workers and ffmpeg children"""
+
+        self.cancelled = True
+        if not self.running():
+            return
+        pid = self.process.pid
+        if os.name=='nt':
+            subprocess.call(['taskkill','/F','/T','/PID',str(pid)],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        else:
+            # the job stops the workers of its pool, they are not in its process group
+            self.process.terminate()
+            self.process.join(CANCEL_WAIT)
+            try:
+                # the job process leads its own group (generation_main), the rest of it dies too
+                os.killpg(pid,signal.SIGKILL)
+            except OSError:
+                pass
+        self.process.kill() # in case it did not stop, or setsid had not run yet
+        self.process.join()
+
+    def read(self):
+        """Reader thread, rate-limits progress and reports the end of the job"""
+
+        latest = None
+        last_call = 0.0
+        state,error = 'failed','job process ended without a result'
+        while True:
+            try:
+                message = self.messages.get(timeout=self.INTERVAL)
+            except (queue.Empty,EOFError,OSError):
+                message = None
+                if not self.process.is_alive():
+                    break
+            if self.cancelled:
+                break
+            if message is not None and message[0]=='finished':
+                state,error = message[1],message[2]
+                break
+            if message is not None:
+                latest = message[1:]
+            if latest is not None and time.time()-last_call >= self.INTERVAL:
+                if self.on_progress is not None:
+                    self.on_progress(*latest)
+                latest = None
+                last_call = time.time()
+
+        if self.cancelled:
+            state,error = 'cancelled',None
+        if latest is not None and state=='done' and self.on_progress is not None:
+            self.on_progress(*latest)
+        self.process.join()
+        if self.on_finished is not None:
+            self.on_finished(state,error)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-aware admission of thumbnail jobs
+
+A job holds all extracted frames of a video as full resolution arrays plus a
+large matplotlib figure, so on 4K/8K material a few parallel workers can take
+gigabytes. Every job gets a memory estimate from the probed resolution, the
+number of timepoints and the candidate frames of each, and jobs are only
+started while the estimates of the running ones stay under a budget. A job is
+always started when nothing else runs, so a video larger than the budget is
+processed alone instead of never.
+
+Workers report the peak RSS of each job and the ratio of measured to estimated
+memory is learned as the run goes on. Only the part that grows with the frames
+is scaled, JOB_OVERHEAD stays fixed, and the scale is kept above MIN_SCALE so
+that a run of small measurements cannot turn off the admission.
+
+Jobs are probed in DATA['order'] (largest files first) and the probed ones are
+started most expensive first as workers become free (LPT scheduling). Probes
+and jobs of one device are also kept under DATA['device_limits'].
+
+Every worker leads its own process group with its ffmpeg children, so a run
+that is stopped early kills the ffmpeg runs in flight instead of leaving them
+running. The workers themselves are not killed: one that dies while waiting
+for a task would leave the pool locked.
+"""
+
+import os
+import sys
+import queue
+import signal
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+MB = 1 << 20
+JOB_OVERHEAD = 32*MB # decoder, figure and text objects of a job
+DEFAULT_RESOLUTION = (1920,1080) # when probing did not tell
+MIN_SCALE = 0.5 # learned scale of the frame memory never goes below this
+WAIT = 0.5 # seconds between checks of a stopped source while jobs run
+
+def default_budget():
+    """Half of the physical memory in bytes, None if unknown (no limit)"""
+    try:
+        return os.sysconf('SC_PHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')//2
+    except (ValueError,OSError,AttributeError):
+        return None
+
+def estimate_job_memory(width,height,npoints,SIZE,DPI=100,CANDIDATES=1):
+    """Bytes needed to make the thumbnail of a width x height video with CANDIDATES frames per timepoint"""
+
+    if not (width>0 and height>0):
+        width,height = DEFAULT_RESOLUTION
+    frames = npoints*CANDIDATES*width*height*3 # uint8 RGB from imread
+    resample = width*height*4*4 # float RGBA copy while imshow draws a frame
+    canvas = (SIZE*1.02*DPI)*(SIZE*(height/width)/npoints*1.08*DPI)*4*2 # Agg buffer and its encoder copy
+    return int(frames + resample + canvas + JOB_OVERHEAD)
+
+def worker_group():
+    """Pool initializer, the worker leads a process group with its ffmpeg children (POSIX)"""
+    if hasattr(os,'setpgrp'):
+        os.setpgrp()
+        # a handler and not SIG_IGN, ffmpeg started by the worker gets the default action (exit)
+        signal.signal(signal.SIGUSR1,lambda signum,frame: None)
+        # Pool.terminate ends the worker, whatever handler the parent had
+        signal.signal(signal.SIGTERM,signal.SIG_DFL)
+
+def stop_jobs(pool):
+    """Kills the ffmpeg children of the workers of pool, their jobs fail and the workers stay"""
+    if not hasattr(os,'killpg'):
+        return
+    for process in list(pool._pool):
+        try:
+            os.killpg(process.pid,signal.SIGUSR1)
+        except OSError:
+            pass
+
+def current_rss():
+    """Resident set size of this process in bytes, 0 if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError,ValueError,AttributeError):
+        return 0
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, 0 if unknown"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0 # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform=='darwin' else peak*1024
+
+def reset_peak_rss():
+    """Restarts the peak RSS of this process (Linux), returns False if not possible"""
+    try:
+        with open('/proc/self/clear_refs','w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def measured_call(func,*args):
+    """
+    Runs func(*args) in a worker, returns (result, peak memory of the call in
+    bytes above the RSS before it). The peak is 0 if it could not be measured.
+    """
+
+    base = current_rss()
+    reset = reset_peak_rss()
+    before = peak_rss()
+
+    result = func(*args)
+
+    peak = peak_rss()
+    if base==0 or (not reset and peak<=before):
+        # lifetime peak was reached by an earlier job, this one is unknown
+        return result,0
+    return result,max(0,peak-base)
+
+class MemoryBudget(object):
+
+    def __init__(self,BUDGET):
+        self.BUDGET = BUDGET # bytes, None for no limit
+        self.in_use = 0
+        self.running = 0
+        self.scale = 1.0 # measured / estimated memory above JOB_OVERHEAD of finished jobs
+        self.largest = 0
+
+    def estimate(self,base):
+        return int(JOB_OVERHEAD + max(0,base-JOB_OVERHEAD)*self.scale)
+
+    def fits(self,estimate):
+        return self.running==0 or self.BUDGET is None or self.in_use + estimate <= self.BUDGET
+
+    def acquire(self,estimate):
+        self.in_use += estimate
+        self.running += 1
+
+    def release(self,estimate):
+        self.in_use -= estimate
+        self.running -= 1
+
+    def observe(self,base,peak):
+        """Feedback of the measured peak of a job with base estimate"""
+        if peak>0 and base>JOB_OVERHEAD:
+            ratio = max(0,peak-JOB_OVERHEAD)/(base-JOB_OVERHEAD)
+            self.scale = max(MIN_SCALE,0.7*self.scale + 0.3*ratio)
+            self.largest = max(self.largest,peak)
+
+    def summary(self):
+        limit = 'no limit' if self.BUDGET is None else '%i MB budget' % (self.BUDGET//MB)
+        return '..memory: %s, largest job %i MB, frame memory measured/estimated %.2f' % (limit,self.largest//MB,self.scale)
+
+class ProbeOrder(object):
+    """
+    Videos to probe in DATA['order'], the next one of each device in turn. A
+    source of iter_pool: pop(accept) removes and returns the first video that
+    accept(k) allows (None if none), left() counts the videos not popped yet,
+    rank(k) orders probed jobs before their cost and stopped ends the run.
+    """
+
+    stopped = False
+
+    def __init__(self,order,devices):
+        self.unprobed = {} # device -> deque of (rank, k)
+        for rank,k in enumerate(order):
+            self.unprobed.setdefault(devices[k],deque()).append((rank,k))
+        self.count = len(order)
+
+    def left(self):
+        return self.count
+
+    def pop(self,accept):
+        # earliest head of the devices accept allows, the videos of a device share it
+        heads = [(files[0][0],device) for device,files in self.unprobed.items() if len(files)>0 and accept(files[0][1])]
+        if len(heads)==0:
+            return None
+        self.count -= 1
+        return self.unprobed[min(heads)[1]].popleft()[1]
+
+    def rank(self,k):
+        return 0
+
+def iter_pool(DATA,NWORKERS,BUDGET,POOL=None,tuner=None,source=None):
+    """
+    Pool engine with memory admission, yields thumbnail_job results as they
+    finish (with the measured 'memory' of the job in bytes). Videos are probed
+    a few ahead of the extraction jobs, which are started most expensive first
+    while they fit the budget and the limit of their device. POOL is a running
+    multiprocessing.Pool of NWORKERS to use instead of a new one, it is left
+    running. A ConcurrencyTuner (see VideoThumbTuner) sets how many of the
+    NWORKERS are used. source gives the videos in another order than
+    DATA['order'] (see ProbeOrder and VideoThumbPriority).
+    """
+
+    from VideoThumbGenerator import probe_metadata,job_function,new_result,probed_cost
+
+    N = len(DATA['allfiles'])
+    job = job_function(DATA)
+    npoints = len(DATA['TIMEPOINTS'])
+    budget = MemoryBudget(BUDGET)
+    done = queue.Queue()
+    devices = DATA.get('devices') or [None]*N
+    if source is None:
+        source = ProbeOrder(DATA.get('order',range(N)),devices)
+    limits = DATA.get('device_limits') or {}
+    busy = {} # device -> probes and jobs running on it
+
+    def device_free(device):
+        return device not in limits or busy.get(device,0)<limits[device]
+
+    def submit(k,stage,func,args,value=None):
+        running[k] = value
+        busy[devices[k]] = busy.get(devices[k],0) + 1
+        pool.apply_async(func,args,
+                         callback=lambda result: done.put((k,stage,result)),
+                         error_callback=lambda error: done.put((k,stage,error)))
+
+    def next_probe():
+        # next video of a free device that does not have enough probed already
+        return source.pop(lambda k: device_free(devices[k]) and sum(devices[x[1]]==devices[k] for x in probed)<limit)
+
+    def next_job():
+        # first ranked, then most expensive probed job of a free device
+        ready = [entry for entry in probed if device_free(devices[entry[1]])]
+        return min(ready,key=lambda entry: (source.rank(entry[1]),entry[0],entry[1])) if len(ready)>0 else None
+
+    running = {}
+    # leaving the with block (also when the consumer stops iterating) terminates the workers
+    with (Pool(processes=NWORKERS,initializer=worker_group) if POOL is None else nullcontext(POOL)) as pool:
+        try:
+            probed = [] # (-cost, k, metadata, base estimate), a few per device
+            limit = NWORKERS if tuner is None else tuner.limit
+            while not source.stopped and (source.left()>0 or len(probed)>0 or len(running)>0):
+                while len(running)<limit:
+                    entry = next_job()
+                    if entry is not None and budget.fits(budget.estimate(entry[3])):
+                        probed.remove(entry)
+                        _,k,metadata,base = entry
+                        estimate = budget.estimate(base)
+                        budget.acquire(estimate)
+                        submit(k,'job',measured_call,(job,k,DATA,metadata),(base,estimate))
+                        continue
+                    k = next_probe()
+                    if k is None:
+                        break
+                    submit(k,'probe',probe_metadata,(DATA['allfiles'][k],DATA['FFMPEG_PATH'],DATA.get('DECODER','ffmpeg')))
+
+                try:
+                    k,stage,result = done.get(timeout=WAIT)
+                except queue.Empty:
+                    # the source may have been stopped or reordered meanwhile
+                    continue
+                busy[devices[k]] -= 1
+                if stage=='probe':
+                    del running[k]
+                    if isinstance(result,BaseException):
+                        result = {'duration':0,'width':0,'height':0}
+                    width,height = result['width'],result['height']
+                    probed.append((-probed_cost(result['duration'],width,height),k,result,estimate_job_memory(width,height,npoints,DATA['SIZE'],CANDIDATES=DATA['CANDIDATES'])))
+                    continue
+
+                base,estimate = running.pop(k)
+                budget.release(estimate)
+                if tuner is not None:
+                    limit = tuner.observe()
+                if isinstance(result,BaseException):
+                    error = result
+                    result = new_result(k,DATA['allfiles'][k],DATA['THUMBFOLDER'] + os.sep + DATA['alloutfiles'][k])
+                    result['error'] = str(error)
+                    yield result
+                    continue
+                result,peak = result
+                result['memory'] = peak
+                if result['status']=='done':
+                    budget.observe(base,peak)
+                yield result
+        finally:
+            if len(running)>0:
+                # stopped early, ffmpeg of the jobs in flight would run on
+                stop_jobs(pool)
+
+    print(budget.summary())
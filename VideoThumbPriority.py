@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Thumbnails in the order the viewer needs them
+
+When the viewer opens a folder without a catalog, videos are found with a
+quick scan and shown as placeholders right away. Thumbnail jobs then go
+through a priority queue: the viewer moves the visible page and its
+neighbours to the front whenever the page changes, the rest of the library
+follows in scan order. The scan and the search for copies and old thumbnails
+run in the background thread too, the viewer gets the placeholder rows when
+they are done. Jobs go through the pool engine (memory admission, device
+limits, tuner and killing ffmpeg on stop, see iter_pool) in this order, with
+a pool spawned for the run (wx is not forked, as in VideoThumbJobs). Rows are
+passed back as jobs finish and the catalogs are written when all jobs are
+done.
+"""
+
+import heapq
+import threading
+import multiprocessing
+from VideoThumbGenerator import print_result,attach_copies,file_devices,device_limits
+from VideoThumbCatalog import read_known_rows,write_catalogs,clear_changes
+
+NORMAL = 1
+URGENT = 0
+
+class PriorityGenerator(object):
+    """
+    Catalog indices used here are positions in skeleton(). on_planned(rows)
+    with the rows of skeleton(), on_result(index,row) and on_finished(rows)
+    are called from a background thread.
+    """
+
+    def __init__(self,generator,on_planned=None,on_result=None,on_finished=None):
+
+        self.generator = generator
+        self.on_planned = on_planned
+        self.on_result = on_result
+        self.on_finished = on_finished
+
+        self.oldrows = []
+        self.DATA = {'allfiles':[],'alloutfiles':[]}
+        self.offset = 0
+        self.results = []
+        self.queued = set()
+        self.priority = {}
+        self.devices = []
+        self.heaps = {} # device -> heap of (rank, position, k)
+        self.urgent = set()
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def plan(self):
+        """Scan of the folder, copies and old thumbnails, this reads the files and takes a while"""
+
+        generator = self.generator
+        self.OUTTIMES,self.THUMBFOLDER = generator.setup()
+        allfiles = generator.filesearch(generator.INFOLDER,[])
+        oldrows,newfiles,alloutfiles,self.copies = generator.plan(allfiles,read_known_rows(generator.OUTPATH),self.THUMBFOLDER)
+        DATA = generator.job_data(newfiles,alloutfiles,self.THUMBFOLDER)
+        DATA['devices'] = file_devices(newfiles)
+        DATA['device_limits'] = device_limits(DATA['devices'],generator.DEVICE_JOBS)
+
+        with self.condition:
+            self.oldrows = oldrows
+            self.DATA = DATA
+            self.offset = len(oldrows) # jobs come after the rows of old thumbnails
+            self.results = [[] for _ in newfiles]
+            self.queued = set(range(len(newfiles)))
+            self.priority = {k:(NORMAL,k) for k in range(len(newfiles))}
+            self.devices = DATA['devices']
+            self.heaps = {}
+            for k,device in enumerate(self.devices):
+                self.heaps.setdefault(device,[]).append((NORMAL,k,k)) # sorted, so already a heap
+
+    def skeleton(self):
+        """Rows of all videos, the ones still to be made have no duration"""
+        return self.oldrows + [{'folder':self.THUMBFOLDER,'name':name,'video':video,'duration':''}
+                               for video,name in zip(self.DATA['allfiles'],self.DATA['alloutfiles'])]
+
+    def pending(self):
+        """Indices that have no thumbnail yet"""
+        with self.condition:
+            return set(self.offset + k for k in range(len(self.results)) if len(self.results[k])==0)
+
+    def start(self):
+        # daemon thread, closing the viewer does not wait for the library
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Ends the run, ffmpeg of the jobs in flight is killed (see iter_pool)"""
+        with self.condition:
+            self.stopped = True
+
+    def prioritize(self,indices):
+        """Indices in order of urgency (visible page first), replaces the previous call"""
+
+        with self.condition:
+            for k in self.urgent:
+                self.priority[k] = (NORMAL,k)
+                if k in self.queued:
+                    heapq.heappush(self.heaps[self.devices[k]],(NORMAL,k,k))
+            self.urgent = set()
+            for position,i in enumerate(indices):
+                k = i - self.offset
+                # probed jobs that wait for a worker are ranked again too
+                if k in self.priority and k not in self.urgent:
+                    self.urgent.add(k)
+                    self.priority[k] = (URGENT,position)
+                    if k in self.queued:
+                        heapq.heappush(self.heaps[self.devices[k]],(URGENT,position,k))
+
+    # source of iter_pool, see VideoThumbMemory.ProbeOrder
+
+    def left(self):
+        with self.condition:
+            return len(self.queued)
+
+    def pop(self,accept):
+        """Most urgent queued job that accept(k) allows, None if none"""
+        with self.condition:
+            # accept only depends on the device, so the head of each device decides for all its videos
+            heads = []
+            for heap in self.heaps.values():
+                # entries of earlier priorities are left in the heap and dropped here
+                while len(heap)>0 and (heap[0][2] not in self.queued or self.priority[heap[0][2]]!=heap[0][:2]):
+                    heapq.heappop(heap)
+                if len(heap)>0 and accept(heap[0][2]):
+                    heads.append(heap)
+            if len(heads)==0:
+                return None
+            k = heapq.heappop(min(heads,key=lambda heap: heap[0]))[2]
+            self.queued.discard(k)
+            return k
+
+    def rank(self,k):
+        with self.condition:
+            return self.priority[k]
+
+    def run(self):
+        from VideoThumbMemory import iter_pool,worker_group
+
+        try:
+            self.plan()
+            rows = self.skeleton()
+        except Exception as inst:
+            print('... scan failed: %s' % str(inst))
+            rows = []
+        if self.stopped:
+            return
+        if self.on_planned is not None:
+            self.on_planned(rows)
+        if len(rows)==0:
+            return
+
+        generator = self.generator
+        NWORKERS = max(1,generator.workers())
+        tuner = None
+        if generator.AUTOTUNE or generator.NWORKERS<=0:
+            from VideoThumbTuner import ConcurrencyTuner
+            tuner = ConcurrencyTuner(NWORKERS)
+        pool = generator.POOL
+        if pool is None:
+            # a fork would copy the wx process into the workers
+            pool = multiprocessing.get_context('spawn').Pool(NWORKERS,initializer=worker_group)
+        try:
+            # memory admission, device limits and the tuner as in a normal run, only the order is ours
+            for result in iter_pool(self.DATA,NWORKERS,generator.memory_budget(),pool,tuner,source=self):
+                print_result(result)
+                k = result['index']
+                with self.condition:
+                    self.results[k] = result['row']
+                if self.on_result is not None:
+                    self.on_result(self.offset + k,result['row'])
+        finally:
+            if pool is not generator.POOL:
+                pool.terminate()
+        if self.stopped:
+            return
+
+        rows = attach_copies(self.oldrows + [row for row in self.results if len(row)>0],self.copies)
+        write_catalogs(self.generator.OUTPATH,rows,self.OUTTIMES)
+        clear_changes(self.generator.OUTPATH)
+        if self.on_finished is not None:
+            self.on_finished(rows)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of generator workers and viewer paint paths
+
+Generator (PROFILE, --profile FILE): every thumbnail job runs under cProfile in
+its worker and the worker profiles are merged into one pstats FILE at the end
+of the run (python -m pstats FILE). Each job also records its CPU time (worker
+and ffmpeg children) against its wall time and the bytes ffmpeg read, from
+/proc/<pid>/io of the children (Linux, PyAV reads in the worker and is not
+counted). These go to FILE.jobs. With the asyncio engine only the compositing
+runs in workers, so only it is profiled.
+
+Viewer (environment variable VIDEOTHUMB_PROFILE=1): duration of every call of
+the functions decorated with profiled(), e.g. MegaImageRenderer.Draw and
+SetData, and the event loop lag, printed every REPORT_INTERVAL seconds.
+"""
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import functools
+
+JOB = None # counters of the profiled job running in this process
+REPORT_INTERVAL = 10.0 # seconds between viewer reports
+
+def read_io(pid):
+    """(bytes read, bytes read from storage) of a process from /proc/<pid>/io, zeros if unknown"""
+    values = {}
+    try:
+        with open('/proc/%i/io' % pid) as f:
+            for line in f:
+                key,value = line.split(':')
+                values[key] = int(value)
+    except (OSError,ValueError):
+        pass
+    return values.get('rchar',0),values.get('read_bytes',0)
+
+def run_counted(cmd):
+    """subprocess.run of an ffmpeg command that adds the bytes it read to JOB, returns stderr as text"""
+
+    process = subprocess.Popen(cmd,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    process.stderr.close()
+    if hasattr(os,'waitid'):
+        # exited but not reaped, its /proc entry is still there
+        os.waitid(os.P_PID,process.pid,os.WEXITED | os.WNOWAIT)
+        read,disk = read_io(process.pid)
+        JOB['read'] += read
+        JOB['disk'] += disk
+    process.wait()
+    return str(stderr)
+
+def profiled_call(PROFILE_DIR,func,*args):
+    """func(*args) under cProfile, the profile is written into PROFILE_DIR"""
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args)
+    finally:
+        profile.disable()
+        handle,filename = tempfile.mkstemp(suffix='.prof',dir=PROFILE_DIR)
+        os.close(handle)
+        profile.dump_stats(filename)
+
+def profiled_job(k,DATA,metadata=None):
+    """thumbnail_job under cProfile, the result gets 'cpu' seconds and 'read'/'disk' bytes of ffmpeg"""
+    global JOB
+    from VideoThumbGenerator import thumbnail_job
+
+    JOB = {'read':0,'disk':0}
+    before = os.times()
+    try:
+        result = profiled_call(DATA['PROFILE_DIR'],thumbnail_job,k,DATA,metadata)
+    finally:
+        after = os.times()
+        counters,JOB = JOB,None
+    # user and system time of this worker and of its reaped ffmpeg children
+    result['cpu'] = sum(after[:4])-sum(before[:4])
+    result['read'] = counters['read']
+    result['disk'] = counters['disk']
+    return result
+
+class JobProfile(object):
+    """Collects the results of a profiled run, close() merges and reports"""
+
+    def __init__(self,PROFILE):
+        self.PROFILE = PROFILE
+        self.folder = tempfile.mkdtemp(prefix='videothumb_profile_')
+        self.results = []
+
+    def add(self,result):
+        self.results.append(result)
+
+    def close(self):
+        import pstats
+
+        try:
+            files = [self.folder + os.sep + x for x in os.listdir(self.folder)]
+            if len(files)>0:
+                stats = pstats.Stats(files[0])
+                for file in files[1:]:
+                    stats.add(file)
+                stats.dump_stats(self.PROFILE)
+                print('\n..profile: %i worker profiles merged into %s' % (len(files),self.PROFILE))
+                stats.sort_stats('cumulative').print_stats(15)
+        finally:
+            shutil.rmtree(self.folder,ignore_errors=True)
+
+        with open(self.PROFILE + '.jobs','w',encoding='utf-8') as f:
+            f.write('status\twall\tcpu\tread\tdisk\tvideo\n')
+            for result in self.results:
+                f.write('%s\t%.3f\t%.3f\t%i\t%i\t%s\n' % (result['status'],result['elapsed'],result.get('cpu',0.0),
+                                                          result.get('read',0),result.get('disk',0),result['video']))
+        wall = sum(x['elapsed'] for x in self.results)
+        cpu = sum(x.get('cpu',0.0) for x in self.results)
+        read = sum(x.get('read',0) for x in self.results)
+        disk = sum(x.get('disk',0) for x in self.results)
+        print('..profile: %i jobs, wall %.1fs, cpu %.1fs (%.0f%% of wall), ffmpeg read %.1f MB (%.1f MB from storage), per job in %s' %
+              (len(self.results),wall,cpu,100*cpu/max(wall,1e-6),read/2**20,disk/2**20,self.PROFILE + '.jobs'))
+
+class UiProfile(object):
+    """Call durations and event loop lag of the viewer"""
+
+    def __init__(self):
+        self.calls = {} # name -> [count, total, largest] seconds
+        self.lag = [0,0.0,0.0]
+        self.last_tick = None
+        self.last_report = time.time()
+
+    def add(self,name,seconds,entry=None):
+        entry = self.calls.setdefault(name,[0,0.0,0.0]) if entry is None else entry
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2],seconds)
+
+    def tick(self,interval):
+        """Called by a timer of interval seconds, the extra delay is the event loop lag"""
+        now = time.perf_counter()
+        if self.last_tick is not None:
+            self.add(None,max(0.0,now-self.last_tick-interval),self.lag)
+        self.last_tick = now
+        if time.time()-self.last_report > REPORT_INTERVAL:
+            self.report()
+
+    def report(self):
+        self.last_report = time.time()
+        lines = ['%-32s %6i calls %8.2f ms mean %8.2f ms max' % (name,count,1000*total/count,1000*largest)
+                 for name,(count,total,largest) in sorted(self.calls.items()) if count>0]
+        count,total,largest = self.lag
+        if count>0:
+            lines.append('%-32s %6i ticks %8.2f ms mean %8.2f ms max' % ('event loop lag',count,1000*total/count,1000*largest))
+        print('..ui profile:\n' + '\n'.join(lines))
+        sys.stdout.flush()
+        self.calls = {}
+        self.lag = [0,0.0,0.0]
+
+UI = UiProfile() if os.environ.get('VIDEOTHUMB_PROFILE') else None
+
+def profiled(name):
+    """Decorator that times every call when the viewer is profiled, no-op otherwise"""
+    def decorate(func):
+        if UI is None:
+            return func
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                UI.add(name,time.perf_counter()-start)
+        return wrapper
+    return decorate
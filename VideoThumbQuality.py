@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Choice between candidate frames of a timepoint
+
+Fixed TIMEPOINTS often land on a fade, a black frame or a title card. The
+extraction gives CANDIDATES frames from each timepoint on, STEP seconds apart
+(in the same ffmpeg run or PyAV session, see frames_command), and the frame
+with the best score is kept. Scores come from a subsampled luma image:
+    contrast  standard deviation of luma
+    edges     mean absolute difference of neighbouring pixels
+Nearly black, nearly white and flat frames are rejected, they are only kept
+if every candidate of the timepoint was rejected. Scores within TOLERANCE of
+the best go to the frame closest to the timepoint.
+"""
+
+import numpy as np
+
+DARK = 0.08 # mean luma (0-1) below this is a black frame
+BRIGHT = 0.95 # and above this a white one
+FLAT = 0.03 # luma standard deviation below this is a blank frame
+SAMPLE_WIDTH = 160 # pixels, frames are subsampled to about this width
+TOLERANCE = 0.2 # relative score difference that counts as a tie
+
+def luma(img):
+    """Subsampled luma (0-1) of an RGB(A) or gray frame, uint8 or float"""
+    scale = 1/255.0 if img.dtype.kind in 'ui' else 1.0
+    step = max(1,img.shape[1]//SAMPLE_WIDTH)
+    img = img[::step,::step]
+    if img.ndim==3:
+        return img[:,:,:3].astype(np.float32) @ np.array([0.299*scale,0.587*scale,0.114*scale],dtype=np.float32)
+    return img.astype(np.float32)*scale
+
+def frame_score(img):
+    """(accepted, score) of a frame, higher scores have more contrast and detail"""
+    y = luma(img)
+    mean = float(y.mean())
+    contrast = float(y.std())
+    edges = float(np.abs(np.diff(y,axis=0)).mean() + np.abs(np.diff(y,axis=1)).mean())
+    accepted = DARK<=mean<=BRIGHT and contrast>=FLAT
+    return accepted,contrast + edges
+
+def best_frame(frames):
+    """Index of the best frame, rejected ones only win over rejected ones, None if all are None"""
+    scores = [(j,)+frame_score(img) for j,img in enumerate(frames) if img is not None]
+    if len(scores)==0:
+        return None
+    accepted = [x for x in scores if x[1]] or scores
+    best = max(x[2] for x in accepted)
+    return min(j for j,_,score in accepted if score>=(1-TOLERANCE)*best)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental substring search over video paths
+
+The index maps every trigram of the (lowercase) paths to the sorted list of
+paths that contain it. A query is answered by intersecting the posting lists
+of its trigrams and checking the few remaining candidates. When a query only
+extends the previous one (typing), the previous result set is narrowed
+instead of going back to the index.
+"""
+
+from array import array
+
+def trigrams(text):
+    return set(text[i:i+3] for i in range(len(text)-2))
+
+class TrigramIndex(object):
+
+    def __init__(self,texts):
+        self.texts = [x.lower() for x in texts]
+        postings = {}
+        for i,text in enumerate(self.texts):
+            for gram in trigrams(text):
+                postings.setdefault(gram,[]).append(i)
+        # compact unsigned int arrays, ids are appended in order so they are sorted
+        self.postings = {gram:array('I',ids) for gram,ids in postings.items()}
+        self.last_terms = []
+        self.last_result = None
+
+    def add(self,texts):
+        """Appends texts, their ids continue from the current ones"""
+        for text in texts:
+            i = len(self.texts)
+            self.texts.append(text.lower())
+            for gram in trigrams(self.texts[i]):
+                self.postings.setdefault(gram,array('I')).append(i)
+        self.last_terms = []
+        self.last_result = None
+
+    def candidates(self,term):
+        """Ids whose text may contain term"""
+        grams = trigrams(term)
+        if len(grams)==0:
+            return range(len(self.texts))
+        lists = sorted((self.postings.get(gram,()) for gram in grams),key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            if len(result)==0:
+                break
+            result.intersection_update(ids)
+        return result
+
+    def search(self,query):
+        """Sorted ids of texts containing every whitespace separated term of query, None for an empty query"""
+
+        terms = query.lower().split()
+        if len(terms)==0:
+            self.last_terms = []
+            self.last_result = None
+            return None
+
+        narrowing = self.last_result is not None and all(any(old in new for new in terms) for old in self.last_terms)
+        if narrowing:
+            ids = self.last_result
+        else:
+            ids = sorted(self.candidates(max(terms,key=len)))
+
+        texts = self.texts
+        for term in sorted(terms,key=len,reverse=True):
+            ids = [i for i in ids if term in texts[i]]
+
+        self.last_terms = terms
+        self.last_result = ids
+        return ids
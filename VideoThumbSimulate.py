@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Scale simulation of generator runs
+
+Planning, scheduling and catalog writing can not be tried on a million videos
+if every run has to decode real video. This builds a synthetic library of
+sparse placeholder files and a stand-in ffmpeg, and times the phases of a
+generator run separately:
+    scan      filesearch of INFOLDER
+    plan      duplicate detection and matching against the catalog
+    dispatch  the thumbnail jobs (stand-in ffmpeg and compositing of tiny frames)
+    catalog   writing the catalogs
+The stand-in answers probes with a Duration and a Video stream line and writes
+a tiny JPEG for frames, after a tunable latency and with tunable failure
+rates. Durations are derived from the path, so repeated runs agree. A part of
+the library can be given an existing catalog (--known), as only the new
+videos of a run are dispatched.
+
+USAGE:
+    python VideoThumbSimulate.py [--files N] [--known F] [--latency S] [--workers N] [--check]
+
+With --check the exit status is 1 if a phase takes longer per file than its
+budget in BUDGETS. Use --known 0 to time the dispatch of a first run over the
+whole library. The stand-in is a Python script named ffmpeg, so a POSIX
+system is needed.
+"""
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+
+# microseconds per video for --check, dispatch is per dispatched job and
+# without the stand-in ffmpeg time (pool, compositing and result handling)
+BUDGETS = {
+    'scan': 100,
+    'plan': 300,
+    'dispatch': 200000,
+    'catalog': 100,
+    }
+FILES_PER_FOLDER = 200
+
+STAND_IN = r'''#!{python}
+# stand-in ffmpeg of VideoThumbSimulate, nothing is decoded
+import sys,time,zlib,random
+LATENCY = {latency!r}
+JITTER = {jitter!r}
+PROBE_FAILURES = {probe_failures!r}
+FRAME_FAILURES = {frame_failures!r}
+FRAME = bytes.fromhex('{frame}')
+
+args = sys.argv[1:]
+video = args[args.index('-i')+1]
+key = zlib.crc32(video.encode('utf8'))
+time.sleep(max(0.0,LATENCY*(1+JITTER*random.uniform(-1,1))))
+outputs = [(args[i+2],int(args[i+1])) for i,x in enumerate(args) if x in ('-vframes','-frames:v')]
+if len(outputs)>0:
+    if (key>>16) % 10000 >= FRAME_FAILURES*10000:
+        for output,count in outputs:
+            # numbered candidate frames (candidate_files) or a single file
+            for name in ([output % (j+1) for j in range(count)] if '%d' in output else [output]):
+                with open(name,'wb') as f:
+                    f.write(FRAME)
+    sys.exit(0)
+sys.stderr.write('Input #0, mov,mp4,m4a,3gp,3g2,mj2, from %r:\n' % video)
+if key % 10000 >= PROBE_FAILURES*10000:
+    seconds = 10 + key % 7200
+    sys.stderr.write('  Duration: %02i:%02i:%02i.00, start: 0.000000, bitrate: 1000 kb/s\n' % (seconds//3600,seconds//60%60,seconds%60))
+    sys.stderr.write('    Stream #0:0(und): Video: h264 (High), yuv420p, 1920x1080, 25 fps\n')
+'''
+
+def tiny_jpeg():
+    """Bytes of a 64x36 JPEG"""
+    import io
+    import numpy as np
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    plt.imsave(buffer,np.full((36,64,3),128,dtype=np.uint8),format='jpg')
+    return buffer.getvalue()
+
+def write_stand_in(folder,latency=0.0,jitter=0.5,probe_failures=0.0,frame_failures=0.0):
+    """Writes the stand-in ffmpeg into folder, returns the FFMPEG_PATH for it"""
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    filename = folder + os.sep + 'ffmpeg'
+    with open(filename,'w') as f:
+        f.write(STAND_IN.format(python=sys.executable,latency=latency,jitter=jitter,probe_failures=probe_failures,
+                                frame_failures=frame_failures,frame=tiny_jpeg().hex()))
+    os.chmod(filename,0o755)
+    return folder + os.sep
+
+def build_library(INFOLDER,N,duplicates=0.0,seed=0):
+    """
+    N placeholder videos in folders of FILES_PER_FOLDER. Files are sparse with
+    distinct sizes like real videos, a duplicates share of them are hardlinks.
+    Returns the paths.
+    """
+    import random
+
+    rng = random.Random(seed)
+    files = []
+    for i in range(N):
+        folder = INFOLDER + os.sep + 'd%03i' % (i//(FILES_PER_FOLDER*FILES_PER_FOLDER)) + os.sep + 'd%03i' % (i//FILES_PER_FOLDER % FILES_PER_FOLDER)
+        if i % FILES_PER_FOLDER == 0:
+            os.makedirs(folder,exist_ok=True)
+        file = folder + os.sep + 'clip_%07i.mp4' % i
+        if len(files)>0 and rng.random()<duplicates:
+            os.link(rng.choice(files),file)
+        else:
+            with open(file,'wb') as f:
+                f.write(b'placeholder %i\n' % i)
+                f.truncate((1 << 20) + 4099*i + rng.randrange(4096))
+        files.append(file)
+    return files
+
+def build_catalog(OUTPATH,files,OUTTIMES=(2,15)):
+    """Catalog rows and thumbnails (hardlinks of one JPEG) as if files were done by an earlier run"""
+    import zlib
+    from VideoThumbCatalog import THUMB_FOLDER,write_catalogs
+
+    THUMBFOLDER = OUTPATH + os.sep + THUMB_FOLDER
+    os.makedirs(THUMBFOLDER,exist_ok=True)
+    frame = tiny_jpeg()
+    template = None
+
+    rows = []
+    for i,file in enumerate(files):
+        name = 'known_%07i.jpg' % i
+        try:
+            os.link(template,THUMBFOLDER + os.sep + name)
+        except (OSError,TypeError):
+            # first file, or the link limit of the file system was reached
+            template = THUMBFOLDER + os.sep + name
+            with open(template,'wb') as f:
+                f.write(frame)
+        stat = os.stat(file)
+        rows.append({'folder':THUMBFOLDER,'name':name,'video':file,'duration':str(10 + zlib.crc32(file.encode('utf8')) % 7200),
+                     'phash':'','size':str(stat.st_size),'mtime':'%.0f' % stat.st_mtime,'width':'64','height':'36','copies':''})
+    write_catalogs(OUTPATH,rows,OUTTIMES)
+
+def stand_in_call(FFMPEG_PATH,repeats=5):
+    """Seconds of one stand-in probe, its interpreter start included"""
+    from VideoThumbGenerator import run_ffmpeg,duration_command
+
+    start_time = time.time()
+    for _ in range(repeats):
+        run_ffmpeg(duration_command('probe.mp4',FFMPEG_PATH))
+    return (time.time()-start_time)/repeats
+
+def simulate(N=10000,known=0.99,latency=0.0,NWORKERS=2,probe_failures=0.01,frame_failures=0.01,duplicates=0.01,FOLDER=None):
+    """Builds a library of N videos and times one generator run, returns {phase: seconds} and counts"""
+    import random
+    from VideoThumbGenerator import VideoThumbGenerator,attach_copies
+    from VideoThumbCatalog import read_known_rows,write_catalogs
+
+    FOLDER = tempfile.mkdtemp(prefix='videothumb_sim_',dir=FOLDER)
+    INFOLDER = FOLDER + os.sep + 'library'
+    OUTPATH = FOLDER + os.sep + 'output'
+    try:
+        print('... building %i placeholder videos' % N)
+        files = build_library(INFOLDER,N,duplicates)
+        old = random.Random(1).sample(files,int(known*N))
+        build_catalog(OUTPATH,old)
+        FFMPEG_PATH = write_stand_in(FOLDER + os.sep + 'bin',latency,probe_failures=probe_failures,frame_failures=frame_failures)
+
+        # small figures, compositing should not hide the orchestration
+        obj = VideoThumbGenerator(INFOLDER=INFOLDER,OUTPATH=OUTPATH,FFMPEG_PATH=FFMPEG_PATH,NWORKERS=NWORKERS,SIZE=2,DECODER='ffmpeg')
+        times = {}
+
+        start_time = time.time()
+        OUTTIMES,THUMBFOLDER = obj.setup()
+        allfiles = obj.filesearch(INFOLDER,[])
+        times['scan'] = time.time()-start_time
+
+        start_time = time.time()
+        oldrows,newfiles,alloutfiles,copies = obj.plan(allfiles,read_known_rows(OUTPATH),THUMBFOLDER)
+        times['plan'] = time.time()-start_time
+
+        start_time = time.time()
+        results = list(obj.iter_jobs(newfiles,alloutfiles,THUMBFOLDER))
+        times['dispatch'] = time.time()-start_time
+
+        start_time = time.time()
+        rows = attach_copies(oldrows + [x['row'] for x in sorted(results,key=lambda x: x['index']) if len(x['row'])>0],copies)
+        write_catalogs(OUTPATH,rows,OUTTIMES)
+        times['catalog'] = time.time()-start_time
+
+        # a probe and one frames run per video, failed frames are tried again one at a time
+        calls = sum(1 if x['error'] in ('zero duration','too short') else 2 if x['status']!='failed' else 2 + len(obj.TIMEPOINTS) for x in results)
+        counts = {'files':len(allfiles),'jobs':len(results),'failed':sum(x['status']=='failed' for x in results),
+                  'rows':len(rows),'ideal':calls*stand_in_call(FFMPEG_PATH)/max(1,obj.workers())}
+        return times,counts
+    finally:
+        shutil.rmtree(FOLDER,ignore_errors=True)
+
+def report(times,counts,budgets=BUDGETS):
+    """Prints the phases, returns False if a phase is over its budget"""
+
+    ok = True
+    print('\n%i videos, %i jobs (%i failed), %i catalog rows' % (counts['files'],counts['jobs'],counts['failed'],counts['rows']))
+    print('%-10s %10s %14s %10s' % ('phase','seconds','us per video','budget'))
+    print('(dispatch: overhead per job over the stand-in ffmpeg time)')
+    for phase in ('scan','plan','dispatch','catalog'):
+        if phase=='dispatch':
+            per_file = 1e6*(times[phase]-counts['ideal'])/max(1,counts['jobs'])
+        else:
+            per_file = 1e6*times[phase]/max(1,counts['files'])
+        budget = budgets.get(phase)
+        status = ''
+        if budget is not None:
+            status = '%i' % budget
+            if per_file>budget:
+                status += ' OVER'
+                ok = False
+        print('%-10s %10.2f %14.1f %10s' % (phase,times[phase],per_file,status))
+    if counts['jobs']>0:
+        print('%.2fs of the dispatch is stand-in ffmpeg time' % counts['ideal'])
+    return ok
+
+def main(argv=None):
+    import optparse
+
+    prs = optparse.OptionParser(usage=__doc__.split('USAGE:')[1].split('\n\n')[0])
+    prs.add_option('--files',dest='files',type='int',default=10000,help='videos in the library')
+    prs.add_option('--known',dest='known',type='float',default=0.99,help='share of videos in the existing catalog')
+    prs.add_option('--latency',dest='latency',type='float',default=0.0,help='seconds of every stand-in ffmpeg call')
+    prs.add_option('--probe-failures',dest='probe_failures',type='float',default=0.01,help='share of videos without a duration')
+    prs.add_option('--frame-failures',dest='frame_failures',type='float',default=0.01,help='share of videos whose frames fail')
+    prs.add_option('--duplicates',dest='duplicates',type='float',default=0.01,help='share of videos that are hardlinks of others')
+    prs.add_option('--workers',dest='nworkers',type='int',default=2)
+    prs.add_option('--folder',dest='folder',default=None,help='parent folder of the temporary library, e.g. on the disk to measure')
+    prs.add_option('--check',dest='check',action='store_true',default=False,help='exit status 1 if a phase is over its budget')
+    argv = list(argv) if argv is not None else sys.argv[1:]
+    (opts, args) = prs.parse_args(args=argv)
+
+    times,counts = simulate(opts.files,opts.known,opts.latency,opts.nworkers,opts.probe_failures,opts.frame_failures,opts.duplicates,opts.folder)
+    ok = report(times,counts)
+    return 1 if opts.check and not ok else 0
+
+if __name__ == '__main__':
+    __spec__ = "ModuleSpec(name='builtins', loader=<class '_frozen_importlib.BuiltinImporter'>)"
+    sys.exit(main(argv=sys.argv[1:]))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar in-memory catalog for the viewer
+
+Numeric catalog fields are kept as NumPy arrays and paths are split into a
+table of unique directories plus interned file names, which is much smaller
+than one Python string per path and field. Sort permutations are computed
+once per sort key combination and cached, so re-sorting is an index swap.
+
+Rows can be appended and removed while the viewer is open (watch mode).
+Removed rows are only marked dead so that indices held by the viewer stay
+valid.
+
+Search texts can filter on the video metadata, e.g. 'codec:h264 height>=1080
+fps>30' (see parse_filters), the other words are searched in the paths.
+"""
+
+import os
+import os.path
+import re
+import sys
+import operator
+import numpy as np
+
+NUMERIC_FIELDS = ('duration','size','mtime','width','height','fps','bitrate','video_width','video_height')
+# filter names of parse_filters, width and height of a video are its frame size
+FILTER_FIELDS = {'duration':'duration','size':'size','mtime':'mtime','fps':'fps','bitrate':'bitrate',
+                 'width':'video_width','height':'video_height','codec':'codec'}
+OPERATORS = {':':operator.eq,'=':operator.eq,'>=':operator.ge,'<=':operator.le,'>':operator.gt,'<':operator.lt}
+FILTER = re.compile(r'^([a-z]+)(:|>=|<=|=|>|<)(.+)$')
+
+def to_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+def parse_filters(text):
+    """
+    Splits a search text into conditions (catalog field, operator, value) and
+    the remaining words, e.g. 'holiday codec:h264 height>=1080' gives
+    [('codec',operator.eq,'h264'),('video_height',operator.ge,1080.0)] and 'holiday'
+    """
+
+    conditions = []
+    words = []
+    for word in text.split():
+        match = FILTER.match(word.lower())
+        if match is not None and match.group(1) in FILTER_FIELDS:
+            field,value = FILTER_FIELDS[match.group(1)],match.group(3)
+            if field=='codec':
+                if match.group(2) in (':','='):
+                    conditions.append((field,operator.eq,value))
+                    continue
+            elif not np.isnan(to_number(value)):
+                conditions.append((field,OPERATORS[match.group(2)],to_number(value)))
+                continue
+        words.append(word)
+    return conditions,' '.join(words)
+
+class PathTable(object):
+    """Paths stored as (directory index, interned file name)"""
+
+    def __init__(self,paths):
+        self.dirs = []
+        self.dir_lookup = {}
+        self.dir_index = np.empty(0,dtype=np.int32)
+        self.files = []
+        self.extend(paths)
+
+    def extend(self,paths):
+        dirs = self.dir_lookup
+        dir_index = np.empty(len(paths),dtype=np.int32)
+        for i,path in enumerate(paths):
+            folder,file = os.path.split(path)
+            if folder not in dirs:
+                dirs[folder] = len(self.dirs)
+                self.dirs.append(folder)
+            dir_index[i] = dirs[folder]
+            self.files.append(sys.intern(file))
+        self.dir_index = np.concatenate((self.dir_index,dir_index))
+
+    def __getitem__(self,i):
+        return self.dirs[self.dir_index[i]] + os.sep + self.files[i]
+
+    def __len__(self):
+        return len(self.files)
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+class CatalogStore(object):
+
+    def __init__(self,rows):
+        self.videos = PathTable([row['video'] for row in rows])
+        self.thumbs = PathTable([row['folder'] + os.sep + row['name'] for row in rows])
+        self.columns = {}
+        for field in NUMERIC_FIELDS:
+            self.columns[field] = np.array([to_number(row.get(field,'')) for row in rows],dtype=np.float64)
+        self.hashes = [sys.intern(row.get('phash','')) for row in rows]
+        self.codecs = [sys.intern(row.get('codec','')) for row in rows]
+        self.copies = {i:row['copies'].split('\t') for i,row in enumerate(rows) if len(row.get('copies',''))>0}
+        self.alive = np.ones(len(rows),dtype=bool)
+        self._video_index = None
+        self.clear_cache()
+
+    def clear_cache(self):
+        self._ranks = {}
+        self._permutations = {}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.videos)
+
+    def video(self,i):
+        return self.videos[i]
+
+    def thumb(self,i):
+        return self.thumbs[i]
+
+    def name(self,i):
+        return self.videos.files[i]
+
+    def append(self,rows):
+        """Adds rows, returns their indices"""
+        start = len(self)
+        self.videos.extend([row['video'] for row in rows])
+        self.thumbs.extend([row['folder'] + os.sep + row['name'] for row in rows])
+        for field in NUMERIC_FIELDS:
+            values = np.array([to_number(row.get(field,'')) for row in rows],dtype=np.float64)
+            self.columns[field] = np.concatenate((self.columns[field],values))
+        self.hashes += [sys.intern(row.get('phash','')) for row in rows]
+        self.codecs += [sys.intern(row.get('codec','')) for row in rows]
+        for i,row in enumerate(rows):
+            if len(row.get('copies',''))>0:
+                self.copies[start + i] = row['copies'].split('\t')
+        self.alive = np.concatenate((self.alive,np.ones(len(rows),dtype=bool)))
+        if self._video_index is not None:
+            for i,row in enumerate(rows):
+                self._video_index[row['video']] = start + i
+        self.clear_cache()
+        return np.arange(start,len(self))
+
+    def update(self,i,row):
+        """Replaces the values of row i, for thumbnails made while the viewer is open"""
+        for field in NUMERIC_FIELDS:
+            self.columns[field][i] = to_number(row.get(field,''))
+        self.hashes[i] = sys.intern(row.get('phash',''))
+        self.codecs[i] = sys.intern(row.get('codec',''))
+        if len(row.get('copies',''))>0:
+            self.copies[i] = row['copies'].split('\t')
+        self.clear_cache()
+
+    def remove(self,videos):
+        """Marks rows of video paths dead, returns their indices"""
+        if self._video_index is None:
+            self._video_index = {self.videos[i]:i for i in range(len(self)) if self.alive[i]}
+        indices = [self._video_index.pop(video) for video in videos if video in self._video_index]
+        self.alive[indices] = False
+        self.clear_cache()
+        return np.array(indices,dtype=np.int64)
+
+    def rank(self,key):
+        """Array that sorts like key, strings are replaced by their dense rank"""
+        if key in self.columns:
+            return self.columns[key]
+        if key not in self._ranks:
+            if key == 'name':
+                values = np.array([x.lower() for x in self.videos.files])
+            elif key == 'path':
+                values = np.array([x.lower() for x in self.videos.tolist()])
+            elif key == 'codec':
+                values = np.array(self.codecs)
+            else:
+                raise ValueError('unknown sort key %s' % key)
+            self._ranks[key] = np.unique(values,return_inverse=True)[1].astype(np.float64)
+            if key == 'codec':
+                self._ranks[key][values==''] = np.nan # older rows without metadata
+        return self._ranks[key]
+
+    def match(self,conditions):
+        """Boolean mask of the rows that meet all conditions of parse_filters, rows without the value never do"""
+        mask = self.alive.copy()
+        for field,compare,value in conditions:
+            if field == 'codec':
+                mask &= np.array([x.lower()==value for x in self.codecs],dtype=bool)
+            else:
+                with np.errstate(invalid='ignore'):
+                    mask &= compare(self.columns[field],value)
+        return mask
+
+    def permutation(self,keys):
+        """
+        Catalog indices sorted by keys, a sequence of (key, descending) with the
+        primary key first. Missing values go last.
+        """
+        keys = tuple(keys)
+        if keys not in self._permutations:
+            # lexsort uses the last key as the primary one
+            arrays = [-self.rank(key) if descending else self.rank(key) for key,descending in reversed(keys)]
+            perm = np.lexsort(arrays) if len(arrays)>0 else np.arange(len(self))
+            self._permutations[keys] = perm[self.alive[perm]]
+        return self._permutations[keys]
+
+    def sort(self,indices,keys):
+        """indices (array) reordered by keys, removed rows are dropped"""
+        keys = tuple(keys)
+        indices = np.asarray(indices,dtype=np.int64)
+        indices = indices[self.alive[indices]]
+        perm = self.permutation(keys)
+        if len(indices)==len(perm) and len(np.unique(indices))==len(perm):
+            # all live rows
+            return perm
+        if keys not in self._positions:
+            position = np.full(len(self),len(self),dtype=np.int64)
+            position[perm] = np.arange(len(perm))
+            self._positions[keys] = position
+        return indices[np.argsort(self._positions[keys][indices],kind='stable')]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive number of parallel jobs
+
+The best NWORKERS depends on codecs, resolution and storage: a fast SSD with
+H.264 files keeps many workers busy, a single spinning disk gets slower with
+every extra parallel seek. With NWORKERS=0 (or AUTOTUNE) the pool engine
+starts with a few jobs in flight and the tuner hill-climbs on the observed
+videos/sec, one job at a time:
+    - throughput went up: take another step in the same direction
+    - throughput went down: step back the other way
+    - throughput plateaued: drop a job, the same rate with fewer jobs is better
+    - I/O wait of the machine rose: drop a job, the disks are the bottleneck
+Every decision is printed and kept in trajectory, so it shows why the run
+converged where it did.
+"""
+
+import os
+import time
+
+TOLERANCE = 0.05 # relative change of throughput that counts as a change
+IOWAIT_RISE = 0.10 # rise of the I/O wait share that makes the tuner back off
+
+def default_ceiling():
+    """Most jobs the tuner may try when NWORKERS is not given"""
+    return max(2,2*(os.cpu_count() or 1))
+
+def cpu_times():
+    """(iowait, total) jiffies of all CPUs from /proc/stat, None if unknown"""
+    try:
+        with open('/proc/stat') as f:
+            values = [int(x) for x in f.readline().split()[1:]]
+    except (OSError,ValueError):
+        return None
+    return values[4],sum(values)
+
+class ConcurrencyTuner(object):
+
+    def __init__(self,MAXIMUM,start=None):
+
+        self.MAXIMUM = max(1,MAXIMUM)
+        self.limit = min(self.MAXIMUM,start or max(1,(os.cpu_count() or 1)//2))
+        self.direction = 1
+        self.previous = None # videos/sec of the previous window
+        self.previous_iowait = None
+        self.trajectory = [] # (seconds from start, limit, videos/sec, iowait share or None, decision)
+        self.start = time.time()
+        self.open_window()
+
+    def open_window(self):
+        self.window_start = time.time()
+        self.window_count = 0
+        self.window_cpu = cpu_times()
+
+    def window_size(self):
+        # enough jobs that every slot finishes about twice
+        return max(4,2*self.limit)
+
+    def iowait(self):
+        now = cpu_times()
+        if now is None or self.window_cpu is None or now[1]==self.window_cpu[1]:
+            return None
+        return (now[0]-self.window_cpu[0])/(now[1]-self.window_cpu[1])
+
+    def observe(self):
+        """Called when a job finishes, returns the number of jobs to keep in flight"""
+
+        self.window_count += 1
+        if self.window_count < self.window_size():
+            return self.limit
+
+        rate = self.window_count/max(time.time()-self.window_start,1e-6)
+        iowait = self.iowait()
+        limit = self.limit
+        if iowait is not None and self.previous_iowait is not None and iowait > self.previous_iowait + IOWAIT_RISE:
+            self.direction = -1
+            decision = 'I/O wait rose'
+        elif self.previous is None:
+            decision = 'first window'
+        elif rate > self.previous*(1+TOLERANCE):
+            decision = 'faster'
+        elif rate < self.previous*(1-TOLERANCE):
+            self.direction = -self.direction
+            decision = 'slower, turning'
+        else:
+            self.direction = -1
+            decision = 'plateau'
+        # at a bound the limit stays until a slower window turns the direction
+        self.limit = min(self.MAXIMUM,max(1,limit + self.direction))
+
+        self.trajectory.append((time.time()-self.start,limit,rate,iowait,decision))
+        print('..tuner: %i jobs %.2f videos/sec%s, %s -> %i jobs' % (limit,rate,'' if iowait is None else ' iowait %.0f%%' % (100*iowait),decision,self.limit))
+
+        self.previous = rate
+        self.previous_iowait = iowait
+        self.open_window()
+        return self.limit
+
+    def summary(self):
+        if len(self.trajectory)==0:
+            return '..tuner: %i jobs (run too short to tune)' % self.limit
+        path = ' -> '.join('%i' % x[1] for x in self.trajectory)
+        best = max(self.trajectory,key=lambda x: x[2])
+        return '..tuner: %s -> %i jobs, best %.2f videos/sec with %i jobs' % (path,self.limit,best[2],best[1])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Integrity check of an OUTPATH catalog
+
+Crashes and full disks leave truncated or empty thumbnails behind. Every
+catalog row is checked for
+    - thumbnail markers: JPEG SOI at the start and EOI at the end, or a WebP
+      RIFF header whose length matches the file size
+    - thumbnail dimensions from the header (get_image_size), and that they
+      match the catalog
+    - a source video that still exists with the size and mtime of the catalog
+Checks only read a few bytes of each file and run in a thread pool, the work
+is mostly waiting for the disk.
+"""
+
+import os
+import os.path
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from get_image_size import get_image_size,UnknownImageFormat
+
+# problems of a catalog row
+BROKEN = 'broken' # thumbnail has to be made again
+CHANGED = 'changed' # source video changed, thumbnail has to be made again
+MISSING = 'missing' # source video is gone, row is dropped
+
+def check_thumbnail(filename,width='',height=''):
+    """None for a complete thumbnail, otherwise the problem as text"""
+
+    try:
+        size = os.path.getsize(filename)
+        if size<32:
+            return 'empty file' if size==0 else 'truncated file'
+        with open(filename,'rb') as file:
+            head = file.read(12)
+            file.seek(-16,os.SEEK_END)
+            tail = file.read(16)
+    except OSError:
+        return 'not found'
+
+    if head[:2] == b'\xff\xd8':
+        # a few padding bytes after EOI are allowed
+        if b'\xff\xd9' not in tail.rstrip(b'\x00'):
+            return 'no JPEG end marker'
+    elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        if struct.unpack('<I',head[4:8])[0] + 8 > size:
+            return 'truncated WebP'
+    else:
+        return 'unknown format'
+
+    try:
+        w,h = get_image_size(filename)
+    except (UnknownImageFormat,OSError):
+        return 'unreadable header'
+    if not (w>0 and h>0):
+        return 'no dimensions'
+    if len(str(width))>0 and len(str(height))>0 and (str(w),str(h)) != (str(width),str(height)):
+        return 'dimensions %ix%i, catalog has %sx%s' % (w,h,width,height)
+    return None
+
+def check_source(row):
+    """None if the source video of row is unchanged, otherwise (kind, problem)"""
+
+    try:
+        stat = os.stat(row['video'])
+    except OSError:
+        return MISSING,'video not found'
+    if len(row.get('size',''))>0 and str(stat.st_size) != row['size']:
+        return CHANGED,'video size changed'
+    if len(row.get('mtime',''))>0 and '%.0f' % stat.st_mtime != row['mtime']:
+        return CHANGED,'video modified'
+    return None
+
+def check_row(row):
+    """None for a good row, otherwise (kind, problem)"""
+
+    source = check_source(row)
+    if source is not None and source[0]==MISSING:
+        return source
+    problem = check_thumbnail(row['folder'] + os.sep + row['name'],row.get('width',''),row.get('height',''))
+    if problem is not None:
+        return BROKEN,problem
+    return source
+
+def verify_rows(rows,NTHREADS=16):
+    """(row, kind, problem) of the rows that failed a check"""
+
+    with ThreadPoolExecutor(max_workers=NTHREADS) as executor:
+        results = list(executor.map(check_row,rows))
+    return [(row,)+result for row,result in zip(rows,results) if result is not None]
+
+def missing_copies(rows):
+    """Copies of catalogued videos that no longer exist"""
+    copies = [x for row in rows for x in row.get('copies','').split('\t') if len(x)>0]
+    return [x for x in copies if not os.path.isfile(x)]
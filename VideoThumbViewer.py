@@ -20,11 +20,15 @@ import wx.grid as Grid
 import get_image_size
 import math
 import os
+from collections import OrderedDict
 from os import startfile
-from threading import Thread
 from pubsub import pub
-from VideoThumbGenerator import VideoThumbGenerator
-from operator import itemgetter
+from VideoThumbCatalog import CATALOG_NAME,JOURNAL_NAME,read_catalog,read_changes
+from VideoThumbSearch import TrigramIndex
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None # thumbnails are decoded at full size by wx
 
 #import images
 
@@ -33,6 +37,18 @@ from operator import itemgetter
 WIDTH = 0.80 # of primary monitor
 HEIGHT = 0.75 # of primary monitor
 FIGURES_PER_PAGE = 200 # grid size
+LAG_INTERVAL = 100 # ms, event loop lag timer with VIDEOTHUMB_PROFILE=1
+CELL_CACHE = 60 # painted thumbnail cells kept as bitmaps, a screen and a half of rows
+WX_FORMATS = ('.png','.bmp','.gif') # decoded by wx itself, the rest (JPEG, WebP) goes through PIL
+SORT_KEYS = (('name','&Name'),('duration','&Duration'),('size','&File size'),('mtime','&Modified'),('path','&Path'),
+             ('video_height','&Resolution'),('fps','F&rame rate'),('bitrate','&Bitrate'),('codec','&Codec'))
+
+def profiled(name):
+    """VideoThumbProfile.profiled, which is only imported when the viewer is profiled"""
+    if os.environ.get('VIDEOTHUMB_PROFILE'):
+        from VideoThumbProfile import profiled
+        return profiled(name)
+    return lambda func: func
 
 def scale_bitmap(bitmap, width, height):
     image = bitmap.ConvertToImage()
@@ -40,6 +56,28 @@ def scale_bitmap(bitmap, width, height):
     result = wx.Bitmap(image)
     return result  
 
+def decode_scaled(path, width, height):
+    """
+    PIL image of a thumbnail at width x height. For JPEG the decoder skips DCT
+    coefficients to give the smallest 1/1, 1/2, 1/4 or 1/8 scale that still
+    covers the target, so only a cheap resample of less than 2x is left. Other
+    formats such as WebP are decoded at full size.
+    """
+    image = PILImage.open(path)
+    image.draft('RGB', (width, height))
+    return image.convert('RGB').resize((width, height), PILImage.BILINEAR)
+
+def load_bitmap(path, width, height):
+    """Thumbnail scaled to width x height"""
+    width, height = max(1,int(width)), max(1,int(height))
+    if PILImage is not None and os.path.splitext(path)[1].lower() not in WX_FORMATS:
+        try:
+            image = decode_scaled(path, width, height)
+            return wx.Bitmap.FromBuffer(width, height, image.tobytes())
+        except (OSError, ValueError):
+            pass # let wx try
+    return scale_bitmap(wx.Bitmap(path), width, height)
+
 class MegaTable(Grid.GridTableBase):
     """
     A custom wx.Grid Table using user supplied data
@@ -60,6 +98,8 @@ class MegaTable(Grid.GridTableBase):
         # see if the table has changed size
         self._rows = self.GetNumberRows()
         self._cols = self.GetNumberCols()
+        self._renderers = {} # colname -> renderer, kept with its caches over resets
+        self._drawn = [] # cell keys of the rows at the last reset
 
     def GetNumberCols(self):
         return len(self.colnames)
@@ -86,38 +126,72 @@ class MegaTable(Grid.GridTableBase):
     def ResetView(self, grid):
         """
         (Grid) -> Reset the grid view.   Call this to
-        update the grid if rows and columns have been added or deleted
+        update the grid if rows and columns have been added or deleted.
+        Only the visible rows whose content changed are painted again.
         """
-        grid.BeginBatch()
-
-        for current, new, delmsg, addmsg in [
-            (self._rows, self.GetNumberRows(), Grid.GRIDTABLE_NOTIFY_ROWS_DELETED, Grid.GRIDTABLE_NOTIFY_ROWS_APPENDED),
-            (self._cols, self.GetNumberCols(), Grid.GRIDTABLE_NOTIFY_COLS_DELETED, Grid.GRIDTABLE_NOTIFY_COLS_APPENDED),
-        ]:
+        resized = self._rows != self.GetNumberRows() or self._cols != self.GetNumberCols()
+        if resized:
+            # EndBatch repaints the whole grid, only needed when rows come or go
+            grid.BeginBatch()
+
+            for current, new, delmsg, addmsg in [
+                (self._rows, self.GetNumberRows(), Grid.GRIDTABLE_NOTIFY_ROWS_DELETED, Grid.GRIDTABLE_NOTIFY_ROWS_APPENDED),
+                (self._cols, self.GetNumberCols(), Grid.GRIDTABLE_NOTIFY_COLS_DELETED, Grid.GRIDTABLE_NOTIFY_COLS_APPENDED),
+            ]:
+
+                if new < current:
+                    msg = Grid.GridTableMessage(self,delmsg,new,current-new)
+                    grid.ProcessTableMessage(msg)
+                elif new > current:
+                    msg = Grid.GridTableMessage(self,addmsg,new-current)
+                    grid.ProcessTableMessage(msg)
+                    self.UpdateValues(grid)
+
+            grid.EndBatch()
+
+            self._rows = self.GetNumberRows()
+            self._cols = self.GetNumberCols()
+
+        # a changed row height repaints that row and the ones below it
+        for i in range(self._rows):
+            height = int(self.data[i][1]['dims'][1])
+            if grid.GetRowSize(i) != height:
+                grid.SetRowSize(i,height)
 
-            if new < current:
-                msg = Grid.GridTableMessage(self,delmsg,new,current-new)
-                grid.ProcessTableMessage(msg)
-            elif new > current:
-                msg = Grid.GridTableMessage(self,addmsg,new-current)
-                grid.ProcessTableMessage(msg)
-                self.UpdateValues(grid)
-
-        grid.EndBatch()
-
-        self._rows = self.GetNumberRows()
-        self._cols = self.GetNumberCols()
-        
-        for i in range(self._rows):        
-            grid.SetRowSize(i,self.data[i][1]['dims'][1])
-        
         # update the column rendering plugins
-        self._updateColAttrs(grid)
+        if resized or len(self._renderers)==0:
+            self._updateColAttrs(grid)
 
         # update the scrollbars and the displayed part of the grid
         grid.AdjustScrollbars()
-        grid.ForceRefresh()
-
+        self.RefreshChanged(grid)
+
+    def RowVersion(self, row):
+        """Catalog row shown in a row and how, a changed thumbnail comes with a new version"""
+        entry = self.data[row][1]
+        return (entry['index'],entry['video'],entry['text'],entry['dims'],entry.get('pending'))
+
+    def RefreshChanged(self, grid):
+        """Repaints the visible rows whose label or version changed since the last reset"""
+        drawn = [(self.data[i][0],)+self.RowVersion(i) for i in range(len(self.data))]
+        window = grid.GetGridWindow()
+        labels = False
+        for i,key in enumerate(drawn):
+            if i < len(self._drawn) and self._drawn[i] == key:
+                continue
+            labels = labels or i >= len(self._drawn) or self._drawn[i][0] != key[0]
+            rect = grid.BlockToDeviceRect(Grid.GridCellCoords(i,0),Grid.GridCellCoords(i,self._cols-1))
+            if not rect.IsEmpty():
+                window.RefreshRect(rect,eraseBackground=False)
+        if labels:
+            grid.GetGridRowLabelWindow().Refresh()
+        # cells of versions no longer shown are dropped, the others stay cached
+        stale = set(key[1:] for key in self._drawn) - set(key[1:] for key in drawn)
+        if len(stale)>0:
+            for renderer in self._renderers.values():
+                if hasattr(renderer,'Forget'):
+                    renderer.Forget(stale)
+        self._drawn = drawn
 
     def UpdateValues(self, grid):
         """Update all displayed values"""
@@ -138,7 +212,10 @@ class MegaTable(Grid.GridTableBase):
         for colname in self.colnames:
             attr = Grid.GridCellAttr()
             if colname in self.plugins:
-                renderer = self.plugins[colname](self)
+                if colname not in self._renderers:
+                    self._renderers[colname] = self.plugins[colname](self)
+                renderer = self._renderers[colname]
+                renderer.IncRef() # the attribute takes a reference
 
                 if renderer.colSize:
                     grid.SetColSize(col, renderer.colSize)
@@ -250,38 +327,75 @@ class MegaImageRenderer(Grid.GridCellRenderer):
         self.colSize = None
         self.rowSize = None
 
+        # GDI objects and painted cells are made once, not on every paint
+        self.backgroundBrush = wx.Brush(wx.WHITE, wx.BRUSHSTYLE_SOLID)
+        self.pendingBrush = wx.Brush(wx.LIGHT_GREY, wx.BRUSHSTYLE_SOLID)
+        self.pen = wx.Pen(wx.WHITE, 1, wx.PENSTYLE_SOLID)
+        self.cells = OrderedDict() # (row version, width, height) -> bitmap of the cell, least recently used first
+
+    @profiled('MegaImageRenderer.Draw')
     def Draw(self, grid, attr, dc, rect, row, col, isSelected):
-        #bmp = self._choices[ choice % len(self._choices)]()
-        bmp = wx.Bitmap(grid.GetCellValue(row,col))        
-        bmp = scale_bitmap(bmp,self.table.data[row][1]['dims'][0]-2,self.table.data[row][1]['dims'][1]-2) 
-        
+        if self.table.data[row][1].get('pending'):
+            # placeholder, thumbnail is still being generated
+            dc.SetBackgroundMode(wx.SOLID)
+            dc.SetBrush(self.pendingBrush)
+            dc.SetPen(self.pen)
+            dc.DrawRectangle(rect)
+            dc.DrawText('generating...', rect.x+10, rect.y+10)
+            return
+
+        key = (self.table.RowVersion(row), rect.width, rect.height)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.PaintCell(grid.GetCellValue(row,col), rect, self.table.data[row][1]['dims'])
+            self.cells[key] = cell
+            if len(self.cells) > CELL_CACHE:
+                self.cells.popitem(last=False)
+        else:
+            self.cells.move_to_end(key)
+
         image = wx.MemoryDC()
-        image.SelectObject(bmp)
+        image.SelectObject(cell)
+        dc.Blit(rect.x, rect.y, rect.width, rect.height, image, 0, 0, wx.COPY)
+        image.SelectObject(wx.NullBitmap)
+
+    def Forget(self, versions):
+        """Drops the cells of row versions that are not shown any more"""
+        for key in [key for key in self.cells if key[0] in versions]:
+            del self.cells[key]
+
+    def PaintCell(self, path, rect, dims):
+        """Back buffer of a cell: background and the thumbnail clipped to the cell"""
+        cell = wx.Bitmap(max(1,rect.width), max(1,rect.height))
+        dc = wx.MemoryDC()
+        dc.SelectObject(cell)
 
         # clear the background
-        dc.SetBackgroundMode(wx.SOLID)
+        dc.SetBrush(self.backgroundBrush)
+        dc.SetPen(self.pen)
+        dc.DrawRectangle(0, 0, rect.width, rect.height)
 
-        #if isSelected:
-        #    dc.SetBrush(wx.Brush(wx.BLUE, wx.BRUSHSTYLE_SOLID))
-        #    dc.SetPen(wx.Pen(wx.BLUE, 1, wx.PENSTYLE_SOLID))
-        #else:
-        dc.SetBrush(wx.Brush(wx.WHITE, wx.BRUSHSTYLE_SOLID))
-        dc.SetPen(wx.Pen(wx.WHITE, 1, wx.PENSTYLE_SOLID))
-        dc.DrawRectangle(rect)
+        bmp = load_bitmap(path, dims[0]-2, dims[1]-2)
+        image = wx.MemoryDC()
+        image.SelectObject(bmp)
 
         # copy the image but only to the size of the grid cell
         width, height = bmp.GetWidth(), bmp.GetHeight()
-                
+
         if width > rect.width-2:
             width = rect.width-2
 
         if height > rect.height-2:
-            height = rect.height-2                             
+            height = rect.height-2
 
-        dc.Blit(rect.x+1, rect.y+1, width, height,
+        dc.Blit(1, 1, width, height,
                 image,
                 0, 0, wx.COPY, True)
 
+        image.SelectObject(wx.NullBitmap)
+        dc.SelectObject(wx.NullBitmap)
+        return cell
+
 
 class MegaFontRenderer(Grid.GridCellRenderer):
     def __init__(self, table, color="blue", font="ARIAL", fontsize=8):
@@ -292,9 +406,11 @@ class MegaFontRenderer(Grid.GridCellRenderer):
         self.font = wx.Font(fontsize, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL, 0, font)
         self.selectedBrush = wx.Brush("blue", wx.BRUSHSTYLE_SOLID)
         self.normalBrush = wx.Brush(wx.WHITE, wx.BRUSHSTYLE_SOLID)
+        self.pen = wx.Pen(wx.WHITE, 1, wx.PENSTYLE_SOLID)
         self.colSize = 50
         self.rowSize = 200
 
+    @profiled('MegaFontRenderer.Draw')
     def Draw(self, grid, attr, dc, rect, row, col, isSelected):
         # Here we draw text in a grid cell using various fonts
         # and colors.  We have to set the clipping region on
@@ -309,8 +425,8 @@ class MegaFontRenderer(Grid.GridCellRenderer):
         #    dc.SetBrush(wx.Brush(wx.BLUE, wx.BRUSHSTYLE_SOLID))
         #    dc.SetPen(wx.Pen(wx.BLUE, 1, wx.PENSTYLE_SOLID))
         #else:
-        dc.SetBrush(wx.Brush(wx.WHITE, wx.BRUSHSTYLE_SOLID))
-        dc.SetPen(wx.Pen(wx.WHITE, 1, wx.PENSTYLE_SOLID))
+        dc.SetBrush(self.normalBrush)
+        dc.SetPen(self.pen)
         dc.DrawRectangle(rect)
 
         text = self.table.GetValue(row, col)
@@ -362,6 +478,8 @@ class MegaGrid(Grid.Grid):
         self._table = MegaTable(data, colnames, plugins)
         self.SetTable(self._table)
         self._plugins = plugins
+        # cells are painted into a back buffer and shown at once, no flicker while scrolling
+        self.GetGridWindow().SetDoubleBuffered(True)
 
         self.Bind(Grid.EVT_GRID_LABEL_RIGHT_CLICK, self.OnLabelRightClicked)
 
@@ -461,28 +579,6 @@ class MegaFontRendererFactory:
         return MegaFontRenderer(table, self.color, self.font, self.fontsize)
 
 #---------------------------------------------------------------------------
-class MyThread(Thread):
-    """Test Worker Thread Class."""
- 
-    #----------------------------------------------------------------------
-    def __init__(self,OUTPATH,INFOLDER,FFMPEG_PATH):
-        """Init Worker Thread Class."""
-        Thread.__init__(self)
-        self.obj = VideoThumbGenerator(OUTPATH=OUTPATH,INFOLDER=INFOLDER,FFMPEG_PATH=FFMPEG_PATH)
-        self.start()    # start the thread
- 
-    #----------------------------------------------------------------------
-    def run(self):
-        """Run Worker Thread."""
-        # This is the code executing in the new thread.
-        try:
-            self.obj.run()
-            msg = 1           
-        except Exception as inst:
-            print(inst)
-            msg = 2
-        pub.sendMessage("generatorFinished",msg=msg)                      
-        
 class TestFrame(wx.Frame):
     def __init__(self, parent=None, plugins={"text":MegaFontRendererFactory("red", "ARIAL", 11),
                                         "video":MegaImageRenderer}):        
@@ -493,7 +589,6 @@ class TestFrame(wx.Frame):
         self.panel_bottom = wx.Panel(self, size=(WIDTH,100),pos=(0,HEIGHT-100),style=wx.SIMPLE_BORDER)        
         #self.panel_top.SetBackgroundColour('RED')
         
-        pub.subscribe(self.generatorFinished,('generatorFinished'))
         pub.subscribe(self.sortRows,('sortbylength'))
 
         self.btn_generate = wx.Button(self.panel_bottom,-1,"Generate")#,size=(150,40),pos=(0.30*WIDTH,HEIGHT-50))
@@ -503,6 +598,9 @@ class TestFrame(wx.Frame):
         self.btn_next = wx.Button(self.panel_bottom,-1,"Next")#,size=(150,40),pos=(0.70*WIDTH,HEIGHT-50)) 
         self.btn_next.Bind(wx.EVT_BUTTON,self.onClicked_next)          
         self.infotext = wx.TextCtrl(self.panel_bottom, -1, "",style = wx.TE_READONLY | wx.TE_CENTRE )  # | wx.BORDER_NONE
+        self.searchbox = wx.SearchCtrl(self.panel_bottom, -1, size=(250,-1))
+        self.searchbox.SetDescriptiveText("Search videos, e.g. holiday height>=1080")
+        self.searchbox.Bind(wx.EVT_TEXT,self.onSearch)
        
         #panel_top_sizer = wx.BoxSizer(wx.HORIZONTAL,)
         
@@ -510,18 +608,33 @@ class TestFrame(wx.Frame):
         panel_bottom_sizer.Add(self.btn_generate, 0, wx.ALIGN_CENTER, 0)
         panel_bottom_sizer.Add(self.btn_prev,0,wx.ALIGN_CENTER,0)
         panel_bottom_sizer.Add(self.btn_next,0,wx.ALIGN_CENTER,0)
+        panel_bottom_sizer.Add(self.searchbox,0,wx.ALIGN_CENTER,0)
         panel_bottom_sizer.Add(self.infotext,wx.EXPAND,wx.ALIGN_CENTER,0)
         self.panel_bottom.SetSizer(panel_bottom_sizer)    
 
-        self.picPaths = []        
+        # numpy and the store are imported with the first frame, not with the module
+        import numpy as np
+        from VideoThumbStore import CatalogStore
+
+        self.catalog = CatalogStore([])
         self.COLWIDTH = WIDTH-70 - 65
         self.MAX_ROWHEIGHT = int(0.60*WIDTH)
         self.PageNum = 0
         self.TotalPages = 0
         self.totalImages = 0
-        self.vidDuration=[]
-        self.picNames = []
+        self.base = np.arange(0) # catalog indices in display order, before search
+        self.view = self.base # base filtered by the search box
+        self.viewLabels = {}
+        self.sortKeys = [] # (key, descending), primary first
+        self.searchIndex = None
+        self.matches = None # boolean mask of catalog indices matching the search, None for no search
         self.folderPath = []
+        self.catalogPath = [] # folder of the open catalog
+        self.journalOffset = 0
+        self.priorityGen = None # generator following the viewed page, for folders without a catalog
+        self.daemonJob = None # job of the generation daemon started with the Generate button
+        self.generationJob = None # GenerationJob started with the Generate button
+        self.pending = set() # catalog indices without a thumbnail yet
 
         self.grid = MegaGrid(self.panel_top, data, colnames, plugins)
         
@@ -551,14 +664,43 @@ class TestFrame(wx.Frame):
         settingmenu= wx.Menu()
         setting_item = settingmenu.Append(1, "&Properties","change generator settings")
         settingmenu.AppendSeparator()
+
+        toolmenu= wx.Menu()
+        duplicate_item = toolmenu.Append(2, "Find &duplicates","show groups of near-duplicate videos")
+        showall_item = toolmenu.Append(3, "Show &all","show all videos")
+
+        # selecting the same key again reverses the order, the previous key is kept as a tie-breaker
+        sortmenu= wx.Menu()
+        for k,(key,label) in enumerate(SORT_KEYS):
+            item = sortmenu.Append(10+k, label, "sort by %s" % label.replace('&','').lower())
+            self.Bind(wx.EVT_MENU,lambda event,key=key: self.sortRows(msg=key),item,id=10+k)
         
         menuBar = wx.MenuBar()
         menuBar.Append(filemenu,"&File") # Adding the "filemenu" to the MenuBar
         menuBar.Append(settingmenu,"&Settings") # Adding the "filemenu" to the MenuBar
+        menuBar.Append(sortmenu,"S&ort")
+        menuBar.Append(toolmenu,"&Tools")
         self.SetMenuBar(menuBar)  # Adding the MenuBar to the Frame content.
 
         self.Bind(wx.EVT_MENU,self.onOpenDirectory,dir_item,id=0)   
         self.Bind(wx.EVT_MENU,self.onChangeParameters,setting_item,id=1) 
+        self.Bind(wx.EVT_MENU,self.onFindDuplicates,duplicate_item,id=2)
+        self.Bind(wx.EVT_MENU,self.onShowAll,showall_item,id=3)
+
+        # follow changes made by the generator in watch mode
+        self.journalTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER,self.onJournalTimer,self.journalTimer)
+        self.journalTimer.Start(2000)
+
+        # closing the window must not leave workers and ffmpeg running
+        self.Bind(wx.EVT_CLOSE,self.onClose)
+
+        if os.environ.get('VIDEOTHUMB_PROFILE'):
+            from VideoThumbProfile import UI as UI_PROFILE
+            # a timer that fires late shows how long the event loop was blocked
+            self.lagTimer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER,lambda event: UI_PROFILE.tick(LAG_INTERVAL/1000.0),self.lagTimer)
+            self.lagTimer.Start(LAG_INTERVAL)
         
     def updateText(self,text=None):
         if text == None:
@@ -571,10 +713,8 @@ class TestFrame(wx.Frame):
     def onRightClick(self, event):
         row = event.GetRow()
         
-        video_index = row + self.PageNum*FIGURES_PER_PAGE        
-        
-        if -1<video_index<len(self.vidPaths):
-            videofile = self.vidPaths[video_index]
+        if -1<row<len(self.grid._table.data):
+            videofile = self.catalog.video(self.grid._table.data[row][1]['index'])
             startfile(videofile)
             #subprocess.call('open "%s"' % videofile)
             
@@ -582,17 +722,29 @@ class TestFrame(wx.Frame):
         pass
             
     def generatorFinished(self,msg=None):
+        if self.priorityGen is not None:
+            self.priorityGen = None
+            self.pending = set()
+        self.btn_generate.SetLabel('Generate')
         if msg==1:
             self.updateText(text='Generator finished! Open "MyVideoThumbs.dat" in "%s"' % self.folderPath)
             self.btn_generate.Enable()
         elif msg==2:
             self.updateText(text='Generator ran into error!')                
             self.btn_generate.Enable()
+        elif msg==3:
+            self.updateText(text='Generator cancelled, finished thumbnails are reused by the next run')
+            self.btn_generate.Enable()
         self.infotext.SetBackgroundColour(wx.Colour(255, 255, 255, 255))        
         self.panel_bottom.Refresh()
 
     def onClicked_generate(self, event):
 
+        if self.generationJob is not None or self.daemonJob is not None:
+            # the button is Cancel while generating
+            self.cancelGeneration()
+            return
+
         if len(self.folderPath)==0:
             dlg = wx.MessageDialog(self,'No folders selected. Please choose a folder first.','folder selection')
         else:
@@ -602,32 +754,180 @@ class TestFrame(wx.Frame):
                 out = self.folderPath + os.sep + 'video_preview_images'
                 self.updateText(text='Wait! Running image generator...')  
                 self.infotext.SetBackgroundColour('RED')
-                MyThread(OUTPATH=out,INFOLDER=self.folderPath,FFMPEG_PATH='')                    
-                self.btn_generate.Disable()
+                # a running generation daemon has warm workers, otherwise generate here
+                from VideoThumbDaemon import submit
+                job = submit(INFOLDER=self.folderPath,OUTPATH=out)
+                if job is not None:
+                    self.daemonJob = job['job']
+                else:
+                    from VideoThumbJobs import GenerationJob
+                    self.generationJob = GenerationJob({'OUTPATH':out,'INFOLDER':self.folderPath,'FFMPEG_PATH':'','NWORKERS':0},
+                                                       on_progress=lambda done,failed,total: wx.CallAfter(self.onGenerateProgress,done,failed,total),
+                                                       on_finished=lambda state,error: wx.CallAfter(self.onGenerateFinished,state,error))
+                    self.generationJob.start()
+                self.btn_generate.SetLabel('Cancel')
                 self.panel_bottom.Refresh()
                     
         dlg.Destroy()        
 
+    def onGenerateProgress(self,done,failed,total):
+        if self.generationJob is not None:
+            self.updateText(text='Wait! Running image generator (%i/%i videos, %i failed)...' % (done+failed,total,failed))
+
+    def onGenerateFinished(self,state,error):
+        self.generationJob = None
+        if error is not None:
+            print(error)
+        self.generatorFinished(msg={'done':1,'cancelled':3}.get(state,2))
+
+    def cancelGeneration(self):
+        if self.generationJob is not None:
+            self.updateText(text='Cancelling image generator...')
+            self.generationJob.cancel() # onGenerateFinished follows
+        if self.daemonJob is not None:
+            from VideoThumbDaemon import request
+            try:
+                request({'command':'cancel','job':self.daemonJob})
+            except OSError:
+                pass
+
+    def onClose(self,event):
+        if self.generationJob is not None:
+            self.generationJob.cancel()
+            self.generationJob = None
+        if self.priorityGen is not None:
+            self.priorityGen.stop()
+        event.Skip()
+
     def sortRows(self,msg=None):        
         
-        if msg=='time':
-            dat = [int(x) for x in self.vidDuration]
-            ind = [x[0] for x in sorted(enumerate(dat), key=itemgetter(1))]
-        elif msg=='name':
-            ind = [x[0] for x in sorted(enumerate(self.picNames), key=itemgetter(1))]
+        key = {'time':'duration'}.get(msg,msg)
+        if key not in [x[0] for x in SORT_KEYS]:
+            raise ValueError('unknown sort: %s' % msg)
+
+        if len(self.sortKeys)>0 and self.sortKeys[0][0]==key:
+            self.sortKeys[0] = (key,not self.sortKeys[0][1])
         else:
-            raise('unknown sort!')
-        
-        self.vidDuration = [self.vidDuration[x] for x in ind]
-        self.vidPaths = [self.vidPaths[x] for x in ind]
-        self.picPaths = [self.picPaths[x] for x in ind]
-        self.picNames = [self.picNames[x] for x in ind]
-        
-        self.PageNum = 0
-        self.SetData()    
-        self.grid.Reset()        
+            self.sortKeys = [(key,False)] + [x for x in self.sortKeys if x[0]!=key][:1]
+
+        self.setView(self.catalog.sort(self.base,self.sortKeys),self.viewLabels)
+
+    def setView(self,base=None,labels=None,keep_page=False):
+        """Show catalog indices of base (in this order) that match the search, labels are extra texts per index"""
+        if base is not None:
+            self.base = base
+        if labels is not None:
+            self.viewLabels = labels
+        if self.matches is None:
+            view = self.base
+        else:
+            view = self.base[self.matches[self.base]]
+        self.view = view
+        self.totalImages = len(view)
+        self.TotalPages = int(math.ceil(len(view)/FIGURES_PER_PAGE))
+        if not keep_page:
+            self.PageNum = 0
+        self.PageNum = max(0,min(self.PageNum,self.TotalPages-1))
+        self.SetData()
+        self.grid.Reset()
         self.updateText()
 
+    def onFindDuplicates(self,event):
+        import numpy as np
+        from VideoThumbHash import find_duplicates
+
+        self.updateText(text='Searching for duplicates...')
+        # removed rows keep their hash in the store, only live rows are grouped
+        alive = np.flatnonzero(self.catalog.alive)
+        groups = find_duplicates([self.catalog.hashes[i] for i in alive])
+        view = []
+        labels = {}
+        for k,group in enumerate(groups):
+            for i in alive[group]:
+                view.append(i)
+                labels[i] = 'duplicate group %i' % (k+1)
+        if len(view)==0:
+            self.updateText(text='No duplicates found (%i videos with hashes)' % sum(len(self.catalog.hashes[i])>0 for i in alive))
+            return
+        self.setView(np.array(view,dtype=np.int64),labels)
+
+    def onShowAll(self,event):
+        import numpy as np
+
+        self.setView(self.catalog.sort(np.flatnonzero(self.catalog.alive),self.sortKeys),{})
+
+    def onSearch(self,event,refresh=True):
+        import numpy as np
+        from VideoThumbStore import parse_filters
+
+        if self.searchIndex is None:
+            return
+        # metadata filters like height>=1080 or codec:h264, the other words are searched in the paths
+        conditions,text = parse_filters(self.searchbox.GetValue())
+        ids = self.searchIndex.search(text)
+        if ids is None and len(conditions)==0:
+            self.matches = None
+        else:
+            if ids is None:
+                self.matches = np.ones(len(self.catalog),dtype=bool)
+            else:
+                self.matches = np.zeros(len(self.catalog),dtype=bool)
+                self.matches[ids] = True
+            if len(conditions)>0:
+                self.matches &= self.catalog.match(conditions)
+        if refresh:
+            self.setView()
+
+    def onJournalTimer(self,event):
+        import numpy as np
+
+        if self.daemonJob is not None:
+            self.checkDaemonJob()
+        if self.searchIndex is None:
+            return
+        added,removed,self.journalOffset = read_changes(self.catalogPath + os.sep + JOURNAL_NAME,self.journalOffset)
+        if len(added)==0 and len(removed)==0:
+            return
+
+        page = self.view[self.PageNum*FIGURES_PER_PAGE:(self.PageNum+1)*FIGURES_PER_PAGE].tolist()
+
+        self.catalog.remove(removed + [row['video'] for row in added])
+        added = [row for row in added if os.path.isfile(row['folder'] + os.sep + row['name'])]
+        new = self.catalog.append(added)
+        self.searchIndex.add([row['video'] for row in added])
+
+        base = self.base[self.catalog.alive[self.base]]
+        if len(self.viewLabels)==0:
+            # duplicate groups are not updated, new videos only go to the full view
+            base = np.concatenate((base,new))
+            if len(self.sortKeys)>0:
+                base = self.catalog.sort(base,self.sortKeys)
+        if self.matches is not None:
+            self.onSearch(None,refresh=False)
+
+        self.base = base
+        view = base if self.matches is None else base[self.matches[base]]
+        if view[self.PageNum*FIGURES_PER_PAGE:(self.PageNum+1)*FIGURES_PER_PAGE].tolist() == page:
+            # changes are on other pages, only the counts change
+            self.view = view
+            self.totalImages = len(view)
+            self.TotalPages = int(math.ceil(len(view)/FIGURES_PER_PAGE))
+            self.updateText()
+        else:
+            self.setView(keep_page=True)
+
+    def checkDaemonJob(self):
+        from VideoThumbDaemon import request
+        try:
+            job = request({'command':'status','job':self.daemonJob})
+        except OSError:
+            job = {'state':'failed'} # daemon was stopped
+        if job.get('state') in ('queued','running'):
+            self.updateText(text='Wait! Generation daemon is running (%i/%i videos)...' % (job['done'],job['total']))
+            return
+        self.daemonJob = None
+        self.generatorFinished(msg={'done':1,'cancelled':3}.get(job.get('state'),2))
+
     def onClicked_next(self,event):
         if self.TotalPages>0:
             newpage = self.PageNum+1
@@ -654,84 +954,153 @@ class TestFrame(wx.Frame):
         """
         dlg = wx.DirDialog(None, "Choose a directory",
                            style=wx.DD_DEFAULT_STYLE)        
-        picPaths = []
-        vidPaths = []
-        vidDuration=[]
+        rows = []
         if dlg.ShowModal() == wx.ID_OK:
             self.folderPath = dlg.GetPath()
             print(self.folderPath)
 
-            filename = self.folderPath + os.sep + 'MyVideoThumbs.dat'
-
-            if os.path.isfile(filename):
-                picPaths,vidPaths,vidDuration,picNames = self.load_images(filename)
+            if self.priorityGen is not None:
+                self.priorityGen.stop()
+                self.priorityGen = None
+                self.pending = set()
+
+            # the catalog itself, or a video folder generated with the Generate button
+            for path in [self.folderPath,self.folderPath + os.sep + 'video_preview_images']:
+                if os.path.isfile(path + os.sep + CATALOG_NAME):
+                    self.catalogPath = path
+                    rows = self.load_images(path + os.sep + CATALOG_NAME)
+                    break
             else:
-                self.updateText(text='No "MyVideoThumbs.dat" found, run generator first.\n Folder is: %s' % self.folderPath)
+                rows = self.startPriorityGeneration()
             #picPaths = glob.glob(self.folderPath + "\\*.jpg")
             #print(picPaths)
 
-        if len(picPaths)>0:
-            self.vidPaths = vidPaths
-            self.picPaths = picPaths
-            self.picNames = picNames
-            self.vidDuration = vidDuration
-            self.totalImages = len(picPaths)
-            assert(len(self.vidDuration) == self.totalImages == len(self.vidPaths) )
-            self.TotalPages = int(math.ceil(len(picPaths)/FIGURES_PER_PAGE))
-            self.PageNum = 0
+        if len(rows)>0:
+            self.showCatalog(rows)
+        elif self.priorityGen is None:
+            self.updateText(text='No videos or "MyVideoThumbs.dat" found.\n Folder is: %s' % self.folderPath)
+
+    def showCatalog(self,rows):
+        import numpy as np
+        from VideoThumbStore import CatalogStore
+
+        self.catalog = CatalogStore(rows)
+        self.searchIndex = TrigramIndex([row['video'] for row in rows])
+        self.matches = None
+        self.sortKeys = []
+        self.searchbox.ChangeValue('')
+        journal = self.catalogPath + os.sep + JOURNAL_NAME
+        self.journalOffset = os.path.getsize(journal) if os.path.isfile(journal) else 0
+        self.setView(np.arange(len(self.catalog)),{})
+
+    def startPriorityGeneration(self):
+        """
+        Scans folderPath in the background, its videos are shown as placeholders
+        when the scan is done (onPlanned) and their thumbnails are made, the
+        viewed page first. Returns no rows, they come with onPlanned.
+        """
+        from VideoThumbGenerator import VideoThumbGenerator
+        from VideoThumbPriority import PriorityGenerator
+
+        self.updateText(text='Scanning for videos...')
+        self.catalogPath = self.folderPath + os.sep + 'video_preview_images'
+        generator = VideoThumbGenerator(OUTPATH=self.catalogPath,INFOLDER=self.folderPath,FFMPEG_PATH='')
+        gen = PriorityGenerator(generator,
+                                on_planned=lambda rows: wx.CallAfter(self.onPlanned,gen,rows),
+                                on_result=lambda i,row: wx.CallAfter(self.onThumbnailReady,i,row),
+                                on_finished=lambda rows: wx.CallAfter(self.generatorFinished,1))
+        self.priorityGen = gen
+        self.pending = set()
+        self.btn_generate.Disable()
+        gen.start()
+        return []
+
+    def onPlanned(self,gen,rows):
+        if gen is not self.priorityGen:
+            # another folder was opened during the scan
+            return
+        if len(rows)==0:
+            self.priorityGen = None
+            self.btn_generate.Enable()
+            self.updateText(text='No videos or "MyVideoThumbs.dat" found.\n Folder is: %s' % self.folderPath)
+            return
+        self.pending = gen.pending()
+        self.showCatalog(rows)
+
+    def prioritizePage(self):
+        """Visible page first, then the next and previous pages"""
+        if self.priorityGen is None:
+            return
+        pages = [self.PageNum,self.PageNum+1,self.PageNum-1]
+        indices = []
+        for page in pages:
+            if 0<=page<self.TotalPages:
+                indices += self.view[page*FIGURES_PER_PAGE:(page+1)*FIGURES_PER_PAGE].tolist()
+        self.priorityGen.prioritize(indices)
+
+    def onThumbnailReady(self,i,row):
+        if self.priorityGen is None or i not in self.pending:
+            return
+        self.pending.discard(i)
+        if len(row)==0:
+            # failed video, dropped like a deleted one
+            self.catalog.remove([self.catalog.video(i)])
+            self.setView(self.base[self.catalog.alive[self.base]],keep_page=True)
+            return
+        self.catalog.update(i,row)
+        if i in self.view[self.PageNum*FIGURES_PER_PAGE:(self.PageNum+1)*FIGURES_PER_PAGE]:
             self.SetData()
             self.grid.Reset()
-            self.updateText()
+        self.updateText(text='%i pictures, current page %i of %i (%i thumbnails to go)' % (self.totalImages,self.PageNum+1,self.TotalPages,len(self.pending)))
 
     def load_images(self,filename):
 
-        pics = []
-        videos = []
-        duration = []
-        names = []
+        rows = []
         
         self.updateText(text='Loading images from MyVideoThumbs.dat...') 
 
         try:
 
-            with open(filename,'r',encoding='utf8') as file:
-                data = file.read()
-            data = data.split('\n')
-
-            for d in data:
-                dd = d.split('|')
-                if len(dd)==4:
-                    file = dd[0] + os.sep + dd[1]
-                    if os.path.isfile(file) and os.path.isfile(dd[2]):
-                        names.append(dd[1])
-                        pics.append(file)
-                        videos.append(dd[2])
-                        duration.append(dd[3])
-                    else:
-                        print('Files %s and %s not found!\n' % (file,dd[2]))
+            for row in read_catalog(filename):
+                file = row['folder'] + os.sep + row['name']
+                if os.path.isfile(file) and os.path.isfile(row['video']):
+                    rows.append(row)
                 else:
-                    print('Incorrect row format %s\n' % d)
+                    print('Files %s and %s not found!\n' % (file,row['video']))
 
-            assert(len(pics) == len(videos))
         except:
             pass
 
-        return pics,videos,duration,names
+        return rows
                 
+    @profiled('SetData')
     def SetData(self,issorted = False):
             
         ind1 = self.PageNum*FIGURES_PER_PAGE
-        ind2 = min((self.PageNum+1)*FIGURES_PER_PAGE,len(self.picPaths))
+        ind2 = min((self.PageNum+1)*FIGURES_PER_PAGE,len(self.view))
         
         self.grid._table.data = []
-        for i in range(ind1,ind2):            
-            try:
-                width, height = get_image_size.get_image_size(self.picPaths[i])
-            except get_image_size.UnknownImageFormat:
-                width, height = -1, -1
-                print('Warning: Failed to load figure %sn' % self.picPaths[i])
-                self.totalImages-=1
+        widths = self.catalog.columns['width']
+        heights = self.catalog.columns['height']
+        durations = self.catalog.columns['duration']
+        video_heights = self.catalog.columns['video_height']
+        for k in range(ind1,ind2):            
+            i = int(self.view[k])
+            picture = self.catalog.thumb(i)
+            width, height = widths[i], heights[i]
+            if i in self.pending:
+                d = (str(k+1),{'video':picture,'dims':(self.COLWIDTH-10,(self.COLWIDTH-10)/5.0,5.0),'text':'generating...','index':i,'pending':True})
+                self.grid._table.data.append(d)
                 continue
+            if not width>0 or not height>0:
+                # not stored in older catalogs
+                try:
+                    width, height = get_image_size.get_image_size(picture)
+                except get_image_size.UnknownImageFormat:
+                    width, height = -1, -1
+                    print('Warning: Failed to load figure %sn' % picture)
+                    self.totalImages-=1
+                    continue
             
             ratio = float(width)/float(height)
             new_height = self.COLWIDTH/ratio            
@@ -743,8 +1112,17 @@ class TestFrame(wx.Frame):
                 width = self.MAX_ROWHEIGHT*ratio
                 height = self.MAX_ROWHEIGHT                
                                 
-            d = (str(i+1),{'video':self.picPaths[i],'dims':(width, height,ratio),'text':self.vidDuration[i]})
+            text = '%i' % durations[i]
+            if video_heights[i]>0:
+                text = '%s, %ip %s' % (text,video_heights[i],self.catalog.codecs[i])
+            if i in self.catalog.copies:
+                text = '%s, +%i copies' % (text,len(self.catalog.copies[i]))
+            if i in self.viewLabels:
+                text = '%s, %s' % (self.viewLabels[i],text)
+            d = (str(k+1),{'video':picture,'dims':(width, height,ratio),'text':text,'index':i})
             self.grid._table.data.append(d)
+
+        self.prioritizePage()
             
 
 if __name__ == '__main__':
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode of VideoThumbGenerator
+
+New, changed, moved and deleted videos under INFOLDER are detected with
+inotify on Linux, or by polling the folder tree elsewhere. A new or changed
+file is only processed once its size and modification time have stayed the
+same for DEBOUNCE seconds, so files still being copied are not thumbnailed
+half way. A rename or move within the tree keeps the thumbnail, only the
+paths in the catalog change (inotify pairs the two halves of a move, polling
+sees a delete and a create). Each batch of changes is one
+VideoThumbGenerator.update call.
+"""
+
+import os
+import os.path
+import time
+import struct
+import select
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+MOVE_WAIT = 1.0 # seconds to wait for the IN_MOVED_TO of a move, otherwise it left the tree
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+class InotifyWatcher(object):
+    """Recursive inotify watch of a folder tree, Linux only"""
+
+    def __init__(self,PATH):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd<0:
+            raise OSError(ctypes.get_errno(),'inotify_init failed')
+        self.folders = {}
+        self.moving = {} # cookie -> (path, is folder, time) of IN_MOVED_FROM without IN_MOVED_TO yet
+        self.add_tree(PATH)
+
+    def add_tree(self,PATH):
+        """Watches PATH and its subfolders, returns files already in them"""
+        files = []
+        for root,dirs,names in os.walk(PATH):
+            wd = self.libc.inotify_add_watch(self.fd,os.fsencode(root),WATCH_MASK)
+            if wd>=0:
+                self.folders[wd] = root
+            files += [root + os.sep + name for name in names]
+        return files
+
+    def subtree(self,PATH):
+        """Watch descriptors of PATH and its subfolders"""
+        return [wd for wd,root in self.folders.items() if root==PATH or root.startswith(PATH + os.sep)]
+
+    def moved_out(self,now):
+        """Moves older than MOVE_WAIT went out of the tree, their folders are not watched any more"""
+        deleted = []
+        for cookie,(path,isdir,since) in list(self.moving.items()):
+            if now-since < MOVE_WAIT:
+                continue
+            del self.moving[cookie]
+            if isdir:
+                for wd in self.subtree(path):
+                    self.libc.inotify_rm_watch(self.fd,wd)
+                    del self.folders[wd]
+                deleted.append(path + os.sep)
+            else:
+                deleted.append(path)
+        return deleted
+
+    def poll(self,timeout):
+        """
+        Returns (changed files, deleted files, moved (old, new) pairs) within
+        timeout seconds, deleted and moved folders end with os.sep
+        """
+
+        changed = []
+        deleted = []
+        moved = []
+        if len(self.moving)>0:
+            timeout = min(timeout,MOVE_WAIT)
+        ready,_,_ = select.select([self.fd],[],[],timeout)
+        if len(ready)==0:
+            return changed,self.moved_out(time.time()),moved
+
+        data = os.read(self.fd,1 << 16)
+        pos = 0
+        while pos + 16 <= len(data):
+            wd,mask,cookie,length = struct.unpack('iIII',data[pos:pos+16])
+            name = os.fsdecode(data[pos+16:pos+16+length].rstrip(b'\0'))
+            pos += 16 + length
+            if mask & IN_IGNORED:
+                self.folders.pop(wd,None)
+                continue
+            if wd not in self.folders:
+                continue
+            path = self.folders[wd] + os.sep + name
+            isdir = (mask & IN_ISDIR)!=0
+            if mask & IN_MOVED_FROM:
+                self.moving[cookie] = (path,isdir,time.time())
+            elif mask & IN_MOVED_TO and cookie in self.moving:
+                old,_,_ = self.moving.pop(cookie)
+                if isdir:
+                    # the watches moved with the folder
+                    for wd in self.subtree(old):
+                        self.folders[wd] = path + self.folders[wd][len(old):]
+                    moved.append((old + os.sep,path + os.sep))
+                else:
+                    moved.append((old,path))
+            elif isdir:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed += self.add_tree(path)
+                elif mask & IN_DELETE:
+                    deleted.append(path + os.sep)
+            elif mask & IN_DELETE:
+                deleted.append(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_CLOSE_WRITE):
+                changed.append(path)
+
+        return changed,deleted + self.moved_out(time.time()),moved
+
+class PollingWatcher(object):
+    """Compares (size, mtime) snapshots of the folder tree, works everywhere"""
+
+    def __init__(self,PATH,POLL=2.0):
+        self.PATH = PATH
+        self.POLL = POLL
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for root,dirs,names in os.walk(self.PATH):
+            for name in names:
+                try:
+                    stat = os.stat(root + os.sep + name)
+                except OSError:
+                    continue
+                snapshot[root + os.sep + name] = (stat.st_size,stat.st_mtime)
+        return snapshot
+
+    def poll(self,timeout):
+        time.sleep(min(timeout,self.POLL))
+        snapshot = self.scan()
+        changed = [file for file,stat in snapshot.items() if self.snapshot.get(file) != stat]
+        deleted = [file for file in self.snapshot if file not in snapshot]
+        self.snapshot = snapshot
+        return changed,deleted,[]
+
+def make_watcher(PATH,POLL=2.0):
+    try:
+        return InotifyWatcher(PATH)
+    except (OSError,AttributeError):
+        # no inotify (not Linux, or out of watches)
+        return PollingWatcher(PATH,POLL)
+
+def file_state(file):
+    try:
+        stat = os.stat(file)
+        return (stat.st_size,stat.st_mtime)
+    except OSError:
+        return None
+
+def watch(generator,DEBOUNCE=5.0,POLL=2.0):
+
+    watcher = make_watcher(generator.INFOLDER,POLL)
+    print('... watching %s (%s)' % (generator.INFOLDER,watcher.__class__.__name__))
+
+    pending = {} # file -> (size/mtime, time it was last seen changing)
+    deleted = set()
+    renamed = {} # catalogued path -> new path of moved videos
+    origin = {} # new -> catalogued path, for moves of moved videos
+
+    def is_video(file):
+        return file[-4:] in generator.EXTENSIONS
+
+    while True:
+        changed,gone,moved = watcher.poll(min(POLL,DEBOUNCE))
+        now = time.time()
+
+        for old,new in moved:
+            if old.endswith(os.sep):
+                # folder moved within the tree, everything in it moves along
+                pairs = [(video,new + video[len(old):]) for video in generator.known_videos() if video.startswith(old)]
+                for file in [file for file in pending if file.startswith(old)]:
+                    pending[new + file[len(old):]] = pending.pop(file)
+            elif not is_video(old):
+                pairs = []
+                changed.append(new)
+            elif not is_video(new):
+                pairs = []
+                gone.append(old)
+            elif old in pending:
+                # not catalogued yet, the debounce goes on under the new name
+                pairs = []
+                pending[new] = pending.pop(old)
+            else:
+                pairs = [(old,new)]
+            for video,path in pairs:
+                video = origin.pop(video,video)
+                renamed[video] = path
+                origin[path] = video
+
+        for file in gone:
+            if file.endswith(os.sep):
+                # whole folder deleted or moved away
+                deleted.update(video for video in generator.known_videos() if video.startswith(file))
+            elif is_video(file):
+                deleted.add(file)
+                pending.pop(file,None)
+        for file in changed:
+            if is_video(file):
+                pending[file] = (file_state(file),now)
+                deleted.discard(file)
+
+        # still being written if size or mtime changed within DEBOUNCE seconds
+        ready = []
+        for file,(state,since) in list(pending.items()):
+            current = file_state(file)
+            if current != state:
+                pending[file] = (current,now)
+            elif current is None:
+                del pending[file]
+            elif now-since >= DEBOUNCE:
+                ready.append(file)
+                del pending[file]
+
+        if len(ready)>0 or len(deleted)>0 or len(renamed)>0:
+            print('\n... %i new or changed, %i deleted, %i moved videos' % (len(ready),len(deleted),len(renamed)))
+            generator.update(created=ready,deleted=sorted(deleted),moved=sorted(renamed.items()))
+            deleted = set()
+            renamed = {}
+            origin = {}
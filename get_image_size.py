@@ -35,6 +35,7 @@ ICO = types['ICO'] = 'ICO'
 JPEG = types['JPEG'] = 'JPEG'
 PNG = types['PNG'] = 'PNG'
 TIFF = types['TIFF'] = 'TIFF'
+WEBP = types['WEBP'] = 'WEBP'
 
 image_fields = ['path', 'type', 'file_size', 'width', 'height']
 
@@ -89,7 +90,7 @@ def get_image_metadata(file_path):
     with open(file_path, "rb") as input:
         height = -1
         width = -1
-        data = input.read(26)
+        data = input.read(30)
         msg = " raised while trying to decode as JPEG."
 
         if (size >= 10) and data[:6] in (b'GIF87a', b'GIF89a'):
@@ -111,6 +112,27 @@ def get_image_metadata(file_path):
             w, h = struct.unpack(">LL", data[8:16])
             width = int(w)
             height = int(h)
+        elif ((size >= 30) and data.startswith(b'RIFF')
+              and (data[8:12] == b'WEBP')):
+            # WebP, dimensions depend on the first chunk
+            imgtype = WEBP
+            chunk = data[12:16]
+            if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+                # lossy, 14 bit sizes after the frame start code
+                w, h = struct.unpack("<HH", data[26:30])
+                width = int(w) & 0x3fff
+                height = int(h) & 0x3fff
+            elif chunk == b'VP8L' and data[20:21] == b'\x2f':
+                # lossless, 14 bit sizes minus one packed after the signature
+                bits = struct.unpack("<I", data[21:25])[0]
+                width = (bits & 0x3fff) + 1
+                height = ((bits >> 14) & 0x3fff) + 1
+            elif chunk == b'VP8X':
+                # extended, 24 bit canvas sizes minus one
+                width = struct.unpack("<I", data[24:27] + b'\0')[0] + 1
+                height = struct.unpack("<I", data[27:30] + b'\0')[0] + 1
+            else:
+                raise UnknownImageFormat("Unknown WebP chunk " + repr(chunk))
         elif (size >= 2) and data.startswith(b'\377\330'):
             # JPEG
             imgtype = JPEG
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Cancelling a generation job leaves no process behind (Linux, uses /proc)"""
+
+import os
+import sys
+import time
+import pytest
+
+from VideoThumbJobs import GenerationJob
+
+# probes answer at once, frame extraction hangs like ffmpeg on a slow disk
+FAKE_FFMPEG = '''#!/bin/sh
+case "$*" in
+  *frames:v*|*vframes*) exec sleep 120 ;;
+esac
+echo "  Duration: 00:02:05.00, start: 0.000000, bitrate: 1200 kb/s" >&2
+echo "    Stream #0:0: Video: h264 (High), yuv420p, 640x360, 25 fps" >&2
+'''
+
+def process_table():
+    """pid -> (parent pid, state, command) of all processes"""
+    table = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        command = stat[stat.index('(')+1:stat.rindex(')')]
+        fields = stat[stat.rindex(')')+2:].split()
+        table[int(name)] = (int(fields[1]),fields[0],command)
+    return table
+
+def descendants(pid):
+    table = process_table()
+    found = set()
+    todo = [pid]
+    while len(todo)>0:
+        parent = todo.pop()
+        for child,(ppid,state,command) in table.items():
+            if ppid==parent and child not in found:
+                found.add(child)
+                todo.append(child)
+    return found
+
+def running(pids):
+    """pids that still exist and are not zombies"""
+    table = process_table()
+    return [pid for pid in pids if pid in table and table[pid][1]!='Z']
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),reason='reads /proc')
+def test_cancel_kills_workers_and_ffmpeg(tmp_path):
+    bin_folder = tmp_path / 'bin'
+    bin_folder.mkdir()
+    ffmpeg = bin_folder / 'ffmpeg'
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    videos = tmp_path / 'videos'
+    videos.mkdir()
+    for i in range(4):
+        (videos / ('video%i.mp4' % i)).write_bytes(os.urandom(1000 + i))
+
+    settings = {'INFOLDER':str(videos),'OUTPATH':str(tmp_path / 'out'),'FFMPEG_PATH':str(bin_folder) + os.sep,'NWORKERS':2}
+    job = GenerationJob(settings)
+    job.start()
+    try:
+        deadline = time.time() + 60
+        while time.time()<deadline:
+            pids = descendants(job.process.pid)
+            table = process_table()
+            if sum(table[pid][2]=='sleep' for pid in pids if pid in table)>=2:
+                break
+            time.sleep(0.2)
+        else:
+            pytest.fail('ffmpeg of the job did not start')
+    except BaseException:
+        job.cancel()
+        raise
+
+    job.cancel()
+    time.sleep(0.5)
+    assert running(pids) == []
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Memory admission keeps working when the measured peaks are small"""
+
+from VideoThumbMemory import MemoryBudget,estimate_job_memory,JOB_OVERHEAD,MIN_SCALE,MB
+
+def test_estimate_stays_bounded_below_after_tiny_peaks():
+    base = estimate_job_memory(3840,2160,3,20)
+    budget = MemoryBudget(base)
+    for _ in range(1000):
+        budget.observe(base,1)
+    assert budget.scale >= MIN_SCALE
+    estimate = budget.estimate(base)
+    assert estimate >= JOB_OVERHEAD + MIN_SCALE*(base-JOB_OVERHEAD)
+
+    # at the floor two such jobs still do not fit the memory of one unscaled estimate
+    budget.acquire(estimate)
+    assert not budget.fits(budget.estimate(base))
+
+def test_fixed_overhead_is_not_scaled():
+    budget = MemoryBudget(None)
+    budget.observe(JOB_OVERHEAD + 100*MB,JOB_OVERHEAD + 300*MB)
+    assert budget.estimate(JOB_OVERHEAD) == JOB_OVERHEAD
+    assert budget.estimate(JOB_OVERHEAD + 100*MB) > JOB_OVERHEAD + 100*MB